@@ -0,0 +1,200 @@
+"""Ingest pipeline benchmark on synthetic snapshot sequences.
+
+Measures read_json_from_file, process_query, save_results_to_db and read_json_from_directory
+against sqlite (and the PostgreSQL database in config.py with --postgres, which TRUNCATEs
+voyages and arrivals). Each stage reports throughput in port calls/s, latency per call and
+peak memory traced in a second, untimed pass. Results are saved to
+benchmarks/results/<commit>.json; --compare prints the change against an earlier result.
+
+Usage:
+    python benchmarks/bench_pipeline.py --port-calls 20000 --snapshots 5 --ata-changes 0.1
+    python benchmarks/bench_pipeline.py --postgres --compare benchmarks/results/1ca6850.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from common import quiet, sqlite_connection
+from synthetic import write_snapshot_sequence
+
+from portman_agent import (DATABASE_CONFIG, VoyageStateCache, get_db_connection, process_query,
+                           read_json_from_directory, read_json_from_file, save_results_to_db)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Throughput drop that is flagged when comparing with an earlier result
+REGRESSION_THRESHOLD = 0.10
+
+def git_commit():
+    """Return the short commit hash of the working tree, suffixed with -dirty for local changes."""
+    root = os.path.dirname(RESULTS_DIR)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+@contextlib.contextmanager
+def sqlite_database(directory):
+    """Fresh sqlite database file for one stage pass."""
+    path = os.path.join(directory, "bench.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite_connection(path)
+    yield conn
+    conn.close()
+
+@contextlib.contextmanager
+def postgres_database():
+    """Connection to the configured PostgreSQL database with emptied tables."""
+    conn = get_db_connection(DATABASE_CONFIG["dbname"])
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE voyages, arrivals;")
+    conn.commit()
+    cursor.close()
+    yield conn
+    conn.close()
+
+@contextlib.contextmanager
+def with_cache(prepare):
+    """Stage state of a database connection and a fresh VoyageStateCache."""
+    with prepare() as conn:
+        yield conn, VoyageStateCache(retention_days=100000)
+
+def run_calls(calls, state):
+    """Run each call with the stage state, return per-call latencies in seconds."""
+    latencies = []
+    with quiet():
+        for call in calls:
+            start = time.perf_counter()
+            call(state)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def measure(stage, backend, prepare, calls, port_calls, memory=True):
+    """Time one stage, then rerun it under tracemalloc for its peak memory."""
+    with prepare() as state:
+        latencies = run_calls(calls, state)
+
+    peak = None
+    if memory:
+        with prepare() as state:
+            tracemalloc.start()
+            run_calls(calls, state)
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+
+    seconds = sum(latencies)
+    result = {
+        "stage": stage,
+        "backend": backend,
+        "port_calls": port_calls,
+        "seconds": round(seconds, 4),
+        "port_calls_per_s": round(port_calls / seconds, 1) if seconds else None,
+        "latency_ms": {
+            "mean": round(1000 * statistics.mean(latencies), 2),
+            "p50": round(1000 * statistics.median(latencies), 2),
+            "max": round(1000 * max(latencies), 2)
+        },
+        "peak_memory_mb": round(peak, 1) if peak is not None else None
+    }
+    print(f"{stage:<28} {backend:<10} {result['port_calls_per_s'] or 0:>12.0f} {result['latency_ms']['mean']:>10.1f} "
+          f"{result['latency_ms']['max']:>10.1f} {result['peak_memory_mb'] or 0:>10.1f}")
+    return result
+
+def run_benchmarks(args, directory):
+    """Generate the snapshot sequence and measure every stage, return the result list."""
+    files = write_snapshot_sequence(directory, args.port_calls, args.snapshots, args.ata_changes, args.vessels, args.seed)
+    total = args.port_calls * args.snapshots
+    with quiet():
+        snapshots = [read_json_from_file(path) for path in files]
+        batches = [process_query(snapshot, None) for snapshot in snapshots]
+
+    backends = [("sqlite", lambda: sqlite_database(directory))]
+    if args.postgres:
+        backends.append(("postgres", postgres_database))
+
+    print(f"{args.snapshots} snapshots of {args.port_calls} port calls, {args.ata_changes:.0%} ata changes per snapshot")
+    print(f"{'stage':<28} {'backend':<10} {'port calls/s':>12} {'mean ms':>10} {'max ms':>10} {'peak MB':>10}")
+    memory = not args.no_memory
+    results = [
+        measure("read_json_from_file", "-", contextlib.nullcontext,
+                [lambda _, path=path: read_json_from_file(path) for path in files], total, memory),
+        measure("process_query", "-", contextlib.nullcontext,
+                [lambda _, snapshot=snapshot: process_query(snapshot, None) for snapshot in snapshots], total, memory)
+    ]
+    for backend, prepare in backends:
+        results.append(measure("save_results_to_db", backend, prepare,
+                               [lambda conn, batch=batch: save_results_to_db(batch, conn) for batch in batches], total, memory))
+        if args.cache:
+            results.append(measure("save_results_to_db+cache", backend, lambda prepare=prepare: with_cache(prepare),
+                                   [lambda state, batch=batch: save_results_to_db(batch, state[0], cache=state[1]) for batch in batches],
+                                   total, memory))
+        results.append(measure("read_json_from_directory", backend, prepare,
+                               [lambda conn: read_json_from_directory(directory, None, conn)], total, memory))
+    return results
+
+def compare(results, parameters, previous_path):
+    """Print throughput and memory ratios against an earlier result file."""
+    with open(previous_path, "r", encoding="utf-8") as file:
+        previous = json.load(file)
+    earlier = {(stage["stage"], stage["backend"]): stage for stage in previous["stages"]}
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    if previous["parameters"] != parameters:
+        print(f"Warning: parameters differ from the earlier run: {previous['parameters']}")
+    print(f"{'stage':<28} {'backend':<10} {'throughput':>12} {'memory':>10}")
+    for stage in results:
+        before = earlier.get((stage["stage"], stage["backend"]))
+        if not before or not before["port_calls_per_s"] or not stage["port_calls_per_s"]:
+            continue
+        speed = stage["port_calls_per_s"] / before["port_calls_per_s"]
+        memory = (stage["peak_memory_mb"] / before["peak_memory_mb"]
+                  if stage["peak_memory_mb"] and before["peak_memory_mb"] else None)
+        flag = "  REGRESSION" if speed < 1 - REGRESSION_THRESHOLD else ""
+        print(f"{stage['stage']:<28} {stage['backend']:<10} {speed:>11.2f}x {f'{memory:.2f}x' if memory else '-':>10}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest pipeline benchmark on synthetic snapshots")
+    parser.add_argument("--port-calls", type=int, default=20000, help="Port calls per snapshot")
+    parser.add_argument("--snapshots", type=int, default=5, help="Snapshots in the polled sequence")
+    parser.add_argument("--ata-changes", type=float, default=0.1, help="Fraction of port calls with a new ata per snapshot")
+    parser.add_argument("--vessels", type=int, help="Distinct IMO numbers (default: port calls / 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--postgres", action="store_true", help="Also benchmark the PostgreSQL database in config.py (truncates its tables)")
+    parser.add_argument("--cache", action="store_true", help="Also benchmark saving with the voyage state cache")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_benchmarks(args, directory)
+
+    commit = git_commit()
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "parameters": parameters,
+            "stages": results
+        }, file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        compare(results, parameters, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Read-path query times with sequential scans versus the schema-managed indexes.
+
+Fills voyages and arrivals with `--rows` synthetic port calls (one arrival each), times the
+portman_queries functions without secondary indexes, creates INDEXES and times them again.
+PostgreSQL (--postgres) uses a separate `portman_bench` schema of the configured database.
+
+Usage:
+    python benchmarks/bench_queries.py --rows 2000000
+    python benchmarks/bench_queries.py --rows 2000000 --postgres
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import quiet, sqlite_connection
+from synthetic import PORTS
+
+from portman_agent import DATABASE_CONFIG, INDEXES, create_database_and_tables, create_indexes, get_db_connection
+from portman_queries import get_arrivals, get_port_call_arrivals, get_vessel_route
+
+START = datetime(2015, 1, 1)
+STEP = timedelta(minutes=3)  # Time between consecutive synthetic port calls
+
+def index_names():
+    """Names of the indexes in INDEXES."""
+    return [statement.split("EXISTS ")[1].split(" ")[0] for statement in INDEXES]
+
+def fill_sqlite(conn, rows, vessels):
+    """Insert synthetic voyages and arrivals into a sqlite database."""
+    def voyages():
+        for i in range(1, rows + 1):
+            ts = START + STEP * i
+            ata = (ts + timedelta(minutes=10)).strftime("%Y-%m-%dT%H:%M:00.000Z")
+            yield (i, 9000000 + i % vessels, "70", f"Vessel {i % vessels}", PORTS[i % len(PORTS)], PORTS[(i // 7) % len(PORTS)],
+                   PORTS[(i // 3) % len(PORTS)], ts.isoformat(), ata, (ts + timedelta(hours=6)).isoformat(), "Area", "berth")
+    conn.executemany(
+        "INSERT INTO voyages (portCallId, imoLloyds, vesselTypeCode, vesselName, prevPort, portToVisit, nextPort, "
+        "eta, ata, atd, portAreaName, berthName) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", voyages()
+    )
+    conn.execute(
+        "INSERT INTO arrivals (id, portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName) "
+        "SELECT portCallId, portCallId, eta, NULL, ata, vesselName, portAreaName, berthName FROM voyages"
+    )
+    conn.commit()
+
+def fill_postgres(conn, rows, vessels):
+    """Create the portman_bench schema and fill it server-side with generate_series."""
+    cursor = conn.cursor()
+    cursor.execute("DROP SCHEMA IF EXISTS portman_bench CASCADE;")
+    cursor.execute("CREATE SCHEMA portman_bench;")
+    cursor.execute("CREATE TABLE portman_bench.voyages (LIKE public.voyages INCLUDING DEFAULTS, PRIMARY KEY (portCallId));")
+    cursor.execute("CREATE TABLE portman_bench.arrivals (LIKE public.arrivals, PRIMARY KEY (id));")
+    cursor.execute("SET search_path TO portman_bench;")
+    ports = "ARRAY[" + ", ".join(f"'{port}'" for port in PORTS) + "]"
+    cursor.execute(
+        f"INSERT INTO voyages (portCallId, imoLloyds, vesselTypeCode, vesselName, prevPort, portToVisit, nextPort, "
+        f"eta, ata, atd, portAreaName, berthName) "
+        f"SELECT i, 9000000 + i % {vessels}, '70', 'Vessel ' || i % {vessels}, ({ports})[1 + i % {len(PORTS)}], "
+        f"({ports})[1 + (i / 7) % {len(PORTS)}], ({ports})[1 + (i / 3) % {len(PORTS)}], "
+        f"ts, date_trunc('minute', ts + interval '10 minutes'), ts + interval '6 hours', 'Area', 'berth' "
+        f"FROM generate_series(1, {rows}) AS i, "
+        f"LATERAL (SELECT timestamp '{START.isoformat()}' + i * interval '{int(STEP.total_seconds())} seconds' AS ts) AS t;"
+    )
+    cursor.execute(
+        "INSERT INTO arrivals (id, portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName) "
+        "SELECT portCallId, portCallId, eta, NULL, ata, vesselName, portAreaName, berthName FROM voyages;"
+    )
+    conn.commit()
+    cursor.close()
+
+def analyze(conn):
+    """Refresh planner statistics."""
+    cursor = conn.cursor()
+    cursor.execute("ANALYZE;")
+    conn.commit()
+    cursor.close()
+
+def time_queries(conn, rows, vessels, repeat, seed):
+    """Median milliseconds per query function over `repeat` random parameters."""
+    rng = random.Random(seed)
+    windows = [START + STEP * rng.randrange(1, rows) for _ in range(repeat)]
+    queries = {
+        "get_vessel_route": [lambda imo=9000000 + rng.randrange(vessels): get_vessel_route(imo, conn) for _ in range(repeat)],
+        "get_arrivals (port, 1 day)": [
+            lambda since=since, port=rng.choice(PORTS): get_arrivals(port, since, since + timedelta(days=1), conn) for since in windows
+        ],
+        "get_port_call_arrivals": [lambda port_call_id=rng.randrange(1, rows): get_port_call_arrivals(port_call_id, conn) for _ in range(repeat)]
+    }
+    timings = {}
+    for name, calls in queries.items():
+        latencies = []
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        timings[name] = 1000 * statistics.median(latencies)
+    return timings
+
+def run(label, conn, rows, vessels, repeat, seed):
+    """Time the queries without and with indexes and print the comparison."""
+    cursor = conn.cursor()
+    for name in index_names():
+        cursor.execute(f"DROP INDEX IF EXISTS {name};")
+    conn.commit()
+    analyze(conn)
+    scan = time_queries(conn, rows, vessels, repeat, seed)
+
+    start = time.perf_counter()
+    create_indexes(cursor)
+    conn.commit()
+    build_time = time.perf_counter() - start
+    cursor.close()
+    analyze(conn)
+    indexed = time_queries(conn, rows, vessels, repeat, seed)
+
+    print(f"\n{label}: {rows} voyages and arrivals, {vessels} vessels, indexes built in {build_time:.1f}s")
+    print(f"{'query':<28} {'scan ms':>10} {'index ms':>10} {'speedup':>10}")
+    for name in scan:
+        print(f"{name:<28} {scan[name]:>10.2f} {indexed[name]:>10.2f} {scan[name] / indexed[name]:>9.0f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-path scan versus index benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--vessels", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20, help="Queries per function and phase")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--postgres", action="store_true", help="Also benchmark PostgreSQL (schema portman_bench of config.py's database)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite_connection(os.path.join(directory, "queries.db"))
+        fill_sqlite(conn, args.rows, args.vessels)
+        run("sqlite", conn, args.rows, args.vessels, args.repeat, args.seed)
+        conn.close()
+
+    if args.postgres:
+        with quiet():
+            create_database_and_tables()  # The benchmark tables copy the public schema
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+        try:
+            fill_postgres(conn, args.rows, args.vessels)
+            run("postgresql", conn, args.rows, args.vessels, args.repeat, args.seed)
+        finally:
+            cursor = conn.cursor()
+            cursor.execute("DROP SCHEMA IF EXISTS portman_bench CASCADE;")
+            conn.commit()
+            conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Read API latency under concurrent load versus querying the database directly.
+
+Fills a sqlite database with `--rows` synthetic port calls (one arrival each, as in
+bench_queries.py), warms a ReadCache from it and serves it with portman_api.serve from a
+separate process, so the clients do not compete with the server for the GIL. Each of
+`--clients` threads then sends `--requests` requests over a keep-alive connection,
+alternating the latest arrivals at a port and the port calls of a vessel. The same lookups
+are timed as SQL queries on one sqlite connection per thread. Prints p50/p95/p99 latency
+and the total requests per second of both.
+
+Usage:
+    python benchmarks/bench_read_api.py --rows 200000 --clients 16
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from bench_queries import fill_sqlite
+from common import quiet, sqlite_connection
+from synthetic import PORTS
+
+from portman_api import ReadCache, serve
+from portman_queries import run_query
+
+LATEST_ARRIVALS = (
+    "SELECT arrivals.portCallId, voyages.imoLloyds, arrivals.vesselName, voyages.portToVisit, arrivals.portAreaName,\n"
+    "    voyages.berthCode, arrivals.berthName, arrivals.eta, arrivals.old_ata, arrivals.ata\n"
+    "FROM arrivals JOIN voyages ON voyages.portCallId = arrivals.portCallId\n"
+    "WHERE voyages.portToVisit = %s ORDER BY arrivals.id DESC LIMIT %s;"
+)
+VESSEL_PORT_CALLS = "SELECT * FROM voyages WHERE imoLloyds = %s ORDER BY eta, portCallId;"
+
+def lookups(count, vessels, seed):
+    """Alternating ("arrivals", port) and ("vessel", imo) lookups."""
+    rng = random.Random(seed)
+    return [("arrivals", rng.choice(PORTS)) if i % 2 == 0 else ("vessel", 9000000 + rng.randrange(vessels)) for i in range(count)]
+
+def run_clients(clients, work):
+    """Run work(client number, latencies) in `clients` threads, return (latencies, wall seconds)."""
+    latencies = [[] for _ in range(clients)]
+    threads = [threading.Thread(target=work, args=(number, latencies[number])) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for client in latencies for latency in client], time.perf_counter() - start
+
+def http_client(port, limit, requests, vessels, seed):
+    """Client thread body sending the lookups to the read API."""
+    def work(number, latencies):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        for kind, value in lookups(requests, vessels, seed + number):
+            path = f"/arrivals?port={value}&limit={limit}" if kind == "arrivals" else f"/port-calls?imo={value}"
+            start = time.perf_counter()
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            assert response.status == 200
+        conn.close()
+    return work
+
+def database_client(path, limit, requests, vessels, seed):
+    """Client thread body running the lookups as SQL on its own connection."""
+    def work(number, latencies):
+        conn = sqlite_connection(path)
+        for kind, value in lookups(requests, vessels, seed + number):
+            start = time.perf_counter()
+            if kind == "arrivals":
+                run_query(LATEST_ARRIVALS, (value, limit), conn)
+            else:
+                run_query(VESSEL_PORT_CALLS, (value,), conn)
+            latencies.append(time.perf_counter() - start)
+        conn.close()
+    return work
+
+def run_server(path, rows, ready, stop):
+    """Server process: warm a ReadCache from the database, serve it until `stop` is set."""
+    conn = sqlite_connection(path)
+    cache = ReadCache(retention_days=100000, max_arrivals=rows)  # The synthetic port calls start in 2015
+    with quiet():
+        start = time.perf_counter()
+        cache.warm(conn)
+        warm_time = time.perf_counter() - start
+        server = serve(cache, 0)
+    conn.close()
+    ready.put((server.server_address[1], warm_time))
+    stop.wait()
+    server.shutdown()
+
+def report(label, latencies, wall):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{label:<10} {quantiles[49] * 1000:>8.2f} {quantiles[94] * 1000:>8.2f} {quantiles[98] * 1000:>8.2f} {len(latencies) / wall:>10.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Read API versus direct query latency benchmark")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--vessels", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per client")
+    parser.add_argument("--limit", type=int, default=100, help="Arrivals per request")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "read_api.db")
+        conn = sqlite_connection(path)
+        fill_sqlite(conn, args.rows, args.vessels)
+        conn.close()
+
+        ready = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        server = multiprocessing.Process(target=run_server, args=(path, args.rows, ready, stop))
+        server.start()
+        port, warm_time = ready.get()
+
+        print(f"{args.rows} port calls, cache warmed in {warm_time:.2f}s; {args.clients} clients x {args.requests} requests")
+        print(f"{'path':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'requests/s':>10}")
+        report("read API", *run_clients(args.clients, http_client(port, args.limit, args.requests, args.vessels, args.seed)))
+        report("database", *run_clients(args.clients, database_client(path, args.limit, args.requests, args.vessels, args.seed)))
+        stop.set()
+        server.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compare save_results_to_db write strategies on a large synthetic snapshot.
+
+Usage:
+    python benchmarks/bench_save_results.py --port-calls 20000
+    python benchmarks/bench_save_results.py --postgres   # also run against DATABASE_CONFIG
+"""
+import argparse
+
+from common import quiet, sqlite_connection, timed
+from synthetic import make_snapshot
+
+from portman_agent import DATABASE_CONFIG, get_db_connection, process_query, save_results_to_db
+
+def reset_postgres(conn):
+    """Empty the PostgreSQL tables between runs."""
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE voyages, arrivals;")
+    conn.commit()
+    cursor.close()
+
+def run(label, connect, strategies, results, batch_size, reset=None):
+    """Time a first (insert) and a second (update) save of the same results per strategy."""
+    print(f"\n{label}: {len(results)} port calls, batch size {batch_size}")
+    print(f"{'strategy':<12} {'insert s':>10} {'update s':>10} {'rows/s':>10}")
+    timings = {}
+    for strategy in strategies:
+        conn = connect()
+        if reset:
+            reset(conn)
+        with quiet():
+            insert_time, _ = timed(save_results_to_db, results, conn, strategy, batch_size)
+            update_time, _ = timed(save_results_to_db, results, conn, strategy, batch_size)
+        conn.close()
+        timings[strategy] = insert_time + update_time
+        print(f"{strategy:<12} {insert_time:>10.3f} {update_time:>10.3f} {2 * len(results) / (insert_time + update_time):>10.0f}")
+    baseline = timings[strategies[0]]
+    for strategy in strategies[1:]:
+        print(f"speedup {strategy} vs {strategies[0]}: {baseline / timings[strategy]:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="save_results_to_db write strategy benchmark")
+    parser.add_argument("--port-calls", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--postgres", action="store_true", help="Also benchmark the PostgreSQL database in config.py")
+    args = parser.parse_args()
+
+    with quiet():
+        results = process_query(make_snapshot(args.port_calls), None)
+
+    run("sqlite", sqlite_connection, ["row", "executemany", "values"], results, args.batch_size)
+    if args.postgres:
+        run("postgresql", lambda: get_db_connection(DATABASE_CONFIG["dbname"]),
+            ["row", "executemany", "values", "copy"], results, args.batch_size, reset_postgres)
+
+if __name__ == "__main__":
+    main()
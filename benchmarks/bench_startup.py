@@ -0,0 +1,94 @@
+"""Cold start time of one agent run up to its first API request.
+
+Each run is a fresh interpreter that imports portman_agent, parses the arguments, runs
+create_database_and_tables and creates the HTTP fetcher (the point where the first fetch
+starts). Prints the median milliseconds of each phase, the process wall time and the
+heavy modules loaded by the import alone. `--repo` times another checkout, e.g. a
+baseline made with `git worktree add /tmp/portman-base <commit>`; `--full-setup` drops
+the portman_schema table before every run so the complete setup DDL runs.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 20
+    python benchmarks/bench_startup.py --runs 20 --repo /tmp/portman-base
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import quiet
+
+HEAVY_MODULES = ("requests", "pg8000", "natsort", "schedule", "sqlite3", "http.server", "multiprocessing")
+
+CHILD = """
+import time
+start = time.perf_counter()
+import sys
+sys.path.insert(0, {repo!r})
+sys.argv = ["portman_agent.py"]
+import portman_agent
+imported = time.perf_counter()
+loaded = [name for name in {modules!r} if name in sys.modules]
+portman_agent.parse_arguments()
+parsed = time.perf_counter()
+portman_agent.create_database_and_tables()
+setup = time.perf_counter()
+portman_agent.get_fetcher()
+ready = time.perf_counter()
+import json
+print(json.dumps({{"import": imported - start, "arguments": parsed - imported, "setup": setup - parsed,
+                  "fetcher": ready - setup, "total": ready - start, "loaded": loaded}}))
+"""
+
+PHASES = ("import", "arguments", "setup", "fetcher", "total")
+
+def drop_schema_version():
+    """Make the next run execute the full database setup."""
+    from portman_agent import DATABASE_CONFIG, get_db_connection
+    with quiet():
+        conn = get_db_connection(DATABASE_CONFIG["dbname"])
+    if conn is None:
+        return
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS portman_schema;")
+    conn.commit()
+    conn.close()
+
+def run_once(repo):
+    """Time one cold start in a fresh interpreter, return (phase seconds, wall seconds)."""
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(repo=repo, modules=HEAVY_MODULES)],
+        cwd=repo, check=True, capture_output=True, text=True
+    ).stdout
+    wall = time.perf_counter() - start
+    return json.loads(output.strip().splitlines()[-1]), wall
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent cold start benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--repo", default=os.path.abspath(os.path.join(os.path.dirname(__file__), "../")), help="Checkout to time")
+    parser.add_argument("--full-setup", action="store_true", help="Drop portman_schema before each run")
+    args = parser.parse_args()
+
+    results = []
+    walls = []
+    for _ in range(args.runs):
+        if args.full_setup:
+            drop_schema_version()
+        phases, wall = run_once(os.path.abspath(args.repo))
+        results.append(phases)
+        walls.append(wall)
+
+    print(f"{args.repo}: {args.runs} runs{' with full setup' if args.full_setup else ''}")
+    print(f"{'phase':<12} {'median ms':>10}")
+    for phase in PHASES:
+        print(f"{phase:<12} {statistics.median(result[phase] for result in results) * 1000:>10.1f}")
+    print(f"{'process':<12} {statistics.median(walls) * 1000:>10.1f}")
+    print(f"Loaded by import: {', '.join(results[-1]['loaded']) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Peak memory of loading a snapshot file with json.load versus streaming it.
+
+Each mode runs in a fresh interpreter that reads a synthetic portnet file, processes it
+and saves it to a sqlite database, then reports its peak RSS.
+
+Usage:
+    python benchmarks/bench_streaming.py --size-mb 300
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import quiet, sqlite_connection
+from synthetic import write_snapshot_file
+
+def run_mode(mode, filepath, database):
+    """Process the file in this interpreter and print peak RSS in MB."""
+    import portman_agent
+    conn = sqlite_connection(database)
+    with quiet():
+        if mode == "load":
+            data = portman_agent.read_json_from_file(filepath)
+            results = portman_agent.process_query(data, None)
+            portman_agent.save_results_to_db(results, conn)
+        else:
+            portman_agent.stream_json_file_to_db(filepath, None, conn)
+    conn.close()
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming parser peak memory benchmark")
+    parser.add_argument("--size-mb", type=int, default=300)
+    parser.add_argument("--mode", choices=["load", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.file, args.database)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "portnet-synthetic.json")
+        entries = write_snapshot_file(filepath, size_mb=args.size_mb)
+        print(f"{os.path.getsize(filepath) / 1024 / 1024:.0f} MB file with {entries} port calls")
+        print(f"{'mode':<8} {'seconds':>8} {'peak RSS MB':>12}")
+        for mode in ("load", "stream"):
+            database = os.path.join(directory, f"{mode}.db")
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--file", filepath, "--database", database],
+                check=True, capture_output=True, text=True
+            ).stdout
+            print(f"{mode:<8} {time.perf_counter() - start:>8.1f} {float(output.split()[-1]):>12.0f}")
+
+if __name__ == "__main__":
+    main()
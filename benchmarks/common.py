@@ -0,0 +1,30 @@
+"""Shared helpers for the benchmark scripts."""
+import contextlib
+import io
+import os
+import sys
+import time
+
+# Make the project modules importable when running `python benchmarks/<script>.py`
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from portman_storage import connect_sqlite, create_tables
+
+def sqlite_connection(path=":memory:"):
+    """Open a sqlite3 connection with the portman schema."""
+    conn = connect_sqlite(path)
+    create_tables(conn.cursor(), sqlite=True)
+    conn.commit()
+    return conn
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the agent's log and arrival output while measuring."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def timed(func, *args, **kwargs):
+    """Run func and return (elapsed seconds, result)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
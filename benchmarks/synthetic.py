@@ -0,0 +1,141 @@
+"""Generator of synthetic Digitraffic port-call snapshots for benchmarks."""
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+PORTS = ["FIHEL", "FITKU", "FILAN", "FIMHQ", "FIKOK", "FIRAU", "FIOUL", "FIKTK", "FIPOR", "FIVAA", "FIHKO", "FIUKI"]
+FOREIGN_PORTS = ["SESTO", "EETLL", "DEHAM", "SEKPS", "PLGDY", "NLRTM", "DEROS", "SEGOT"]
+AGENTS = ["Viking Line Abp / Helsinki", "Finnlines Plc", "Tallink Silja Oy", "GAC Finland Oy", "Wilhelmsen Ships Service"]
+PORT_AREAS = [("PASSE", "Matkustajasatama"), ("VUOS", "Vuosaari"), ("LSATA", "Länsisatama"), ("EI", "Ei tiedossa")]
+VESSEL_TYPES = [20, 40, 50, 70, 80, 90]
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000+00:00"
+
+def format_timestamp(value):
+    """Format a datetime like the Digitraffic API does."""
+    return value.strftime(TIMESTAMP_FORMAT) if value else None
+
+def make_port_call(rng, port_call_id, imo, start):
+    """Build one synthetic port call entry with the same shape as the API returns."""
+    eta = start + timedelta(minutes=rng.randrange(0, 3 * 24 * 60))
+    ata = eta + timedelta(minutes=rng.randrange(-30, 90)) if rng.random() < 0.6 else None
+    etd = eta + timedelta(hours=rng.randrange(1, 30))
+    atd = etd + timedelta(minutes=rng.randrange(0, 60)) if ata and rng.random() < 0.5 else None
+    area_code, area_name = rng.choice(PORT_AREAS)
+    agent = rng.choice(AGENTS)
+    return {
+        "portCallId": port_call_id,
+        "portCallTimestamp": format_timestamp(start),
+        "customsReference": f"0/{port_call_id % 1000000}",
+        "portToVisit": rng.choice(PORTS),
+        "prevPort": rng.choice(FOREIGN_PORTS),
+        "nextPort": rng.choice(PORTS + FOREIGN_PORTS),
+        "domesticTrafficArrival": False,
+        "domesticTrafficDeparture": False,
+        "vesselName": f"Vessel {imo}",
+        "vesselNamePrefix": "ms",
+        "radioCallSign": f"OJ{imo % 100:02d}",
+        "imoLloyds": imo,
+        "mmsi": 230000000 + imo % 1000000,
+        "nationality": "FI",
+        "vesselTypeCode": rng.choice(VESSEL_TYPES),
+        "agentInfo": [
+            {"name": agent, "role": 1, "portCallDirection": "Arrival or whole PortCall", "ediNumber": "003701449838"},
+            {"name": agent.split(" / ")[0], "role": 2, "portCallDirection": "Arrival or whole PortCall", "ediNumber": "003701449838"}
+        ],
+        "imoInformation": [
+            {"imoGeneralDeclaration": "Arrival", "numberOfCrew": rng.randrange(5, 250), "numberOfPassangers": rng.randrange(0, 2500)},
+            {"imoGeneralDeclaration": "Departure", "numberOfCrew": rng.randrange(5, 250), "numberOfPassangers": rng.randrange(0, 2500)}
+        ],
+        "portAreaDetails": [{
+            "berthName": f"berth{rng.randrange(1, 20)}",
+            "portAreaCode": area_code,
+            "berthCode": f"b{rng.randrange(1, 20)}",
+            "portAreaName": area_name,
+            "eta": format_timestamp(eta),
+            "etaSource": "Agent",
+            "etd": format_timestamp(etd),
+            "etdSource": "Agent",
+            "ata": format_timestamp(ata),
+            "atd": format_timestamp(atd),
+            "arrivalDraught": 0.0,
+            "departureDraught": 0.0
+        }]
+    }
+
+def iter_synthetic_port_calls(port_calls, vessels=None, seed=0, first_port_call_id=3000000,
+                              start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Yield `port_calls` entries spread over `vessels` IMO numbers."""
+    rng = random.Random(seed)
+    vessels = vessels or max(1, port_calls // 3)
+    imos = [9000000 + rng.randrange(0, 999999) for _ in range(vessels)]
+    for i in range(port_calls):
+        yield make_port_call(rng, first_port_call_id + i, imos[i % vessels], start)
+
+def make_snapshot(port_calls, vessels=None, seed=0, first_port_call_id=3000000,
+                  start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Build a snapshot dict with `port_calls` entries spread over `vessels` IMO numbers."""
+    return {
+        "dataUpdatedTime": format_timestamp(start),
+        "portCalls": list(iter_synthetic_port_calls(port_calls, vessels, seed, first_port_call_id, start))
+    }
+
+def write_snapshot_file(filepath, port_calls=None, size_mb=None, seed=0, start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Write a portnet-style JSON file entry by entry, bounded by a port call count or a size in MB."""
+    limit = size_mb * 1024 * 1024 if size_mb else None
+    entries = iter_synthetic_port_calls(port_calls or 10 ** 9, max(1, (port_calls or 300000) // 3), seed, start=start)
+    written = 0
+    with open(filepath, "w", encoding="utf-8") as file:
+        file.write(f'{{\n  "dataUpdatedTime" : "{format_timestamp(start)}",\n  "portCalls" : [ ')
+        size = file.tell()
+        for entry in entries:
+            if limit and size >= limit:
+                break
+            text = (", " if written else "") + json.dumps(entry, ensure_ascii=False, indent=2)
+            file.write(text)
+            size += len(text.encode("utf-8"))
+            written += 1
+        file.write(" ]\n}\n")
+    return written
+
+def parse_timestamp(value):
+    """Parse a timestamp written by format_timestamp."""
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+def iter_snapshot_sequence(port_calls, snapshots, ata_change_fraction=0.1, vessels=None, seed=0,
+                           interval=timedelta(minutes=5), start=datetime(2025, 1, 1, tzinfo=timezone.utc)):
+    """Yield `snapshots` snapshots of the same port calls, polled `interval` apart.
+
+    In each snapshot after the first, `ata_change_fraction` of the port calls get a new
+    minute-level ata (and a new portCallTimestamp), so that many arrivals are detected.
+    Unchanged entries are shared between snapshots; do not modify them.
+    """
+    rng = random.Random(seed + 1)
+    snapshot = make_snapshot(port_calls, vessels, seed, start=start)
+    yield snapshot
+    for index in range(1, snapshots):
+        polled = start + interval * index
+        entries = list(snapshot["portCalls"])
+        for position in rng.sample(range(len(entries)), int(len(entries) * ata_change_fraction)):
+            entry = entries[position]
+            area = entry["portAreaDetails"][0]
+            previous = parse_timestamp(area["ata"] or area["eta"])
+            entries[position] = dict(
+                entry,
+                portCallTimestamp=format_timestamp(polled),
+                portAreaDetails=[dict(area, ata=format_timestamp(previous + timedelta(minutes=rng.randrange(1, 30))))]
+            )
+        snapshot = {"dataUpdatedTime": format_timestamp(polled), "portCalls": entries}
+        yield snapshot
+
+def write_snapshot_sequence(directory, port_calls, snapshots, ata_change_fraction=0.1, vessels=None, seed=0):
+    """Write a snapshot sequence as portnet-<timestamp>.json files, return their paths in order."""
+    paths = []
+    for snapshot in iter_snapshot_sequence(port_calls, snapshots, ata_change_fraction, vessels, seed):
+        polled = parse_timestamp(snapshot["dataUpdatedTime"])
+        path = os.path.join(directory, f"portnet-{polled.strftime('%Y%m%d%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file, ensure_ascii=False)
+        paths.append(path)
+    return paths
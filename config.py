@@ -2,9 +2,146 @@ import os
 
 # Default PostgreSQL settings
 DATABASE_CONFIG = {
+    "backend": os.getenv("DB_BACKEND", "postgresql"),  # postgresql or sqlite (see SQLITE_CONFIG)
     "dbname": os.getenv("DB_NAME", "portman"),
     "user": os.getenv("DB_USER", "postgres"),
     "password": os.getenv("DB_PASSWORD", "password"),
     "host": os.getenv("DB_HOST", "127.0.0.1"),
-    "port": int(os.getenv("DB_PORT", 5432))
+    "port": int(os.getenv("DB_PORT", 5432)),
+    "pool_min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+    "pool_max_size": int(os.getenv("DB_POOL_MAX_SIZE", 5)),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),  # Seconds to wait for a free connection
+    "pool_max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 600)),  # Seconds before idle connections above min size are closed
+    "connect_retries": int(os.getenv("DB_CONNECT_RETRIES", 5)),
+    "connect_backoff": float(os.getenv("DB_CONNECT_BACKOFF", 0.5))  # First retry delay in seconds, doubled per attempt
+}
+
+# SQLite backend (DB_BACKEND=sqlite) for hosts without PostgreSQL
+SQLITE_CONFIG = {
+    "path": os.getenv("SQLITE_PATH", "portman.db"),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # NORMAL is durable at checkpoints and crash-safe in WAL mode
+    "busy_timeout": float(os.getenv("SQLITE_BUSY_TIMEOUT", 30)),  # Seconds to wait for another writer's lock
+    "cache_kb": int(os.getenv("SQLITE_CACHE_KB", 65536)),  # Page cache per connection
+    "mmap_bytes": int(os.getenv("SQLITE_MMAP_BYTES", 256 * 1024 * 1024)),
+    "cached_statements": int(os.getenv("SQLITE_CACHED_STATEMENTS", 256))  # Prepared statements kept per connection
+}
+
+# Bulk write settings for save_results_to_db
+WRITE_CONFIG = {
+    "strategy": os.getenv("DB_WRITE_STRATEGY", "auto"),  # auto, copy, values, executemany or row
+    "batch_size": int(os.getenv("DB_BATCH_SIZE", 1000)),
+    "chunk_size": int(os.getenv("DB_CHUNK_SIZE", 10000))  # Results per transaction when streaming files
+}
+
+# In-memory voyage state cache used to skip unchanged port calls
+STATE_CACHE_CONFIG = {
+    "enabled": os.getenv("STATE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "retention_days": int(os.getenv("STATE_CACHE_RETENTION_DAYS", 7))
+}
+
+# Digitraffic port calls API
+API_CONFIG = {
+    "url": os.getenv("API_URL", "https://meri.digitraffic.fi/api/port-call/v1/port-calls"),
+    "delta": os.getenv("API_DELTA_MODE", "false").lower() in ("1", "true", "yes"),  # Only fetch port calls changed since the last poll
+    "timeout": int(os.getenv("API_TIMEOUT", 60)),
+    "state_file": os.getenv("API_STATE_FILE")  # Keeps ETag and delta position between runs
+}
+
+# Daemon mode (--daemon)
+DAEMON_CONFIG = {
+    "interval": int(os.getenv("POLL_INTERVAL_SECONDS", 300))
+}
+
+# Several agents sharing the work through PostgreSQL advisory-lock leases (--cluster)
+CLUSTER_CONFIG = {
+    "enabled": os.getenv("CLUSTER_MODE", "false").lower() in ("1", "true", "yes"),
+    "partitions": int(os.getenv("CLUSTER_PARTITIONS", 16)),
+    "partition_by": os.getenv("CLUSTER_PARTITION_BY", "port_call"),  # port_call (portCallId) or port (portToVisit)
+    "lock_namespace": int(os.getenv("CLUSTER_LOCK_NAMESPACE", 1886221678))  # First key of the advisory locks, same for all agents
+}
+
+# Runtime metrics (--metrics-port / --metrics-json)
+METRICS_CONFIG = {
+    "port": int(os.getenv("METRICS_PORT", 0)),  # Serve Prometheus metrics on this port, 0 disables
+    "host": os.getenv("METRICS_HOST", "127.0.0.1"),
+    "json_file": os.getenv("METRICS_JSON_FILE")  # Write a JSON snapshot after every run or poll
+}
+METRICS_CONFIG["enabled"] = bool(METRICS_CONFIG["port"] or METRICS_CONFIG["json_file"])
+
+# Profiling of the metrics stages (--profile or SIGUSR1 on a daemon)
+PROFILE_CONFIG = {
+    "directory": os.getenv("PROFILE_DIR"),  # Profile the run (every poll with --daemon) into this directory
+    "signal_directory": os.getenv("PROFILE_SIGNAL_DIR", "profiles"),  # Output of polls profiled on SIGUSR1
+    "sample_interval": float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005)),  # Seconds between stack samples
+    "trace_frames": int(os.getenv("PROFILE_TRACE_FRAMES", 1)),  # Frames stored per traced allocation
+    "top": int(os.getenv("PROFILE_TOP", 30))  # Functions and allocation sites per stage report
+}
+
+# Read API serving recent voyages and arrivals from memory
+READ_API_CONFIG = {
+    "port": int(os.getenv("READ_API_PORT", 0)),  # 0 disables the read API
+    "host": os.getenv("READ_API_HOST", "127.0.0.1"),
+    "retention_days": int(os.getenv("READ_API_RETENTION_DAYS", 7)),  # Keep port calls departed within this window
+    "max_arrivals": int(os.getenv("READ_API_MAX_ARRIVALS", 10000)),  # Newest arrivals kept in memory
+    "default_limit": int(os.getenv("READ_API_DEFAULT_LIMIT", 100))  # Arrivals per response without ?limit=
+}
+
+# Arrival events emitted by a background worker
+EVENTS_CONFIG = {
+    "outputs": [name.strip() for name in os.getenv("EVENT_OUTPUTS", "stdout").split(",") if name.strip()],  # stdout, jsonl, webhook
+    "jsonl_file": os.getenv("EVENT_JSONL_FILE"),
+    "webhook_url": os.getenv("EVENT_WEBHOOK_URL"),
+    "webhook_timeout": float(os.getenv("EVENT_WEBHOOK_TIMEOUT", 10)),
+    "queue_size": int(os.getenv("EVENT_QUEUE_SIZE", 10000)),
+    "batch_size": int(os.getenv("EVENT_BATCH_SIZE", 100)),
+    "flush_interval": float(os.getenv("EVENT_FLUSH_INTERVAL", 0.5)),  # Seconds to wait for a batch to fill
+    "overflow": os.getenv("EVENT_OVERFLOW", "block")  # block (backpressure) or drop when the queue is full
+}
+
+# Per-IMO byte-range index of --input-dir snapshots, used for --imo runs
+INDEX_CONFIG = {
+    "enabled": os.getenv("SNAPSHOT_INDEX_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "file": os.getenv("SNAPSHOT_INDEX_FILE", ".portman-index.json")  # Stored in the input directory
+}
+
+# Deduplicated snapshot archives (portman_archive.py)
+ARCHIVE_CONFIG = {
+    "compresslevel": int(os.getenv("ARCHIVE_COMPRESSLEVEL", 6))  # gzip level 1 (fast) - 9 (small)
+}
+
+# Asyncio poller (portman_poller.py)
+POLLER_CONFIG = {
+    "slices": os.getenv("POLLER_SLICES", ""),  # e.g. "locode=FIHEL;locode=FITKU;imo=9606900", empty polls all port calls
+    "concurrency": int(os.getenv("POLLER_CONCURRENCY", 4)),  # Slices fetched at the same time
+    "timeout": int(os.getenv("POLLER_TIMEOUT", 30)),  # Seconds per request
+    "retries": int(os.getenv("POLLER_RETRIES", 2)),  # Extra attempts per slice and cycle
+    "retry_backoff": float(os.getenv("POLLER_RETRY_BACKOFF", 1.0)),  # Seconds, doubled after each attempt
+    "interval": int(os.getenv("POLLER_INTERVAL_SECONDS", 300)),
+    "queue_size": int(os.getenv("POLLER_QUEUE_SIZE", 10)),  # Fetched cycles waiting for formatting
+    "diff": os.getenv("POLLER_DIFF_MODE", "false").lower() in ("1", "true", "yes"),  # Only print changed port calls
+    "state_file": os.getenv("POLLER_STATE_FILE")  # Keeps the diff state between restarts
+}
+
+# PostgreSQL range partitioning of voyages (by portCallId) and arrivals (monthly by ata), new databases only
+PARTITION_CONFIG = {
+    "enabled": os.getenv("PARTITIONING_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "months_ahead": int(os.getenv("PARTITION_MONTHS_AHEAD", 3)),  # Upcoming monthly arrivals partitions
+    "voyage_partition_size": int(os.getenv("VOYAGE_PARTITION_SIZE", 100000)),  # portCallIds per voyages partition
+    "voyage_partitions_ahead": int(os.getenv("VOYAGE_PARTITIONS_AHEAD", 2)),
+    "retention_months": int(os.getenv("PARTITION_RETENTION_MONTHS", 24)),
+    "retention_action": os.getenv("PARTITION_RETENTION_ACTION", "archive"),  # archive (move to archive_schema), detach or drop
+    "archive_schema": os.getenv("PARTITION_ARCHIVE_SCHEMA", "portman_archive")
+}
+
+# On-disk spool between polls and database writes, so snapshots survive database outages
+SPOOL_CONFIG = {
+    "enabled": os.getenv("SPOOL_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "directory": os.getenv("SPOOL_DIR", ".portman-spool"),
+    "segment_bytes": int(os.getenv("SPOOL_SEGMENT_BYTES", 64 * 1024 * 1024)),  # Segment file size before rotating
+    "fsync": os.getenv("SPOOL_FSYNC", "true").lower() in ("1", "true", "yes"),
+    "queue_size": int(os.getenv("SPOOL_QUEUE_SIZE", 100)),  # Snapshots handed to the writer in memory
+    "max_batches": int(os.getenv("SPOOL_MAX_BATCHES", 1000)),  # Snapshots per coalesced database transaction
+    "retry_interval": float(os.getenv("SPOOL_RETRY_INTERVAL", 5)),  # Seconds between flushes while the database is down
+    "close_timeout": float(os.getenv("SPOOL_CLOSE_TIMEOUT", 30))  # Seconds to wait for the writer at shutdown
 }
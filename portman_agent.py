@@ -1,29 +1,56 @@
-import sqlite3
-import requests
-import pg8000
-from datetime import datetime
-import schedule
+from datetime import date, datetime, timedelta
 import time
 import os
 import argparse
 import json
+import io
 import glob
-import natsort
-from config import DATABASE_CONFIG
-
-def log(message):
-    """Log a message with a timestamp."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {message}")
-
-def job():
-    """Function that runs every 5 minutes."""
-    log("Fetching new data...")
-    main()  # Calls the existing main function
+import itertools
+import collections
+import signal
+import threading
+from config import DATABASE_CONFIG, WRITE_CONFIG, STATE_CACHE_CONFIG, DAEMON_CONFIG, CLUSTER_CONFIG, METRICS_CONFIG, PROFILE_CONFIG, READ_API_CONFIG, INDEX_CONFIG, PARTITION_CONFIG, SPOOL_CONFIG, SQLITE_CONFIG
+from portman_fetch import NOT_MODIFIED, PortCallFetcher
+from portman_index import SnapshotIndex, iter_indexed_entries
+from portman_partitions import maintain_partitions
+from portman_batch import PortCallBatch
+from portman_events import ArrivalSink, arrival_event
+from portman_log import log
+from portman_metrics import metrics
+from portman_pool import ConnectionPool
+from portman_spool import Spool, SpoolWriter, UnwritableBatches
+from portman_storage import (
+    INDEXES, SCHEMA_VERSION, connect_sqlite, create_arrivals_unique_index, create_indexes, create_tables, is_sqlite_connection,
+    is_transient_error, schema_is_current, using_sqlite
+)
+from portman_stream import iter_port_calls
+
+VOYAGE_COLUMNS = (
+    "portCallId", "imoLloyds", "vesselTypeCode", "vesselName", "prevPort",
+    "portToVisit", "nextPort", "agentName", "shippingCompany", "eta", "ata", "portAreaCode",
+    "portAreaName", "berthCode", "berthName", "etd", "atd",
+    "passengersOnArrival", "passengersOnDeparture", "crewOnArrival", "crewOnDeparture"
+)
+
+ARRIVAL_COLUMNS = ("portCallId", "eta", "old_ata", "ata", "vesselName", "portAreaName", "berthName")
+
+WRITE_STRATEGIES = ("auto", "row", "executemany", "values", "copy")
+
+# Upper bound for bind parameters in one statement (SQLite default is 32766, PostgreSQL 65535)
+MAX_STATEMENT_PARAMS = 32000
+
+ATA_INDEX = VOYAGE_COLUMNS.index("ata")
+ATD_INDEX = VOYAGE_COLUMNS.index("atd")
+TIMESTAMP_INDEXES = frozenset(VOYAGE_COLUMNS.index(column) for column in ("eta", "etd", "atd"))
 
 def get_db_connection(dbName):
-    """Establish and return a database connection to a specified database."""
+    """Establish and return a database connection to a specified database.
+
+    Only used for one-off connections such as the 'postgres' maintenance database;
+    connections to the portman database come from get_pool().
+    """
     try:
+        import pg8000
         conn = pg8000.connect(
             database=dbName,
             user=DATABASE_CONFIG["user"],
@@ -36,132 +63,160 @@ def get_db_connection(dbName):
         log(f"Error connecting to database '{dbName}': {e}")
         return None
 
-def get_tracked_vessels():
-    """Get IMO numbers to track from environment variables or command-line arguments."""
-    parser = argparse.ArgumentParser(description="Portman Tracking Options")
-    parser.add_argument("--imo", help="Comma-separated list of IMO numbers to track")
-    args = parser.parse_args()
-
-    # Read from command-line argument first
-    if args.imo:
-        tracked_set = set(map(int, args.imo.split(",")))
-        log(f"Tracking vessels from CLI argument: {tracked_set}")
-        return tracked_set
-
-    # Fallback to environment variable
-    tracked_env = os.getenv("TRACKED_VESSELS")
-    if tracked_env:
-        tracked_set = set(map(int, tracked_env.split(",")))
-        log(f"Tracking vessels from ENV variable: {tracked_set}")
-        return tracked_set
+pool = None  # ConnectionPool shared by all database writes of this process
 
-    log("No vessel filtering applied. Tracking all vessels.")
-    return None  # No filtering if not set
+def get_pool():
+    """Return the process-wide connection pool for the portman database, creating it on first use."""
+    global pool
+    if pool is None:
+        if using_sqlite():
+            pool = ConnectionPool(SQLITE_CONFIG["path"], connect=connect_sqlite)
+        else:
+            pool = ConnectionPool(DATABASE_CONFIG["dbname"])
+    return pool
 
+def checkout_connection():
+    """Check out a pooled connection to the portman database, None if the database is unreachable."""
+    try:
+        return get_pool().checkout()
+    except Exception as e:
+        log(f"Error connecting to database '{DATABASE_CONFIG["dbname"]}': {e}")
+        return None
 
 def create_database_and_tables():
-    """Create the database and the necessary tables if they don't exist."""
+    """Create the database and the necessary tables if they don't exist.
+
+    Skipped when the schema version recorded by a previous run is current. With the
+    SQLite backend the database file is created by opening it.
+    """
     try:
         log("Checking if database and tables exist...")
-
-        # Connect to PostgreSQL system database to check existence
-        conn = get_db_connection("postgres")
-        if conn is None:
+        sqlite = using_sqlite()
+        try:
+            with get_pool().connection() as conn:
+                cursor = conn.cursor()
+                current = schema_is_current(cursor, sqlite)
+                conn.rollback()
+                cursor.close()
+        except Exception:
+            current = False  # The database may not exist yet, the setup below reports real errors
+        if current:
+            log(f"Database schema version {SCHEMA_VERSION} is current, skipping setup.")
             return
-        conn.autocommit = True
-        cursor = conn.cursor()
-
-        # Create database if it doesn't exist
-        db_name = DATABASE_CONFIG["dbname"]
-        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_name,))
-        if not cursor.fetchone():
-            log("Database '" +  db_name + "' does not exist. Creating...")
-            cursor.execute(f"CREATE DATABASE {db_name};")
-        cursor.close()
-        conn.close()
 
-        # Connect to the created database
-        conn = get_db_connection(db_name)
-        if conn is None:
-            return
-        cursor = conn.cursor()
-
-        # Create the 'voyages' table
-        create_voyages_table = """
-        CREATE TABLE IF NOT EXISTS voyages (
-            portCallId INTEGER PRIMARY KEY,
-            imoLloyds INTEGER,
-            vesselTypeCode TEXT,
-            vesselName TEXT,
-            prevPort TEXT,
-            portToVisit TEXT,
-            nextPort TEXT,
-            agentName TEXT,
-            shippingCompany TEXT,
-            eta TIMESTAMP NULL,
-            ata TIMESTAMP NULL,
-            portAreaCode TEXT,
-            portAreaName TEXT,
-            berthCode TEXT,
-            berthName TEXT,
-            etd TIMESTAMP NULL,
-            atd TIMESTAMP NULL,
-            passengersOnArrival INTEGER DEFAULT 0,
-            passengersOnDeparture INTEGER DEFAULT 0,
-            crewOnArrival INTEGER DEFAULT 0,
-            crewOnDeparture INTEGER DEFAULT 0,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        cursor.execute(create_voyages_table)
-
-        # Create the 'arrivals' table
-        create_arrivals_table = """
-        CREATE TABLE IF NOT EXISTS arrivals (
-            id SERIAL PRIMARY KEY,
-            portCallId INTEGER,
-            eta TIMESTAMP NULL,
-            old_ata TIMESTAMP NULL,
-            ata TIMESTAMP NOT NULL,
-            vesselName TEXT,
-            portAreaName TEXT,
-            berthName TEXT,
-            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        cursor.execute(create_arrivals_table)
+        if not sqlite:
+            # Connect to PostgreSQL system database to check existence
+            conn = get_db_connection("postgres")
+            if conn is None:
+                return
+            conn.autocommit = True
+            cursor = conn.cursor()
+
+            # Create database if it doesn't exist
+            db_name = DATABASE_CONFIG["dbname"]
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_name,))
+            if not cursor.fetchone():
+                log("Database '" +  db_name + "' does not exist. Creating...")
+                cursor.execute(f"CREATE DATABASE {db_name};")
+            cursor.close()
+            conn.close()
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # Use a pooled connection to the created database
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            if not sqlite:
+                from portman_cluster import lock_maintenance
+                lock_maintenance(cursor, wait=True)  # Agents starting together set up the schema one after another
+            create_tables(cursor, sqlite)
+            conn.commit()
+            cursor.close()
         log("Database and tables setup complete.")
     except Exception as e:
         log(f"Error setting up database and tables: {e}")
 
+def create_cluster_index():
+    """Create the unique arrivals index agents in cluster mode rely on, removing duplicate arrivals first.
+
+    Only runs with --cluster: outside cluster mode a port call arriving again at an earlier
+    ata is recorded again, which the index prevents. Skipped while another agent holds the
+    maintenance lock, i.e. is creating it.
+    """
+    from portman_cluster import lock_maintenance
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            if not lock_maintenance(cursor):
+                conn.rollback()
+                cursor.close()
+                log("Another agent is creating the unique arrivals index, skipping.")
+                return
+            removed = create_arrivals_unique_index(cursor)
+            conn.commit()
+            cursor.close()
+        if removed:
+            log(f"Removed {removed} arrivals recorded more than once for the same port call and ata.")
+    except Exception as e:
+        metrics.increment("errors")
+        log(f"Error creating the unique arrivals index for cluster mode, duplicate arrivals are possible: {e}")
+
 def parse_arguments():
     """Parse command-line arguments and environment variables."""
     parser = argparse.ArgumentParser(description="Portman JSON Input Options")
     parser.add_argument("--input-file", help="Path to a JSON input file")
     parser.add_argument("--input-dir", help="Directory containing JSON files (portnet*.json)")
     parser.add_argument("--imo", help="Comma-separated list of IMO numbers to track")
+    parser.add_argument("--write-strategy", choices=WRITE_STRATEGIES, help="Bulk write strategy for the database")
+    parser.add_argument("--batch-size", type=int, help="Number of rows per database write batch")
+    parser.add_argument("--workers", type=int, help="Worker processes decoding --input-dir files in parallel")
+    parser.add_argument("--coalesce", action="store_true", help="Fold all --input-dir files in memory and write them in one transaction")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and poll the API on a fixed-rate schedule")
+    parser.add_argument("--interval", type=int, help="Seconds between polls in daemon mode")
+    parser.add_argument("--cluster", action="store_true", help="In daemon mode, share the polled port calls with other agents through PostgreSQL advisory-lock leases")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-json", help="Write a JSON metrics snapshot to this file after each run or poll")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR", help="Write CPU and allocation profiles of the stages to DIR (of each poll with --daemon)")
+    parser.add_argument("--api-port", type=int, help="Serve recent voyages and arrivals from memory on this local port")
+    parser.add_argument("--no-index", action="store_true", help="Read --input-dir snapshots in full instead of using the per-IMO index")
     args = parser.parse_args()
 
+    if args.write_strategy:
+        WRITE_CONFIG["strategy"] = args.write_strategy
+    if args.batch_size:
+        WRITE_CONFIG["batch_size"] = args.batch_size
+    if args.metrics_port:
+        METRICS_CONFIG["port"] = args.metrics_port
+    if args.metrics_json:
+        METRICS_CONFIG["json_file"] = args.metrics_json
+    if args.profile:
+        PROFILE_CONFIG["directory"] = args.profile
+    if args.api_port:
+        READ_API_CONFIG["port"] = args.api_port
+    if args.no_index:
+        INDEX_CONFIG["enabled"] = False
+    if args.cluster:
+        CLUSTER_CONFIG["enabled"] = True
+    metrics.enabled = bool(METRICS_CONFIG["port"] or METRICS_CONFIG["json_file"])
+
     return {
         "input_file": args.input_file or os.getenv("INPUT_FILE"),
         "input_dir": args.input_dir or os.getenv("INPUT_DIR"),
-        "tracked_vessels": set(map(int, args.imo.split(","))) if args.imo else set(map(int, os.getenv("TRACKED_VESSELS", "").split(","))) if os.getenv("TRACKED_VESSELS") else None
+        "tracked_vessels": set(map(int, args.imo.split(","))) if args.imo else set(map(int, os.getenv("TRACKED_VESSELS", "").split(","))) if os.getenv("TRACKED_VESSELS") else None,
+        "workers": args.workers or int(os.getenv("INPUT_WORKERS", 1)),
+        "coalesce": args.coalesce or os.getenv("INPUT_COALESCE", "false").lower() in ("1", "true", "yes"),
+        "daemon": args.daemon or os.getenv("DAEMON_MODE", "false").lower() in ("1", "true", "yes"),
+        "interval": args.interval or DAEMON_CONFIG["interval"]
     }
 
-def get_json_source(input_file, input_dir, tracked_vessels):
+def get_json_source(input_file, input_dir, tracked_vessels, cache=None, workers=1, coalesce=False):
     """Determine JSON data source: single file or directory of files."""
     if input_file:
-        log(f"Reading JSON from file: {input_file}")
-        return read_json_from_file(input_file)
+        log(f"Streaming JSON from file: {input_file}")
+        stream_json_file_to_db(input_file, tracked_vessels, cache=cache)
+        return None  # Processing is already handled
 
     elif input_dir:
         log(f"Reading JSON files from directory: {input_dir}")
-        read_json_from_directory(input_dir, tracked_vessels)  # Now processes files one by one
+        read_json_from_directory(input_dir, tracked_vessels, cache=cache, workers=workers, coalesce=coalesce)  # Now processes files one by one
         return None  # Processing is already handled
 
     log("No input file or directory specified. Fetching from API instead.")
@@ -170,14 +225,23 @@ def get_json_source(input_file, input_dir, tracked_vessels):
 def read_json_from_file(filepath):
     """Read JSON data from a specified file."""
     try:
-        with open(filepath, "r", encoding="utf-8") as file:
+        with metrics.stage("read_file"), open(filepath, "r", encoding="utf-8") as file:
             return json.load(file)
     except Exception as e:
+        metrics.increment("errors")
         log(f"Error reading JSON file {filepath}: {e}")
         return None
 
-def read_json_from_directory(directory, tracked_vessels, conn=None):
-    """Read and process each JSON file separately, saving its data to the database."""
+def read_json_from_directory(directory, tracked_vessels, conn=None, cache=None, workers=1, coalesce=False):
+    """Read and process each JSON file separately, saving its data to the database.
+
+    With more than one worker, files are decoded and processed in a process pool while
+    this process saves the results one file at a time in natural sort order. When tracking
+    vessels, the directory's SnapshotIndex is brought up to date and only the entries of
+    the tracked vessels are decoded; files without them are skipped. With `coalesce`, all
+    files are folded into a CoalescedReplay and written in one transaction at the end.
+    """
+    import natsort
     try:
         file_pattern = os.path.join(directory, "portnet*.json")  # Match 'portnet*.json'
         files = glob.glob(file_pattern)
@@ -185,259 +249,949 @@ def read_json_from_directory(directory, tracked_vessels, conn=None):
 
         log(f"Found {len(sorted_files)} matching JSON files in {directory}: {sorted_files}")
 
+        index = None
+        if tracked_vessels and INDEX_CONFIG["enabled"]:
+            with metrics.stage("index"):
+                index = SnapshotIndex(directory)
+                indexed = index.update(sorted_files)
+            log(f"Snapshot index up to date, {indexed} new or changed files indexed.")
+
+        replay = CoalescedReplay() if coalesce else None
+        if workers and workers > 1:
+            ingest_files_in_parallel(sorted_files, tracked_vessels, conn, cache, workers, index, replay)
+            if replay is not None:
+                save_coalesced_replay(replay, conn, cache)
+            return
+
         for filepath in sorted_files:
             try:
+                ranges = index.ranges(filepath, tracked_vessels) if index else None
+                if ranges == []:
+                    log(f"Skipping file {filepath}, no tracked vessels in it.")
+                    continue
                 log(f"Processing file: {filepath}")
-                with open(filepath, "r", encoding="utf-8") as file:
-                    data = json.load(file)
-
-                if "portCalls" in data and isinstance(data["portCalls"], list):
-                    results = process_query(data, tracked_vessels)
-                    save_results_to_db(results, conn)  # Save after processing each file
-                    log(f"Finished processing {filepath}, {len(results)} voyages saved.")
-                else:
-                    log(f"Skipping file {filepath}: No valid 'portCalls' data found.")
+                saved = stream_json_file_to_db(filepath, tracked_vessels, conn, cache, ranges, replay)
+                log(f"Finished processing {filepath}, {saved} voyages {'folded' if replay else 'saved'}.")
 
             except Exception as e:
+                metrics.increment("errors")
                 log(f"Skipping file {filepath} due to error: {e}")
 
+        if replay is not None:
+            save_coalesced_replay(replay, conn, cache)
+
     except Exception as e:
+        metrics.increment("errors")
         log(f"Error processing JSON directory {directory}: {e}")
 
 
+def iter_file_entries(filepath, ranges=None):
+    """Yield the port calls of a snapshot file, only those at the given byte ranges if any."""
+    return iter_indexed_entries(filepath, ranges) if ranges is not None else iter_port_calls(filepath)
+
+def process_json_file(filepath, tracked_vessels, ranges=None):
+    """Decode and process one snapshot file, run in worker processes."""
+    return PortCallBatch.from_rows(iter_port_call_rows(iter_file_entries(filepath, ranges), tracked_vessels))
+
+def ingest_files_in_parallel(sorted_files, tracked_vessels, conn, cache, workers, index=None, replay=None):
+    """Process files in a process pool and save their results strictly in the given order."""
+    import concurrent.futures
+    import multiprocessing
+    log(f"Processing files with {workers} worker processes.")
+    # Fork from a clean server process, this one may run event, metrics or daemon threads
+    context = multiprocessing.get_context("forkserver")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        files = iter(sorted_files)
+        pending = collections.deque()
+
+        def submit_next():
+            for filepath in files:
+                ranges = index.ranges(filepath, tracked_vessels) if index else None
+                if ranges == []:
+                    log(f"Skipping file {filepath}, no tracked vessels in it.")
+                    continue
+                pending.append((filepath, executor.submit(process_json_file, filepath, tracked_vessels, ranges)))
+                return
+
+        # Keep a bounded number of processed files waiting for the writer
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            filepath, future = pending.popleft()
+            submit_next()
+            try:
+                results = future.result()
+                log(f"Saving file: {filepath}")
+                saved = save_results_in_chunks(results, conn, cache, replay=replay)
+                log(f"Finished processing {filepath}, {saved} voyages {'folded' if replay else 'saved'}.")
+            except Exception as e:
+                metrics.increment("errors")
+                log(f"Skipping file {filepath} due to error: {e}")
+
+def stream_json_file_to_db(filepath, tracked_vessels, conn=None, cache=None, ranges=None, replay=None):
+    """Stream the portCalls of a JSON file (or the entries at `ranges`) into the database without loading the whole file."""
+    log(f"Tracking only these vessels: {tracked_vessels}" if tracked_vessels else "Tracking all vessels.")
+    rows = iter_port_call_rows(iter_file_entries(filepath, ranges), tracked_vessels)
+    return save_results_in_chunks(rows, conn, cache, replay=replay)
+
+def save_results_in_chunks(results, conn=None, cache=None, chunk_size=None, replay=None):
+    """Save a PortCallBatch or an iterable of result rows in chunks of `chunk_size`, returning the number of results saved.
+
+    With a CoalescedReplay the chunks are folded into it instead of saved.
+    """
+    chunk_size = chunk_size or WRITE_CONFIG["chunk_size"]
+    if replay is not None:
+        save = replay.add
+    elif conn is None:
+        conn = checkout_connection()
+        if conn is None:
+            return 0
+        try:
+            return save_results_in_chunks(results, conn, cache, chunk_size)
+        finally:
+            get_pool().checkin(conn)
+    else:
+        def save(chunk):
+            save_results_to_db(chunk, conn, cache=cache)
+
+    if isinstance(results, PortCallBatch):
+        for start in range(0, len(results), chunk_size):
+            save(results[start:start + chunk_size])
+        return len(results)
+
+    results = iter(results)
+    total = 0
+    while True:
+        with metrics.stage("parse"):  # Decoding and processing of streamed entries
+            chunk = PortCallBatch.from_rows(itertools.islice(results, chunk_size))
+        if not chunk:
+            break
+        save(chunk)
+        total += len(chunk)
+    return total
+
+fetcher = None  # PortCallFetcher shared by all polls of this process
+
+def get_fetcher():
+    """Return the process-wide PortCallFetcher, creating it on first use."""
+    global fetcher
+    if fetcher is None:
+        fetcher = PortCallFetcher()
+    return fetcher
+
+sink = None  # ArrivalSink shared by all saves of this process
+
+def get_sink():
+    """Return the process-wide ArrivalSink, starting its worker on first use."""
+    global sink
+    if sink is None:
+        sink = ArrivalSink()
+    return sink
+
+def close_sink():
+    """Deliver pending arrival events and stop the sink worker."""
+    global sink
+    if sink is not None:
+        sink.close()
+        sink = None
+
 def fetch_data_from_api():
-    """Fetch JSON data from the API."""
-    url = "https://meri.digitraffic.fi/api/port-call/v1/port-calls"
+    """Fetch JSON data from the API. Returns None on errors and when nothing changed since the last fetch."""
+    import requests
     log("Fetching data from the API...")
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        log("Data fetched successfully.")
-        return response.json()
+        data = get_fetcher().fetch()
+        if data is NOT_MODIFIED:
+            log("Port calls not modified since the last fetch.")
+            return None
+        log(f"Data fetched successfully ({get_fetcher().bytes_fetched} bytes).")
+        return data
     except requests.exceptions.RequestException as e:
+        metrics.increment("errors")
         log(f"Error fetching data from API: {e}")
         return None
 
 def process_query(data, tracked_vessels):
-    """Process the JSON data and prepare results for database insertion."""
+    """Process the JSON data and prepare results for database insertion as a PortCallBatch."""
     if isinstance(data, dict) and "portCalls" in data:
         data = data["portCalls"]
 
     if not isinstance(data, list):
         log("Error: Expected a list of port calls in the JSON data.")
-        return []
+        return PortCallBatch()
 
     log(f"Tracking only these vessels: {tracked_vessels}" if tracked_vessels else "Tracking all vessels.")
 
-    results = []
-    for entry in data:
-        try:
-            port_call_id = int(entry.get("portCallId"))  # Ensure it's always an integer
-            #imo_number = int(entry.get("imoLloyds"))  # Ensure it's always an integer
-        except (TypeError, ValueError):
-            #log(f"Skipping entry with invalid portCallId {entry.get('portCallId')} or imoLloyds {entry.get('imoLloyds')}")
-            log(f"Skipping entry with invalid portCallId {entry.get('portCallId')}")
-            continue  # Skip invalid values
-
-        imo_number = int(entry.get("imoLloyds")) if entry.get("imoLloyds") is not None else None  # Ensure it's always an integer
-        #log(f"Checking vessel {imo_number} with portCallId {port_call_id}...")  # Debugging
-
-        # Skip if filtering is enabled and the IMO number is not in the list
-        if tracked_vessels and imo_number not in tracked_vessels:
-            #log(f"Skipping vessel {imo_number} (not in tracked list).")
-            continue
-
-        if tracked_vessels:
-            log(f"Processing vessel {imo_number} with portCallId {port_call_id}...")  # Log vessel is being processed
-
-        # Extract agentName & shippingCompany from agentInfo[]
-        agent_name = None
-        shipping_company = None
-        for agent in entry.get("agentInfo", []):
-            if agent.get("role") == 1:
-                agent_name = agent.get("name")
-            elif agent.get("role") == 2:
-                shipping_company = agent.get("name")
-
-        # Extract passengers & crew from imoInformation[]
-        passengers_on_arrival = 0
-        passengers_on_departure = 0
-        crew_on_arrival = 0
-        crew_on_departure = 0
-
-        for imo in entry.get("imoInformation", []):
-            if imo.get("imoGeneralDeclaration") == "Arrival":
-                passengers_on_arrival = imo.get("numberOfPassangers", 0) or 0
-                crew_on_arrival = imo.get("numberOfCrew", 0) or 0
-            elif imo.get("imoGeneralDeclaration") == "Departure":
-                passengers_on_departure = imo.get("numberOfPassangers", 0) or 0
-                crew_on_departure = imo.get("numberOfCrew", 0) or 0
-
-        # Extract timestamps & berth info from portAreaDetails[0]
-        port_area_details = entry.get("portAreaDetails", [{}])
-        first_area = port_area_details[0] if port_area_details else {}
-
-        results.append({
-            "portCallId": port_call_id,
-            "portCallTimestamp": entry.get("portCallTimestamp"),
-            "imoLloyds": imo_number if imo_number else 0,
-            "vesselTypeCode": entry.get("vesselTypeCode"),
-            "vesselName": entry.get("vesselName"),
-            "prevPort": entry.get("prevPort"),
-            "portToVisit": entry.get("portToVisit"),
-            "nextPort": entry.get("nextPort"),
-            "agentName": agent_name,
-            "shippingCompany": shipping_company,
-            "eta": first_area.get("eta"),
-            "ata": first_area.get("ata"),
-            "portAreaCode": first_area.get("portAreaCode"),
-            "portAreaName": first_area.get("portAreaName"),
-            "berthCode": first_area.get("berthCode"),
-            "berthName": first_area.get("berthName"),
-            "etd": first_area.get("etd"),
-            "atd": first_area.get("atd"),
-            "passengersOnArrival": passengers_on_arrival,
-            "passengersOnDeparture": passengers_on_departure,
-            "crewOnArrival": crew_on_arrival,
-            "crewOnDeparture": crew_on_departure
-        })
+    with metrics.stage("process"):
+        results = PortCallBatch.from_rows(iter_port_call_rows(data, tracked_vessels))
     log(f"Processed {len(results)} records.")
     return results
 
-def save_results_to_db(results, conn=None):
-    """Save processed results into the 'voyages' table and trigger arrivals only when `ata` is updated at the minute level."""
+def iter_port_call_rows(entries, tracked_vessels):
+    """Yield result tuples in RESULT_FIELDS order from an iterable of port call entries."""
+    parsed = filtered = invalid = 0
     try:
-        log(f"Saving {len(results)} records to the database...")
-        connection_managed_elsewhere = conn is not None
+        for entry in entries:
+            parsed += 1
+            try:
+                port_call_id = int(entry.get("portCallId"))  # Ensure it's always an integer
+                #imo_number = int(entry.get("imoLloyds"))  # Ensure it's always an integer
+            except (TypeError, ValueError):
+                #log(f"Skipping entry with invalid portCallId {entry.get('portCallId')} or imoLloyds {entry.get('imoLloyds')}")
+                log(f"Skipping entry with invalid portCallId {entry.get('portCallId')}")
+                invalid += 1
+                continue  # Skip invalid values
+
+            imo_number = int(entry.get("imoLloyds")) if entry.get("imoLloyds") is not None else None  # Ensure it's always an integer
+            #log(f"Checking vessel {imo_number} with portCallId {port_call_id}...")  # Debugging
+
+            # Skip if filtering is enabled and the IMO number is not in the list
+            if tracked_vessels and imo_number not in tracked_vessels:
+                #log(f"Skipping vessel {imo_number} (not in tracked list).")
+                filtered += 1
+                continue
+
+            if tracked_vessels:
+                log(f"Processing vessel {imo_number} with portCallId {port_call_id}...")  # Log vessel is being processed
+
+            # Extract agentName & shippingCompany from agentInfo[]
+            agent_name = None
+            shipping_company = None
+            for agent in entry.get("agentInfo", []):
+                if agent.get("role") == 1:
+                    agent_name = agent.get("name")
+                elif agent.get("role") == 2:
+                    shipping_company = agent.get("name")
+
+            # Extract passengers & crew from imoInformation[]
+            passengers_on_arrival = 0
+            passengers_on_departure = 0
+            crew_on_arrival = 0
+            crew_on_departure = 0
+
+            for imo in entry.get("imoInformation", []):
+                if imo.get("imoGeneralDeclaration") == "Arrival":
+                    passengers_on_arrival = imo.get("numberOfPassangers", 0) or 0
+                    crew_on_arrival = imo.get("numberOfCrew", 0) or 0
+                elif imo.get("imoGeneralDeclaration") == "Departure":
+                    passengers_on_departure = imo.get("numberOfPassangers", 0) or 0
+                    crew_on_departure = imo.get("numberOfCrew", 0) or 0
+
+            # Extract timestamps & berth info from portAreaDetails[0]
+            port_area_details = entry.get("portAreaDetails", [{}])
+            first_area = port_area_details[0] if port_area_details else {}
+
+            yield (
+                port_call_id,
+                entry.get("portCallTimestamp"),
+                imo_number if imo_number else 0,
+                entry.get("vesselTypeCode"),
+                entry.get("vesselName"),
+                entry.get("prevPort"),
+                entry.get("portToVisit"),
+                entry.get("nextPort"),
+                agent_name,
+                shipping_company,
+                first_area.get("eta"),
+                first_area.get("ata"),
+                first_area.get("portAreaCode"),
+                first_area.get("portAreaName"),
+                first_area.get("berthCode"),
+                first_area.get("berthName"),
+                first_area.get("etd"),
+                first_area.get("atd"),
+                passengers_on_arrival,
+                passengers_on_departure,
+                crew_on_arrival,
+                crew_on_departure
+            )
+    finally:
+        metrics.increment("port_calls_parsed", parsed)
+        metrics.increment("port_calls_filtered", filtered)
+        metrics.increment("port_calls_invalid", invalid)
+
+def build_voyage_upsert(placeholder, rows=1, source=None):
+    """Build the voyages upsert statement for a multi-row VALUES list or a SELECT source."""
+    columns = ", ".join(VOYAGE_COLUMNS)
+    updates = ",\n    ".join(f"{column} = excluded.{column}" for column in VOYAGE_COLUMNS[1:])
+    if source is None:
+        row = "(" + ", ".join([placeholder] * len(VOYAGE_COLUMNS)) + ", CURRENT_TIMESTAMP)"
+        source = "VALUES " + ", ".join([row] * rows)
+    return (
+        f"INSERT INTO voyages ({columns}, modified)\n"
+        f"{source}\n"
+        f"ON CONFLICT (portCallId) DO UPDATE SET\n"
+        f"    {updates},\n"
+        f"    modified = CURRENT_TIMESTAMP;"
+    )
+
+def resolve_write_strategy(conn, strategy=None):
+    """Pick the bulk write strategy for the connection ('auto' selects COPY on PostgreSQL, executemany on SQLite)."""
+    strategy = strategy or WRITE_CONFIG["strategy"]
+    if strategy not in WRITE_STRATEGIES:
+        raise ValueError(f"Unknown write strategy '{strategy}', expected one of {WRITE_STRATEGIES}")
+    if strategy == "auto":
+        # sqlite3 executemany steps one prepared insert per row, faster than parsing large VALUES lists
+        return "executemany" if is_sqlite_connection(conn) else "copy"
+    if strategy == "copy" and is_sqlite_connection(conn):
+        log("COPY is not supported by SQLite, falling back to executemany.")
+        return "executemany"
+    return strategy
+
+def chunked(items, size):
+    """Yield successive slices of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def execute_values(cursor, build_statement, placeholder, rows, batch_size):
+    """Insert rows with multi-row VALUES statements of at most `batch_size` rows."""
+    if not rows:
+        return
+    width = len(rows[0])
+    batch_size = max(1, min(batch_size, MAX_STATEMENT_PARAMS // width))
+    for batch in chunked(rows, batch_size):
+        params = tuple(value for row in batch for value in row)
+        cursor.execute(build_statement(placeholder, len(batch)), params)
+
+def copy_text_value(value):
+    """Encode a value for PostgreSQL COPY text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def create_staging_table(cursor, sqlite):
+    """Create the session-local voyages_staging table that incoming rows are loaded into."""
+    if sqlite:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS voyages_staging (position INTEGER PRIMARY KEY, {', '.join(VOYAGE_COLUMNS)});"
+        )
+    else:
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS voyages_staging "
+            "(LIKE voyages INCLUDING DEFAULTS, position BIGINT GENERATED ALWAYS AS IDENTITY) ON COMMIT DELETE ROWS;"
+        )
 
-        if conn is None:
-            conn = get_db_connection(DATABASE_CONFIG["dbname"])
+def build_staging_insert(placeholder, rows=1):
+    """Build the voyages_staging insert statement for a multi-row VALUES list."""
+    row = "(" + ", ".join([placeholder] * len(VOYAGE_COLUMNS)) + ")"
+    return f"INSERT INTO voyages_staging ({', '.join(VOYAGE_COLUMNS)}) VALUES {', '.join([row] * rows)};"
+
+def load_staging(cursor, rows, strategy, placeholder, batch_size):
+    """Load voyage rows into voyages_staging using the selected strategy."""
+    if strategy == "copy":
+        columns = ", ".join(VOYAGE_COLUMNS)
+        for batch in chunked(rows, batch_size):
+            data = "".join("\t".join(copy_text_value(value) for value in row) + "\n" for row in batch)
+            stream = io.BytesIO(data.encode("utf-8"))
+            cursor.execute(f"COPY voyages_staging ({columns}) FROM STDIN", stream=stream)
+    elif strategy == "values":
+        execute_values(cursor, build_staging_insert, placeholder, rows, batch_size)
+    elif strategy == "executemany":
+        for batch in chunked(rows, batch_size):
+            cursor.executemany(build_staging_insert(placeholder), batch)
+    else:
+        insert_query = build_staging_insert(placeholder)
+        for row in rows:
+            cursor.execute(insert_query, row)
+
+def build_postgres_merge():
+    """Build the statement that upserts voyages_staging and inserts arrivals whose minute-level ata changed.
+
+    All parts of a WITH statement see the same snapshot, so `previous` holds the ata
+    values from before the upsert. In cluster mode arrivals already recorded, e.g. by another
+    agent, are skipped by the unique (portCallId, ata) index. Returns (portCallId, old_ata, ata) of the inserted arrivals.
+    """
+    columns = ", ".join(VOYAGE_COLUMNS)
+    incoming = ", ".join("date_trunc('minute', ata) AS ata" if column == "ata" else column for column in VOYAGE_COLUMNS)
+    upsert = build_voyage_upsert("%s", source=f"SELECT {columns}, CURRENT_TIMESTAMP FROM incoming").rstrip(";")
+    return (
+        f"WITH incoming AS (SELECT {incoming}, position FROM voyages_staging),\n"
+        f"previous AS (\n"
+        f"    SELECT portCallId, date_trunc('minute', voyages.ata) AS ata FROM voyages JOIN incoming USING (portCallId)\n"
+        f"),\n"
+        f"upserted AS (\n{upsert}\n)\n"
+        f"INSERT INTO arrivals ({', '.join(ARRIVAL_COLUMNS)}, created)\n"
+        f"SELECT incoming.portCallId, incoming.eta, previous.ata, incoming.ata,\n"
+        f"    incoming.vesselName, incoming.portAreaName, incoming.berthName, CURRENT_TIMESTAMP\n"
+        f"FROM incoming LEFT JOIN previous USING (portCallId)\n"
+        f"WHERE incoming.ata IS NOT NULL AND incoming.ata IS DISTINCT FROM previous.ata\n"
+        f"ORDER BY incoming.position\n"
+        f"ON CONFLICT DO NOTHING\n"
+        f"RETURNING portCallId, old_ata, ata;"
+    )
+
+def sqlite_minute(column):
+    """SQL expression truncating an ISO-8601 text timestamp to the minute."""
+    return f"substr({column}, 1, 16) || ':00.000Z'"
+
+def build_sqlite_merge():
+    """Build the arrivals insert and voyages upsert from voyages_staging for sqlite (no writable CTEs).
+
+    The arrivals insert runs first so it compares against the ata values from before the upsert.
+    """
+    arrivals = (
+        f"INSERT INTO arrivals ({', '.join(ARRIVAL_COLUMNS)}, created)\n"
+        f"SELECT staging.portCallId, staging.eta, {sqlite_minute('voyages.ata')}, {sqlite_minute('staging.ata')},\n"
+        f"    staging.vesselName, staging.portAreaName, staging.berthName, CURRENT_TIMESTAMP\n"
+        f"FROM voyages_staging AS staging LEFT JOIN voyages ON voyages.portCallId = staging.portCallId\n"
+        f"WHERE staging.ata IS NOT NULL\n"
+        f"    AND (voyages.ata IS NULL OR substr(voyages.ata, 1, 16) <> substr(staging.ata, 1, 16))\n"
+        f"ORDER BY staging.position\n"
+        f"ON CONFLICT DO NOTHING\n"
+        f"RETURNING portCallId, old_ata, ata;"
+    )
+    incoming = ", ".join(sqlite_minute("ata") if column == "ata" else column for column in VOYAGE_COLUMNS)
+    # WHERE true keeps sqlite from parsing ON CONFLICT as a join constraint
+    upsert = build_voyage_upsert("?", source=f"SELECT {incoming}, CURRENT_TIMESTAMP FROM voyages_staging WHERE true ORDER BY position")
+    return arrivals, upsert
+
+def merge_staging(cursor, sqlite):
+    """Detect arrivals and upsert the staged voyages, return (portCallId, old_ata, ata) of the new arrivals."""
+    if sqlite:
+        arrivals_query, upsert_query = build_sqlite_merge()
+        cursor.execute(arrivals_query)
+        arrivals = cursor.fetchall()
+        cursor.execute(upsert_query)
+        cursor.execute("DELETE FROM voyages_staging;")
+    else:
+        cursor.execute(build_postgres_merge())
+        arrivals = cursor.fetchall()
+    return arrivals
 
+def canonical_timestamp(value):
+    """Return a timestamp as a second-resolution ISO string regardless of driver type."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    return str(value)[:19]
+
+def voyage_fingerprint(row):
+    """Hash a voyages row so equal rows from the API and the database compare equal (ata at minute level)."""
+    return hash(tuple(
+        canonical_timestamp(value) if index in TIMESTAMP_INDEXES
+        else (value and canonical_timestamp(value)[:16]) if index == ATA_INDEX
+        else (None if value is None else str(value))
+        for index, value in enumerate(row)
+    ))
+
+class VoyageStateCache:
+    """Long-lived map of known port calls used to skip voyages that did not change since the last write.
+
+    `states` holds (fingerprint, atd) per portCallId for recent port calls. Port calls whose
+    atd is older than `retention_days` (relative to the newest portCallTimestamp seen) are
+    evicted; if one shows up again it is simply written and compared in the database.
+    """
+
+    def __init__(self, retention_days=None):
+        self.retention_days = STATE_CACHE_CONFIG["retention_days"] if retention_days is None else retention_days
+        self.states = {}
+        self.clock = None
+        self.warmed = False
+
+    def warm(self, cursor, placeholder):
+        """Load the state of recent port calls from the voyages table."""
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        if placeholder == "?":
+            cutoff = cutoff.strftime("%Y-%m-%dT%H:%M:%S")  # sqlite stores ISO strings
+        cursor.execute(
+            f"SELECT {', '.join(VOYAGE_COLUMNS)} FROM voyages WHERE atd IS NULL OR atd >= {placeholder};",
+            (cutoff,)
+        )
+        self.update(cursor.fetchall())
+        self.warmed = True
+        log(f"State cache warmed with {len(self.states)} recent port calls.")
+
+    def changes(self, rows):
+        """Return the rows whose fingerprint differs from the cached state, keyed by portCallId."""
+        changed = {}
+        for port_call_id, row in rows.items():
+            state = self.states.get(port_call_id)
+            if state is None or state[0] != voyage_fingerprint(row):
+                changed[port_call_id] = row
+        return changed
+
+    def update(self, rows):
+        """Record the state of rows that were written to the database."""
+        for row in rows:
+            self.states[int(row[0])] = (voyage_fingerprint(row), canonical_timestamp(row[ATD_INDEX]))
+
+    def advance_clock(self, timestamps):
+        """Move the eviction clock to the newest portCallTimestamp seen."""
+        latest = max((canonical_timestamp(value) for value in timestamps if value), default=None)
+        if latest and (self.clock is None or latest > self.clock):
+            self.clock = latest
+
+    def evict(self):
+        """Drop port calls whose atd is older than the retention window."""
+        if self.clock is None:
+            return 0
+        cutoff = (datetime.strptime(self.clock, "%Y-%m-%dT%H:%M:%S") - timedelta(days=self.retention_days)).strftime("%Y-%m-%dT%H:%M:%S")
+        expired = [port_call_id for port_call_id, state in self.states.items() if state[1] and state[1] < cutoff]
+        for port_call_id in expired:
+            del self.states[port_call_id]
+        return len(expired)
+
+commit_listeners = []  # Functions called with the written rows after each committed save
+
+def add_commit_listener(listener):
+    """Call `listener(voyage_rows, arrivals)` after every committed save.
+
+    `voyage_rows` are the written voyages rows in VOYAGE_COLUMNS order (ata as loaded,
+    the database keeps it at minute level), `arrivals` the (portCallId, old_ata, ata)
+    rows inserted into arrivals.
+    """
+    commit_listeners.append(listener)
+
+def notify_commit(voyage_rows, arrivals):
+    """Pass committed rows to the commit listeners; their errors never fail the save."""
+    for listener in commit_listeners:
+        try:
+            listener(voyage_rows, arrivals)
+        except Exception as e:
+            metrics.increment("errors")
+            log(f"Error in commit listener: {e}")
+
+def save_results_to_db(results, conn=None, strategy=None, batch_size=None, cache=None):
+    """Save processed results into the 'voyages' table and trigger arrivals only when `ata` is updated at the minute level.
+
+    Rows are loaded into a voyages_staging temp table using the selected strategy (see
+    WRITE_CONFIG): 'copy' streams them with COPY FROM STDIN (PostgreSQL only), 'values'
+    uses multi-row VALUES inserts, 'executemany' a prepared single-row insert and 'row'
+    one statement per voyage. One set-based statement then compares the staged ata with
+    the stored one, upserts voyages and inserts the arrivals (two statements on sqlite).
+    With a VoyageStateCache only changed voyages are staged. Returns True once the
+    transaction is committed, False if saving failed.
+    """
+    if conn is None:
+        conn = checkout_connection()
         if conn is None:
-            return
-        cursor = conn.cursor()
-
-        new_arrival_count = 0  # Track the count of new arrivals
-
-        # Extract unique portCallIds from JSON data
-        port_call_ids = list(set(entry["portCallId"] for entry in results))
-
-        # Fetch all old ata values in one query
-        old_ata_map = {}
-        if port_call_ids:
-            # Detect if using SQLite
-            is_sqlite = isinstance(conn, sqlite3.Connection)
-            placeholder = "?" if is_sqlite else "%s"
-
-            # Fetch old ATA values using proper placeholders
-            port_call_ids = list(set(entry["portCallId"] for entry in results))
-            query = f"""
-                SELECT portCallId, ata FROM voyages WHERE portCallId IN ({','.join([placeholder] * len(port_call_ids))});
-            """
-            cursor.execute(query, tuple(port_call_ids))
-
-            fetched_data = cursor.fetchall()
-
-            # Debugging: Log fetched data
-            log(f"Fetched {len(fetched_data)} existing records from voyages table.")
-
-            # Populate old_ata_map with correctly formatted timestamps (ignore NULL values)
-            for row in fetched_data:
-                port_call_id, old_ata = row
-                if old_ata:  # Only store valid timestamps
-                    old_ata_map[int(port_call_id)] = old_ata.strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize to minute level
-
-        for entry in results:
-            port_call_id = int(entry["portCallId"])  # Ensure it's stored as an integer
-            imo_number = int(entry["imoLloyds"])  # Ensure it's stored as an integer
-            new_ata = entry["ata"]
-            if new_ata:
-                new_ata = datetime.strptime(new_ata, "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%dT%H:%M:00.000Z")  # Normalize
-
-            # Fetch old ata from the map (default to None)
-            old_ata = old_ata_map.get(port_call_id, None)
-
-            # Insert or update voyages
-            insert_query = f"""
-            INSERT INTO voyages (portCallId, imoLloyds, vesselTypeCode, vesselName, prevPort,
-                portToVisit, nextPort, agentName, shippingCompany, eta, ata, portAreaCode,
-                portAreaName, berthCode, berthName, etd, atd,
-                passengersOnArrival, passengersOnDeparture, crewOnArrival, crewOnDeparture,
-                modified
-            ) VALUES ({','.join([placeholder] * 21)}, CURRENT_TIMESTAMP)
-            ON CONFLICT (portCallId) DO UPDATE SET
-                imoLloyds = excluded.imoLloyds,
-                vesselTypeCode = excluded.vesselTypeCode,
-                vesselName = excluded.vesselName,
-                prevPort = excluded.prevPort,
-                portToVisit = excluded.portToVisit,
-                nextPort = excluded.nextPort,
-                agentName = excluded.agentName,
-                shippingCompany = excluded.shippingCompany,
-                eta = excluded.eta,
-                ata = excluded.ata,
-                portAreaCode = excluded.portAreaCode,
-                portAreaName = excluded.portAreaName,
-                berthCode = excluded.berthCode,
-                berthName = excluded.berthName,
-                etd = excluded.etd,
-                atd = excluded.atd,
-                passengersOnArrival = excluded.passengersOnArrival,
-                passengersOnDeparture = excluded.passengersOnDeparture,
-                crewOnArrival = excluded.crewOnArrival,
-                crewOnDeparture = excluded.crewOnDeparture,
-                modified = CURRENT_TIMESTAMP;
-            """
-
-            cursor.execute(insert_query, (
-                port_call_id, imo_number, entry["vesselTypeCode"], entry["vesselName"],
-                entry["prevPort"], entry["portToVisit"], entry["nextPort"], entry["agentName"],
-                entry["shippingCompany"], entry["eta"], new_ata, entry["portAreaCode"], entry["portAreaName"],
-                entry["berthCode"], entry["berthName"], entry["etd"], entry["atd"],
-                entry["passengersOnArrival"], entry["passengersOnDeparture"], entry["crewOnArrival"],
-                entry["crewOnDeparture"]
-            ))
-
-            if old_ata != new_ata and new_ata is not None:
-                insert_arrival_query = f"""
-                INSERT INTO arrivals (portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName, created)
-                VALUES ({','.join([placeholder] * 7)}, CURRENT_TIMESTAMP);
-                """
-                cursor.execute(insert_arrival_query, (
-                    port_call_id, entry["eta"], old_ata, new_ata,
-                    entry["vesselName"], entry["portAreaName"], entry["berthName"]
-                ))
-                new_arrival_count += 1
-                print(
-                    f"-----------------------------\n"
-                    f"Port Call ID: {port_call_id}\n"
-                    f"Port Call Time Stamp: {entry["portCallTimestamp"]}\n\n"
-                    f"Aluksen IMO/nimi: {imo_number}/{entry["vesselName"]}\n\n"
-                    f"Satamakoodi: {entry["portToVisit"]}\n"
-                    f"Satama: {entry["portAreaName"]}\n"
-                    f"Laituri: {entry["berthName"]}\n\n"
-                    f"Saapuminen\n"
-                    f"Arvioitu saapumisaika (UTC): {datetime.strptime(entry['eta'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('eta') else 'N/A'}\n"
-                    f"Toteutunut saapumisaika (UTC): {datetime.strptime(new_ata, "%Y-%m-%dT%H:%M:%S.%f%z").strftime("%Y-%m-%d %H:%M") if new_ata else 'N/A'}\n"
-                    f"Miehistön lukumäärä: {entry["crewOnArrival"]}\n"
-                    f"Matkustajien lukumäärä: {entry["passengersOnArrival"]}\n\n"
-                    f"Lähtö\n"
-                    f"Arvioitu lähtöaika (UTC): {datetime.strptime(entry['etd'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('etd') else 'N/A'}\n"
-                    f"Toteutunut lähtöaika (UTC): {datetime.strptime(entry['atd'], '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%Y-%m-%d %H:%M') if entry.get('atd') else 'N/A'}\n"
-                    f"Miehistön lukumäärä: {entry["crewOnDeparture"]}\n"
-                    f"Matkustajien lukumäärä: {entry["passengersOnDeparture"]}\n"
-                )
-                #log(f"Trigger executed: New arrival detected for portCallId {port_call_id} (old_ata: {old_ata}, new_ata: {new_ata})")
-
-        conn.commit()
+            return False
+        try:
+            return save_results_to_db(results, conn, strategy, batch_size, cache)
+        finally:
+            get_pool().checkin(conn)
+
+    if not isinstance(results, PortCallBatch):
+        results = PortCallBatch.from_dicts(results)
+
+    try:
+        log(f"Saving {len(results)} records to the database...")
+        cursor = metrics.cursor(conn.cursor())
+
+        strategy = resolve_write_strategy(conn, strategy)
+        batch_size = batch_size or WRITE_CONFIG["batch_size"]
+        sqlite = is_sqlite_connection(conn)
+        placeholder = "?" if sqlite else "%s"
+
+        # Keep the last entry per portCallId, an upsert batch may not touch the same row twice
+        rows = {row[0]: row for row in results.rows(VOYAGE_COLUMNS)}
+        positions = {port_call_id: index for index, port_call_id in enumerate(results.column("portCallId"))}
+
+        if cache is not None:
+            with metrics.stage("cache"):
+                if not cache.warmed:
+                    cache.warm(cursor, placeholder)
+                rows = cache.changes(rows)
+            metrics.increment("rows_unchanged", len(positions) - len(rows))
+            log(f"Skipping {len(positions) - len(rows)} unchanged voyages.")
+
+        voyage_rows = list(rows.values())
+        arrivals = []
+        if voyage_rows:
+            create_staging_table(cursor, sqlite)
+            with metrics.stage("load_staging"):
+                load_staging(cursor, voyage_rows, strategy, placeholder, batch_size)
+            with metrics.stage("merge"):
+                arrivals = merge_staging(cursor, sqlite)
+
+        with metrics.stage("commit"):
+            conn.commit()
+        metrics.increment("db_round_trips")
+        metrics.increment("rows_written", len(voyage_rows))
+        metrics.increment("arrivals_detected", len(arrivals))
         cursor.close()
-        if not connection_managed_elsewhere:
-            conn.close()
-        log(f"{len(results)} records saved/updated in the database.")
-        log(f"Total new arrivals detected: {new_arrival_count}")
+
+        notify_commit(voyage_rows, arrivals)
+        if cache is not None:
+            cache.update(voyage_rows)
+            cache.advance_clock(results.column("portCallTimestamp"))
+            evicted = cache.evict()
+            if evicted:
+                log(f"Evicted {evicted} departed port calls from the state cache.")
+
+        events = get_sink()
+        for port_call_id, _, new_ata in arrivals:
+            events.publish(arrival_event(results[positions[port_call_id]], new_ata))
+        log(f"{len(voyage_rows)} records saved/updated in the database ({strategy}).")
+        log(f"Total new arrivals detected: {len(arrivals)}")
+        return True
 
     except Exception as e:
+        metrics.increment("errors")
         log(f"Error saving results to the database: {e}")
+        try:
+            conn.rollback()  # Leave a reused connection usable for the next batch
+        except Exception:
+            pass
+        return False
+
+UNKNOWN_ATA = object()  # Previous ata of a port call first seen in a CoalescedReplay, read from voyages on save
+
+def minute_timestamp(value):
+    """Truncate a timestamp to the minute as an ISO-8601 string, the form of voyages.ata written by the merge."""
+    return None if value is None else canonical_timestamp(value)[:16] + ":00.000Z"
+
+class CoalescedReplay:
+    """In-memory fold of a sequence of snapshot chunks for fast backfills.
+
+    `add` applies a chunk the way save_results_to_db would (last row per portCallId,
+    arrival when the minute-level ata changes), keeping only the final voyages row per
+    port call and the detected arrivals in order. The first arrival of a port call is
+    compared against the database when the fold is saved by save_coalesced_replay.
+    """
+
+    def __init__(self):
+        self.voyages = {}  # portCallId -> final voyages row with minute-level ata
+        self.arrivals = []  # (portCallId, previous ata or UNKNOWN_ATA, ata)
+        self.entries = PortCallBatch()  # Result row of each arrival, for its event
+
+    def add(self, chunk):
+        """Fold one chunk (PortCallBatch) of processed port calls."""
+        rows = {row[0]: row for row in chunk.rows(VOYAGE_COLUMNS)}
+        positions = {port_call_id: index for index, port_call_id in enumerate(chunk.column("portCallId"))}
+        for port_call_id, row in rows.items():
+            ata = minute_timestamp(row[ATA_INDEX])
+            previous = self.voyages[port_call_id][ATA_INDEX] if port_call_id in self.voyages else UNKNOWN_ATA
+            if ata is not None and ata != previous:
+                self.arrivals.append((port_call_id, previous, ata))
+                self.entries.append(tuple(chunk[positions[port_call_id]].values()))
+            self.voyages[port_call_id] = row[:ATA_INDEX] + (ata,) + row[ATA_INDEX + 1:]
+
+    def __len__(self):
+        return len(self.voyages)
+
+def fetch_minute_atas(cursor, port_call_ids, placeholder):
+    """Return {portCallId: minute-level ata} of the given port calls from voyages."""
+    atas = {}
+    for batch in chunked(port_call_ids, MAX_STATEMENT_PARAMS):
+        cursor.execute(
+            f"SELECT portCallId, ata FROM voyages WHERE portCallId IN ({', '.join([placeholder] * len(batch))});", tuple(batch)
+        )
+        atas.update((port_call_id, minute_timestamp(ata)) for port_call_id, ata in cursor.fetchall())
+    return atas
+
+def build_arrival_insert(placeholder, rows=1):
+    """Build a multi-row arrivals insert returning (portCallId, old_ata, ata) of the inserted rows."""
+    row = "(" + ", ".join([placeholder] * len(ARRIVAL_COLUMNS)) + ", CURRENT_TIMESTAMP)"
+    return (
+        f"INSERT INTO arrivals ({', '.join(ARRIVAL_COLUMNS)}, created) VALUES {', '.join([row] * rows)}\n"
+        f"ON CONFLICT DO NOTHING\n"
+        f"RETURNING portCallId, old_ata, ata;"
+    )
+
+def save_coalesced_replay(replay, conn=None, cache=None, strategy=None, batch_size=None, reraise=False):
+    """Write the final voyages and all arrivals of a CoalescedReplay in one transaction and publish the arrival events.
+
+    Gives the same voyages and arrivals as saving every chunk with save_results_to_db.
+    Returns True once the transaction is committed; database errors are logged and return
+    False, or are raised after the rollback with `reraise`.
+    """
+    if conn is None:
+        conn = checkout_connection()
+        if conn is None:
+            return False
+        try:
+            return save_coalesced_replay(replay, conn, cache, strategy, batch_size, reraise)
+        finally:
+            get_pool().checkin(conn)
+
+    try:
+        log(f"Saving {len(replay)} coalesced voyages and up to {len(replay.arrivals)} arrivals to the database...")
+        cursor = metrics.cursor(conn.cursor())
+        strategy = resolve_write_strategy(conn, strategy)
+        batch_size = batch_size or WRITE_CONFIG["batch_size"]
+        sqlite = is_sqlite_connection(conn)
+        placeholder = "?" if sqlite else "%s"
+
+        # First arrivals of port calls already in the database depend on the stored ata
+        first_seen = [port_call_id for port_call_id, previous, _ in replay.arrivals if previous is UNKNOWN_ATA]
+        stored = fetch_minute_atas(cursor, first_seen, placeholder)
+        arrival_rows = []
+        positions = collections.defaultdict(collections.deque)  # (portCallId, ata) -> positions of its arrivals, in order
+        for position, (port_call_id, previous, ata) in enumerate(replay.arrivals):
+            if previous is UNKNOWN_ATA:
+                previous = stored.get(port_call_id)
+                if previous == ata:
+                    continue
+            voyage = replay.entries[position]
+            arrival_rows.append((port_call_id, voyage["eta"], previous, ata, voyage["vesselName"], voyage["portAreaName"], voyage["berthName"]))
+            positions[(port_call_id, ata)].append(position)
+
+        voyage_rows = list(replay.voyages.values())
+        arrivals = []
+        if voyage_rows:
+            create_staging_table(cursor, sqlite)
+            with metrics.stage("load_staging"):
+                load_staging(cursor, voyage_rows, strategy, placeholder, batch_size)
+            with metrics.stage("merge"):
+                # WHERE true keeps sqlite from parsing ON CONFLICT as a join constraint
+                cursor.execute(build_voyage_upsert(placeholder, source=(
+                    f"SELECT {', '.join(VOYAGE_COLUMNS)}, CURRENT_TIMESTAMP FROM voyages_staging WHERE true ORDER BY position"
+                )))
+                if sqlite:
+                    cursor.execute("DELETE FROM voyages_staging;")
+                for batch in chunked(arrival_rows, MAX_STATEMENT_PARAMS // len(ARRIVAL_COLUMNS)):
+                    cursor.execute(build_arrival_insert(placeholder, len(batch)), tuple(value for row in batch for value in row))
+                    arrivals.extend(cursor.fetchall())
+
+        with metrics.stage("commit"):
+            conn.commit()
+        metrics.increment("db_round_trips")
+        metrics.increment("rows_written", len(voyage_rows))
+        metrics.increment("arrivals_detected", len(arrivals))
+        cursor.close()
+
+        notify_commit(voyage_rows, arrivals)
+        if cache is not None and cache.warmed:
+            cache.update(voyage_rows)
+
+        events = get_sink()
+        # Inserts skipped by ON CONFLICT return no row, so rows are matched by key, not by order
+        for port_call_id, _, new_ata in arrivals:
+            position = positions[(port_call_id, minute_timestamp(new_ata))].popleft()
+            events.publish(arrival_event(replay.entries[position], new_ata))
+        log(f"{len(voyage_rows)} coalesced voyages saved/updated in the database ({strategy}).")
+        log(f"Total new arrivals detected: {len(arrivals)}")
+        return True
+
+    except Exception as e:
+        metrics.increment("errors")
+        log(f"Error saving coalesced replay to the database: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if reraise:
+            raise
+        return False
+
+def save_spooled_batches(batches, conn=None, cache=None):
+    """Save spooled snapshots, oldest first, in one coalesced transaction.
+
+    Returns True once committed and False on transient errors (no connection, lost
+    connection, lock timeout, ...), which the SpoolWriter retries. Other errors raise
+    UnwritableBatches so the writer moves the failing snapshot aside.
+    """
+    replay = CoalescedReplay()
+    for batch in batches:
+        replay.add(batch)
+    try:
+        return save_coalesced_replay(replay, conn, cache, reraise=True)
+    except Exception as e:
+        if is_transient_error(e):
+            return False
+        raise UnwritableBatches(f"{type(e).__name__}: {e}") from e
+
+spool_writer = None  # SpoolWriter between polls and the database, if the spool is enabled
+
+def get_spool_writer(cache=None):
+    """Return the process-wide SpoolWriter, opening the spool and starting its writer on first use."""
+    global spool_writer
+    if spool_writer is None:
+        spool_writer = SpoolWriter(Spool(), lambda batches: save_spooled_batches(batches, cache=cache))
+    return spool_writer
+
+def close_spool_writer():
+    """Flush the spool within the configured timeout and stop the writer; unwritten snapshots stay on disk."""
+    global spool_writer
+    if spool_writer is not None:
+        spool_writer.close(SPOOL_CONFIG["close_timeout"])
+        spool_writer = None
+
+def poll(tracked_vessels, conn=None, cache=None, leases=None):
+    """Fetch, process and save one snapshot from the API (through the spool if it is enabled).
+
+    With PartitionLeases only the port calls of the held partitions are saved. The fetcher's
+    delta position and validators only move on once the snapshot is saved or spooled, so
+    a failed save is fetched again by the next poll.
+    """
+    metrics.increment("polls")
+    data = fetch_data_from_api()
+    if not data:
+        log("No data available to process.")
+        return
+    stored = False
+    try:
+        results = process_query(data, tracked_vessels)
+        if leases is not None:
+            if not leases.verify():
+                log("No partition leases held, skipping the save.")
+                return
+            results = leases.select(results)
+        if SPOOL_CONFIG["enabled"] and conn is None:
+            if len(results):
+                get_spool_writer(cache).put(results)
+            stored = True
+        else:
+            stored = save_results_to_db(results, conn, cache=cache)
+    finally:
+        if stored:
+            get_fetcher().commit()
+        else:
+            get_fetcher().discard()
+
+class AgentDaemon:
+    """Resident agent polling the API on a fixed-rate schedule.
+
+    Schema setup happens once before start; pooled database connections, the HTTP session
+    and the state cache stay alive between polls. Polls run in a worker thread on a grid of
+    `interval` seconds from startup, so processing time does not shift later polls, and
+    a poll is skipped while the previous one is still running. SIGTERM and SIGINT stop
+    the scheduler and wait for the running poll to finish. SIGUSR1 profiles the next poll
+    into PROFILE_SIGNAL_DIR (every poll is profiled with --profile). With PartitionLeases
+    (--cluster) the leases are rebalanced before every poll. With partitioning enabled,
+    partition maintenance runs after the first poll of each day. `clock` (datetime.now by
+    default) places the grid.
+    """
+
+    def __init__(self, tracked_vessels, interval=None, cache=None, leases=None, clock=None):
+        self.tracked_vessels = tracked_vessels
+        self.interval = interval or DAEMON_CONFIG["interval"]
+        self.cache = cache
+        self.leases = leases
+        self.clock = clock or datetime.now
+        import schedule
+        self.scheduler = schedule.Scheduler()
+        self.stop_event = threading.Event()
+        self.profile_next = threading.Event()
+        self.worker = None
+        self.anchor = None
+        self.maintained = date.today()  # create_database_and_tables maintained the partitions at startup
+
+    def job(self):
+        """Start a poll in the worker thread unless the previous poll is still running."""
+        if self.worker is not None and self.worker.is_alive():
+            log("Previous poll still running, skipping this one.")
+            metrics.increment("polls_skipped")
+            return
+        self.worker = threading.Thread(target=self.poll, name="portman-poll", daemon=True)
+        self.worker.start()
+
+    def poll(self):
+        """Run one poll using pooled connections, profiled if requested."""
+        log("Fetching new data...")
+        directory = PROFILE_CONFIG["directory"]
+        if self.profile_next.is_set():
+            self.profile_next.clear()
+            directory = directory or PROFILE_CONFIG["signal_directory"]
+        session = None
+        try:
+            if directory:
+                from portman_profile import ProfileSession
+                session = ProfileSession(directory, "poll").start()
+            if self.leases is not None:
+                self.rebalance()
+            poll(self.tracked_vessels, cache=self.cache, leases=self.leases)
+            if session is not None and SPOOL_CONFIG["enabled"]:
+                get_spool_writer(self.cache).flush(SPOOL_CONFIG["close_timeout"])  # Include the database writes
+        except Exception as e:
+            metrics.increment("errors")
+            log(f"Error during poll: {e}")
+        finally:
+            if session is not None:
+                session.stop()
+        if PARTITION_CONFIG["enabled"] and not using_sqlite() and self.maintained != date.today():
+            self.maintain_partitions()
+        if METRICS_CONFIG["json_file"]:
+            metrics.dump_json(METRICS_CONFIG["json_file"])
+
+    def rebalance(self):
+        """Rebalance the partition leases; after taking over partitions, fetch and write their port calls in full."""
+        if self.leases.rebalance():
+            get_fetcher().reset()  # A delta or 304 response would skip changes made while nobody held them
+            if self.cache is not None:
+                self.cache.states.clear()  # Another agent may have written these port calls meanwhile
+
+    def maintain_partitions(self):
+        """Create upcoming partitions and apply retention on a pooled connection.
+
+        With PartitionLeases, only the agent taking the maintenance lock maintains the
+        partitions; the others skip it for the day.
+        """
+        try:
+            with metrics.stage("partitions"), get_pool().connection() as conn:
+                cursor = conn.cursor()
+                if self.leases is not None:
+                    from portman_cluster import lock_maintenance
+                    if not lock_maintenance(cursor):
+                        log("Another agent is maintaining the partitions, skipping.")
+                        conn.rollback()
+                        cursor.close()
+                        self.maintained = date.today()
+                        return
+                maintain_partitions(cursor)
+                conn.commit()
+                cursor.close()
+            self.maintained = date.today()
+        except Exception as e:
+            metrics.increment("errors")
+            log(f"Error maintaining partitions: {e}")
+
+    def next_run(self):
+        """Next point on the fixed-rate grid after now."""
+        elapsed = (self.clock() - self.anchor).total_seconds()
+        return self.anchor + timedelta(seconds=(int(elapsed // self.interval) + 1) * self.interval)
+
+    def request_profile(self, signum=None, frame=None):
+        """Profile the next poll."""
+        log("Received SIGUSR1, profiling the next poll.")
+        self.profile_next.set()
+
+    def stop(self, signum=None, frame=None):
+        """Ask the scheduler loop to stop."""
+        if signum is not None:
+            log(f"Received signal {signum}, shutting down...")
+        self.stop_event.set()
+
+    def run(self):
+        """Run polls until stopped."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+            if hasattr(signal, "SIGUSR1"):  # Not available on Windows
+                signal.signal(signal.SIGUSR1, self.request_profile)
+
+        try:
+            get_pool().fill()  # Warm min_size connections before the first poll
+        except Exception as e:
+            log(f"Error opening database connections: {e}")
+
+        self.anchor = self.clock()
+        job = self.scheduler.every(self.interval).seconds.do(self.job)
+        log(f"Scheduler started. Fetching data every {self.interval} seconds...")
+        self.job()  # Run the job once at startup
+        job.next_run = self.next_run()
+
+        while not self.stop_event.is_set():
+            self.scheduler.run_pending()
+            job.next_run = self.next_run()  # Realign to the grid instead of run end + interval
+            self.stop_event.wait(min(1.0, max(0.0, self.scheduler.idle_seconds)))
+
+        self.scheduler.clear()
+        if self.worker is not None and self.worker.is_alive():
+            log("Waiting for the running poll to finish...")
+            self.worker.join()
+        get_pool().close()
+        get_fetcher().close()
+        close_spool_writer()
+        if self.leases is not None:
+            self.leases.close()
+        close_sink()
+        metrics.close()
+        log("Shutting down scheduler gracefully. Goodbye!")
 
 def main():
     log("Program started.")
@@ -446,39 +1200,58 @@ def main():
     # Parse CLI arguments and environment variables
     args = parse_arguments()
 
+    cache = VoyageStateCache() if STATE_CACHE_CONFIG["enabled"] else None
+
+    if METRICS_CONFIG["port"]:
+        try:
+            metrics.serve(METRICS_CONFIG["port"], METRICS_CONFIG["host"])
+        except OSError as e:
+            log(f"Error starting metrics server on port {METRICS_CONFIG['port']}: {e}")
+
+    read_api = None
+    if READ_API_CONFIG["port"]:
+        from portman_api import start_read_api
+        try:
+            read_api = start_read_api()
+        except OSError as e:
+            log(f"Error starting read API on port {READ_API_CONFIG['port']}: {e}")
+
+    # Profile the whole run; the daemon profiles each poll itself
+    reading_files = bool(args["input_file"] or args["input_dir"])
+    session = None
+    if PROFILE_CONFIG["directory"] and (reading_files or not args["daemon"]):
+        from portman_profile import ProfileSession
+        session = ProfileSession(PROFILE_CONFIG["directory"]).start()
+
     # Process JSON from input file or directory
-    data = None
-    if args["input_file"] or args["input_dir"]:
-        data = get_json_source(args["input_file"], args["input_dir"], args["tracked_vessels"])
+    if reading_files:
+        get_json_source(args["input_file"], args["input_dir"], args["tracked_vessels"], cache, args["workers"], args["coalesce"])
+    elif args["daemon"]:
+        leases = None
+        if CLUSTER_CONFIG["enabled"]:
+            if using_sqlite():
+                log("Cluster mode needs PostgreSQL advisory locks, running as the only agent.")
+            else:
+                from portman_cluster import PartitionLeases
+                create_cluster_index()
+                leases = PartitionLeases()
+        AgentDaemon(args["tracked_vessels"], args["interval"], cache, leases).run()
     else:
         # If no file/directory is specified, fetch data from API
         log("No input file or directory specified. Fetching from API...")
-        data = fetch_data_from_api()
-
-    if data:
-        results = process_query(data, args["tracked_vessels"])
-        save_results_to_db(results)
-    else:
-        log("No data available to process.")
-
+        poll(args["tracked_vessels"], cache=cache)
+
+    close_spool_writer()
+    if session is not None:
+        session.stop()
+    close_sink()
+    if read_api is not None:
+        read_api.shutdown()
+    if METRICS_CONFIG["json_file"]:
+        metrics.dump_json(METRICS_CONFIG["json_file"])
     log("Program completed.")
 
 if __name__ == "__main__":
-    main()
-
-# Run the job once at startup
-#log("Running initial fetch...")
-#job()
-
-# Schedule the job every 5 minutes
-#schedule.every(5).minutes.do(job)
-
-#log("Scheduler started. Fetching data every 5 minutes...")
-
-# Keep the program running, handle shutdown gracefully
-#try:
-#    while True:
-#        schedule.run_pending()
-#        time.sleep(1)  # Prevent CPU overuse
-#except KeyboardInterrupt:
-#    log("Shutting down scheduler gracefully. Goodbye!")
+    # Run the importable module, so modules importing portman_agent (the read API) share its state
+    import portman_agent
+    portman_agent.main()
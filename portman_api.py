@@ -0,0 +1,270 @@
+import json
+import threading
+import collections
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from config import READ_API_CONFIG
+from portman_agent import VOYAGE_COLUMNS, add_commit_listener, canonical_timestamp
+from portman_log import log
+from portman_metrics import metrics
+from portman_queries import run_query
+
+TIMESTAMP_COLUMNS = frozenset({"eta", "ata", "etd", "atd"})
+# TEXT columns the API may send as numbers (vesselTypeCode), stored and read back as strings
+TEXT_COLUMNS = frozenset({
+    "vesselTypeCode", "vesselName", "prevPort", "portToVisit", "nextPort", "agentName", "shippingCompany",
+    "portAreaCode", "portAreaName", "berthCode", "berthName"
+})
+ARRIVAL_FIELDS = (
+    "portCallId", "imoLloyds", "vesselName", "portToVisit", "portAreaName", "berthCode", "berthName", "eta", "old_ata", "ata"
+)
+INDEXED_FIELDS = {"port": "portToVisit", "imo": "imoLloyds", "berth": "berthCode"}
+
+def api_time(value):
+    """Timestamp from the database or the API as 'YYYY-MM-DDTHH:MM:SSZ' (UTC), None if missing."""
+    value = canonical_timestamp(value)
+    return value and value + "Z"
+
+def utc_now():
+    """Current UTC time as a naive datetime, like the timestamps in the tables."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def minute_time(value):
+    """api_time truncated to the minute, the resolution of voyages.ata."""
+    value = api_time(value)
+    return value and value[:16] + ":00Z"
+
+def voyage_record(row):
+    """Dict of a voyages row in VOYAGE_COLUMNS order with the values as read back from the table."""
+    record = dict(zip(VOYAGE_COLUMNS, row))
+    for column in TEXT_COLUMNS:
+        if record[column] is not None:
+            record[column] = str(record[column])
+    for column in TIMESTAMP_COLUMNS:
+        record[column] = api_time(record[column])
+    record["ata"] = record["ata"] and record["ata"][:16] + ":00Z"
+    return record
+
+class ReadCache:
+    """In-memory copy of recent voyages and the latest arrivals for the read API.
+
+    Voyages are kept by portCallId with index sets by port (portToVisit), IMO and berth
+    (berthCode); port calls that departed more than `retention_days` ago are evicted.
+    The newest `max_arrivals` arrivals are kept in commit order, numbered by `appended`, and
+    indexed the same way by per-value deques of (number, arrival); index entries older than
+    the oldest kept arrival are skipped and trimmed. `warm` loads both from the tables,
+    `apply` (registered as a commit listener) adds every committed save.
+    Records are replaced, never modified, so query results can be serialised outside the lock.
+    """
+
+    def __init__(self, retention_days=None, max_arrivals=None):
+        self.retention_days = READ_API_CONFIG["retention_days"] if retention_days is None else retention_days
+        self.voyages = {}
+        self.indexes = {field: collections.defaultdict(set) for field in INDEXED_FIELDS.values()}
+        self.arrivals = collections.deque(maxlen=max_arrivals or READ_API_CONFIG["max_arrivals"])
+        self.arrival_indexes = {field: collections.defaultdict(collections.deque) for field in INDEXED_FIELDS.values()}
+        self.appended = 0  # Number of arrivals ever added
+        self.lock = threading.Lock()
+        self.warmed = False
+
+    def cutoff(self):
+        """Departures before this time are evicted."""
+        return api_time(utc_now() - timedelta(days=self.retention_days))
+
+    def warm(self, conn=None):
+        """Load recent voyages and the latest arrivals from the database."""
+        cutoff = utc_now() - timedelta(days=self.retention_days)
+        rows = run_query(f"SELECT {', '.join(VOYAGE_COLUMNS)} FROM voyages WHERE atd IS NULL OR atd >= %s;", (cutoff,), conn)
+        arrivals = run_query(
+            "SELECT arrivals.portCallId, voyages.imoLloyds, arrivals.vesselName, voyages.portToVisit, arrivals.portAreaName,\n"
+            "    voyages.berthCode, arrivals.berthName, arrivals.eta, arrivals.old_ata, arrivals.ata\n"
+            "FROM arrivals LEFT JOIN voyages ON voyages.portCallId = arrivals.portCallId\n"
+            "ORDER BY arrivals.id DESC LIMIT %s;",
+            (self.arrivals.maxlen,), conn
+        )
+        with self.lock:
+            for row in rows:
+                self.store(voyage_record(row))
+            for row in reversed(arrivals):
+                arrival = dict(zip(ARRIVAL_FIELDS, row))
+                for field in ("eta", "old_ata", "ata"):
+                    arrival[field] = api_time(arrival[field])
+                self.add_arrival(arrival)
+            self.warmed = True
+        log(f"Read cache warmed with {len(rows)} recent port calls and {len(arrivals)} arrivals.")
+
+    def store(self, record):
+        """Insert or replace one voyage record and its index entries (lock held)."""
+        previous = self.voyages.get(record["portCallId"])
+        if previous is not None:
+            self.unindex(previous)
+        self.voyages[record["portCallId"]] = record
+        for field, index in self.indexes.items():
+            if record[field] is not None:
+                index[record[field]].add(record["portCallId"])
+
+    def unindex(self, record):
+        """Remove a voyage record from the index sets (lock held)."""
+        for field, index in self.indexes.items():
+            ids = index.get(record[field])
+            if ids is not None:
+                ids.discard(record["portCallId"])
+                if not ids:
+                    del index[record[field]]
+
+    def apply(self, voyage_rows, arrivals):
+        """Add the rows of a committed save: voyages rows and (portCallId, old_ata, ata) arrivals."""
+        records = [voyage_record(row) for row in voyage_rows]
+        with self.lock:
+            for record in records:
+                self.store(record)
+            for port_call_id, old_ata, ata in arrivals:
+                voyage = self.voyages.get(port_call_id, {})
+                arrival = {field: voyage.get(field) for field in ARRIVAL_FIELDS}
+                arrival.update(portCallId=port_call_id, old_ata=minute_time(old_ata), ata=minute_time(ata))
+                self.add_arrival(arrival)
+            self.evict()
+
+    def add_arrival(self, arrival):
+        """Append an arrival and its index entries (lock held)."""
+        self.arrivals.append(arrival)
+        for field, index in self.arrival_indexes.items():
+            if arrival[field] is not None:
+                index[arrival[field]].append((self.appended, arrival))
+        self.appended += 1
+
+    def oldest_arrival(self):
+        """Number of the oldest arrival still kept."""
+        return self.appended - len(self.arrivals)
+
+    def evict(self):
+        """Drop port calls that departed before the retention window (lock held). Returns the number evicted."""
+        cutoff = self.cutoff()
+        expired = [record for record in self.voyages.values() if record["atd"] and record["atd"] < cutoff]
+        for record in expired:
+            self.unindex(record)
+            del self.voyages[record["portCallId"]]
+        oldest = self.oldest_arrival()
+        for index in self.arrival_indexes.values():
+            for value in [value for value, entries in index.items() if entries[0][0] < oldest]:
+                entries = index[value]
+                while entries and entries[0][0] < oldest:
+                    entries.popleft()
+                if not entries:
+                    del index[value]
+        return len(expired)
+
+    def select(self, filters):
+        """portCallIds matching all {field: value} filters through the index sets (lock held)."""
+        ids = None
+        for field, value in filters.items():
+            matches = self.indexes[field].get(value, set())
+            ids = set(matches) if ids is None else ids & matches
+        return self.voyages.keys() if ids is None else ids
+
+    def port_calls(self, port=None, imo=None, berth=None, in_port=False, limit=None):
+        """Cached port calls matching the filters ordered by eta; `in_port` keeps arrived and not departed ones."""
+        filters = {INDEXED_FIELDS[name]: value for name, value in (("port", port), ("imo", imo), ("berth", berth)) if value is not None}
+        with self.lock:
+            records = [self.voyages[port_call_id] for port_call_id in self.select(filters)]
+        if in_port:
+            records = [record for record in records if record["ata"] and not record["atd"]]
+        records.sort(key=lambda record: (record["eta"] or "", record["portCallId"]))
+        return records[:limit] if limit else records
+
+    def port_call(self, port_call_id):
+        with self.lock:
+            return self.voyages.get(port_call_id)
+
+    def latest_arrivals(self, port=None, imo=None, berth=None, limit=None):
+        """Newest arrivals first, optionally at one port, of one vessel or at one berth."""
+        filters = [(field, value) for field, value in (("portToVisit", port), ("imoLloyds", imo), ("berthCode", berth)) if value is not None]
+        limit = limit or READ_API_CONFIG["default_limit"]
+        found = []
+        with self.lock:
+            if filters:
+                # Walk the shortest index deque, newest first, and check the other filters
+                oldest = self.oldest_arrival()
+                entries = min((self.arrival_indexes[field].get(value, ()) for field, value in filters), key=len)
+                candidates = (arrival for number, arrival in reversed(entries) if number >= oldest)
+            else:
+                candidates = reversed(self.arrivals)
+            for arrival in candidates:
+                if all(arrival[field] == value for field, value in filters):
+                    found.append(arrival)
+                    if len(found) >= limit:
+                        break
+        return found
+
+def int_param(params, name):
+    """Integer query parameter, None if missing. Raises ValueError if it is not a number."""
+    value = params.get(name)
+    return None if value is None else int(value)
+
+def route(cache, path):
+    """Answer a GET request path, return (HTTP status, JSON-serialisable body)."""
+    url = urlsplit(path)
+    params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    parts = [part for part in url.path.split("/") if part]
+    try:
+        if parts == ["arrivals"]:
+            return 200, cache.latest_arrivals(params.get("port"), int_param(params, "imo"), params.get("berth"), int_param(params, "limit"))
+        if parts == ["port-calls"]:
+            in_port = params.get("in_port", "").lower() in ("1", "true", "yes")
+            return 200, cache.port_calls(params.get("port"), int_param(params, "imo"), params.get("berth"), in_port, int_param(params, "limit"))
+        if len(parts) == 2 and parts[0] == "port-calls":
+            record = cache.port_call(int(parts[1]))
+            return (200, record) if record is not None else (404, {"error": "unknown port call"})
+        if parts == ["health"]:
+            return 200, {"warmed": cache.warmed, "voyages": len(cache.voyages), "arrivals": len(cache.arrivals)}
+    except ValueError:
+        return 400, {"error": "imo, limit and port call ids must be integers"}
+    return 404, {"error": "not found"}
+
+def serve(cache, port, host="127.0.0.1"):
+    """Serve the read API for `cache` from background threads, return the server."""
+
+    class ReadApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep connections of polling dashboards open
+        disable_nagle_algorithm = True  # Headers and body are separate writes, do not wait for the ACK in between
+
+        def do_GET(self):
+            with metrics.stage("api_request"):
+                status, body = route(cache, self.path)
+                payload = json.dumps(body, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+            metrics.increment("api_requests")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReadApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="portman-api", daemon=True).start()
+    log(f"Serving the read API on http://{host}:{server.server_address[1]}/")
+    return server
+
+read_cache = None  # ReadCache of this process, created by start_read_api
+
+def get_read_cache():
+    """Return the process-wide ReadCache, creating it on first use."""
+    global read_cache
+    if read_cache is None:
+        read_cache = ReadCache()
+    return read_cache
+
+def start_read_api(port=None, host=None):
+    """Warm the read cache, keep it updated on every committed save and serve it. Returns the server."""
+    cache = get_read_cache()
+    try:
+        cache.warm()
+    except Exception as e:
+        metrics.increment("errors")
+        log(f"Error warming the read cache, starting empty: {e}")
+    add_commit_listener(cache.apply)
+    return serve(cache, port or READ_API_CONFIG["port"], host or READ_API_CONFIG["host"])
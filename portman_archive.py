@@ -0,0 +1,158 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import natsort
+from config import ARCHIVE_CONFIG
+from portman_agent import close_sink, create_database_and_tables, iter_port_call_rows, save_results_in_chunks
+from portman_log import log
+from portman_metrics import metrics
+from portman_stream import iter_port_calls
+
+ARCHIVE_VERSION = 1
+
+def port_call_key(entry):
+    """Return the portCallId of an entry as an int, None if it is missing or invalid."""
+    try:
+        return int(entry.get("portCallId"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def entry_digest(entry):
+    """Digest of the canonical JSON encoding of a port call entry."""
+    encoded = json.dumps(entry, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+def iter_archive(path):
+    """Yield (snapshot name, upserted entries, removed portCallIds) for each snapshot of an archive.
+
+    The upserted entries are read lazily and must be consumed before the next snapshot.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} portman archive")
+        for line in file:
+            snapshot = json.loads(line)
+            upserts = (json.loads(file.readline()) for _ in range(snapshot["upserts"]))
+            yield snapshot["snapshot"], upserts, snapshot["removed"]
+            for _ in upserts:
+                pass  # Skip entries the caller did not read
+
+def iter_snapshots(path):
+    """Yield (snapshot name, {portCallId: entry}) with the full contents of each archived snapshot."""
+    state = {}
+    for name, upserts, removed in iter_archive(path):
+        for entry in upserts:
+            state[port_call_key(entry)] = entry
+        for port_call_id in removed:
+            state.pop(port_call_id, None)
+        yield name, dict(state)
+
+class ArchiveWriter:
+    """Append snapshots to a deduplicated archive of portnet*.json files.
+
+    The archive is a gzip JSON-lines file: a header line, then for every snapshot a line
+    with its name, the number of upserted entries and the removed portCallIds, followed by
+    the upserted entries one per line. A port call is only stored again when its content
+    changed since the previous snapshot. Opening an existing archive replays it to restore
+    the digests, so new snapshots can be appended as gzip members later.
+    """
+
+    def __init__(self, path, compresslevel=None):
+        self.path = path
+        self.compresslevel = compresslevel or ARCHIVE_CONFIG["compresslevel"]
+        self.digests = {}  # portCallId -> digest of the last stored entry
+        self.snapshots = set()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            self.load()
+        self.file = gzip.open(path, "at", encoding="utf-8", compresslevel=self.compresslevel)
+        if new:
+            self.file.write(json.dumps({"format": "portman-archive", "version": ARCHIVE_VERSION}) + "\n")
+
+    def load(self):
+        """Restore the snapshot names and entry digests of an existing archive."""
+        for name, upserts, removed in iter_archive(self.path):
+            for entry in upserts:
+                self.digests[port_call_key(entry)] = entry_digest(entry)
+            for port_call_id in removed:
+                self.digests.pop(port_call_id, None)
+            self.snapshots.add(name)
+
+    def add(self, name, entries):
+        """Append one snapshot given its port call entries, return (upserted, removed) counts."""
+        upserts = []
+        seen = set()
+        for entry in entries:
+            key = port_call_key(entry)
+            digest = entry_digest(entry)
+            if key is None or self.digests.get(key) != digest:
+                upserts.append(entry)  # Entries without a valid portCallId are kept as they are
+            self.digests[key] = digest
+            seen.add(key)
+        removed = sorted(key for key in self.digests if key not in seen and key is not None)
+        for key in removed:
+            del self.digests[key]
+
+        self.file.write(json.dumps({"snapshot": name, "upserts": len(upserts), "removed": removed}) + "\n")
+        self.file.writelines(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n" for entry in upserts)
+        self.snapshots.add(name)
+        return len(upserts), len(removed)
+
+    def close(self):
+        self.file.close()
+
+def convert_directory(directory, path):
+    """Append the portnet*.json files of a directory that are not archived yet, in natural order. Returns the number added."""
+    sorted_files = natsort.natsorted(glob.glob(os.path.join(directory, "portnet*.json")))
+    writer = ArchiveWriter(path)
+    added = 0
+    try:
+        for filepath in sorted_files:
+            name = os.path.basename(filepath)
+            if name in writer.snapshots:
+                continue
+            upserted, removed = writer.add(name, iter_port_calls(filepath))
+            log(f"Archived {name}: {upserted} changed port calls, {removed} removed.")
+            added += 1
+    finally:
+        writer.close()
+    log(f"Archived {added} new snapshots of {directory} to {path} ({os.path.getsize(path)} bytes).")
+    return added
+
+def replay_archive(path, tracked_vessels, conn=None, cache=None):
+    """Save the changed port calls of every archived snapshot, giving the voyages and arrivals of replaying the raw files."""
+    total = 0
+    try:
+        for name, upserts, _ in iter_archive(path):
+            saved = save_results_in_chunks(iter_port_call_rows(upserts, tracked_vessels), conn, cache)
+            log(f"Replayed {name}, {saved} changed voyages saved.")
+            total += saved
+    except Exception as e:
+        metrics.increment("errors")
+        log(f"Error replaying archive {path}: {e}")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicated portnet snapshot archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Append the portnet*.json files of a directory to an archive")
+    convert.add_argument("directory")
+    convert.add_argument("archive")
+    replay = commands.add_parser("replay", help="Replay an archive into the database")
+    replay.add_argument("archive")
+    replay.add_argument("--imo", help="Comma-separated list of IMO numbers to track")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert_directory(args.directory, args.archive)
+    else:
+        create_database_and_tables()
+        replay_archive(args.archive, set(map(int, args.imo.split(","))) if args.imo else None)
+        close_sink()
+
+if __name__ == "__main__":
+    main()
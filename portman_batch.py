@@ -0,0 +1,114 @@
+import sys
+from array import array
+from collections.abc import Mapping
+
+# Fields produced by process_query, in the order of the original result dicts
+RESULT_FIELDS = (
+    "portCallId", "portCallTimestamp", "imoLloyds", "vesselTypeCode", "vesselName", "prevPort",
+    "portToVisit", "nextPort", "agentName", "shippingCompany", "eta", "ata", "portAreaCode",
+    "portAreaName", "berthCode", "berthName", "etd", "atd",
+    "passengersOnArrival", "passengersOnDeparture", "crewOnArrival", "crewOnDeparture"
+)
+
+# Large integer ids are stored in machine-word arrays instead of one int object each
+# (small counts such as passengers and crew are cached ints and stay in lists)
+INTEGER_FIELDS = frozenset({"portCallId", "imoLloyds"})
+
+# Low-cardinality strings repeated across port calls share one interned object
+INTERNED_FIELDS = frozenset({
+    "vesselName", "prevPort", "portToVisit", "nextPort", "agentName", "shippingCompany",
+    "portAreaCode", "portAreaName", "berthCode", "berthName"
+})
+
+FIELD_INDEX = {field: index for index, field in enumerate(RESULT_FIELDS)}
+
+def intern_value(value):
+    """Intern strings, pass other values through."""
+    return sys.intern(value) if type(value) is str else value
+
+class PortCallBatch:
+    """Columnar batch of processed port calls, one array per field in RESULT_FIELDS order.
+
+    Iterating or indexing yields read-only PortCallView mappings, so code written for the
+    previous list of result dicts keeps working. Writers read whole columns with
+    `column()` or tuples of selected fields with `rows()`.
+    """
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns=None):
+        self.columns = columns or [
+            array("q") if field in INTEGER_FIELDS else [] for field in RESULT_FIELDS
+        ]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a batch from tuples in RESULT_FIELDS order."""
+        batch = cls()
+        batch.extend(rows)
+        return batch
+
+    @classmethod
+    def from_dicts(cls, results):
+        """Build a batch from result dicts (or views)."""
+        return cls.from_rows(tuple(result[field] for field in RESULT_FIELDS) for result in results)
+
+    def append(self, row):
+        """Append one tuple in RESULT_FIELDS order."""
+        for field, column, value in zip(RESULT_FIELDS, self.columns, row):
+            column.append(intern_value(value) if field in INTERNED_FIELDS else value)
+
+    def extend(self, rows):
+        """Append tuples in RESULT_FIELDS order."""
+        for row in rows:
+            self.append(row)
+
+    def column(self, field):
+        """Return the array holding one field."""
+        return self.columns[FIELD_INDEX[field]]
+
+    def rows(self, fields=RESULT_FIELDS):
+        """Iterate tuples of the given fields."""
+        return zip(*(self.columns[FIELD_INDEX[field]] for field in fields))
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PortCallBatch([column[index] for column in self.columns])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PortCallBatch index out of range")
+        return PortCallView(self, index)
+
+    def __iter__(self):
+        return (PortCallView(self, index) for index in range(len(self)))
+
+    def __getstate__(self):
+        return self.columns
+
+    def __setstate__(self, state):
+        self.columns = state
+
+class PortCallView(Mapping):
+    """Read-only dict view of one port call in a PortCallBatch."""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, field):
+        return self.batch.columns[FIELD_INDEX[field]][self.index]
+
+    def __iter__(self):
+        return iter(RESULT_FIELDS)
+
+    def __len__(self):
+        return len(RESULT_FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,147 @@
+import math
+import random
+import zlib
+from config import CLUSTER_CONFIG, DATABASE_CONFIG
+from portman_batch import PortCallBatch
+from portman_log import log
+from portman_metrics import metrics
+
+PARTITION_FIELDS = {"port_call": "portCallId", "port": "portToVisit"}
+MEMBER_KEY = 2147483647  # Second key of the shared lock every running agent holds
+MAINTENANCE_KEY = 2147483646  # Second key of the transaction lock around schema and partition maintenance
+
+def partition_of(value, partitions, partition_by="port_call"):
+    """Partition of a port call given its portCallId or, with partition_by='port', its portToVisit LOCODE."""
+    if partition_by == "port":
+        return zlib.crc32((value or "").encode("utf-8")) % partitions
+    return int(value) % partitions
+
+def lock_maintenance(cursor, wait=False):
+    """Take the advisory lock serialising schema and partition maintenance between agents for this transaction.
+
+    Returns False at once if another agent holds it, unless `wait` blocks until it is released.
+    """
+    key = (CLUSTER_CONFIG["lock_namespace"], MAINTENANCE_KEY)
+    if wait:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s);", key)
+        cursor.fetchall()
+        return True
+    cursor.execute("SELECT pg_try_advisory_xact_lock(%s, %s);", key)
+    return cursor.fetchone()[0]
+
+class PartitionLeases:
+    """Work partitions of agents sharing one PostgreSQL database, leased with advisory locks.
+
+    Port calls are split into `partitions` partitions by portCallId or port LOCODE. Every
+    agent keeps a connection of its own, holding a shared member lock (namespace, MEMBER_KEY)
+    and an exclusive lock (namespace, partition) per partition it writes. `rebalance`, run
+    before every poll, releases partitions above an even share of ceil(partitions / members)
+    and takes free ones up to it. Session-level advisory locks end with the session, so the
+    partitions of an agent that dies or loses its connection are taken over by the others
+    on their next poll. A partition given away is unowned until the taker's next poll; the
+    taker then writes the full state of its port calls, so changes are delayed, not lost.
+    """
+
+    def __init__(self, partitions=None, partition_by=None, namespace=None):
+        self.partitions = partitions or CLUSTER_CONFIG["partitions"]
+        self.partition_by = partition_by or CLUSTER_CONFIG["partition_by"]
+        if self.partition_by not in PARTITION_FIELDS:
+            raise ValueError(f"Unknown cluster partitioning '{self.partition_by}', expected one of {tuple(PARTITION_FIELDS)}")
+        self.namespace = namespace or CLUSTER_CONFIG["lock_namespace"]
+        self.conn = None
+        self.owned = set()
+
+    def connect(self):
+        """Open the lease connection and join as a member."""
+        import pg8000
+        self.conn = pg8000.connect(
+            database=DATABASE_CONFIG["dbname"],
+            user=DATABASE_CONFIG["user"],
+            password=DATABASE_CONFIG["password"],
+            host=DATABASE_CONFIG["host"],
+            port=DATABASE_CONFIG["port"]
+        )
+        self.conn.autocommit = True  # Session-level locks, no transaction kept open
+        self.query("SELECT pg_advisory_lock_shared(%s, %s);", (self.namespace, MEMBER_KEY))
+        self.owned = set()
+
+    def query(self, statement, params):
+        cursor = self.conn.cursor()
+        cursor.execute(statement, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def locked(self):
+        """(members, partitions locked by any agent) from pg_locks."""
+        rows = self.query(
+            "SELECT objid, count(*) FROM pg_locks\n"
+            "WHERE locktype = 'advisory' AND classid = %s AND objsubid = 2 AND granted\n"
+            "GROUP BY objid;",
+            (self.namespace,)
+        )
+        members = sum(count for key, count in rows if key == MEMBER_KEY)
+        return members, {key for key, _ in rows if key < self.partitions}
+
+    def rebalance(self):
+        """Adjust the held partitions to an even share, return the partitions newly acquired.
+
+        On database errors all partitions are dropped (nothing is written) until the next call reconnects.
+        """
+        try:
+            if self.conn is None:
+                self.connect()
+            members, taken = self.locked()
+            share = math.ceil(self.partitions / max(members, 1))
+            for partition in sorted(self.owned)[share:]:
+                self.query("SELECT pg_advisory_unlock(%s, %s);", (self.namespace, partition))
+                self.owned.discard(partition)
+            acquired = set()
+            free = [partition for partition in range(self.partitions) if partition not in taken]
+            random.shuffle(free)  # Agents starting together try different partitions first
+            for partition in free:
+                if len(self.owned) >= share:
+                    break
+                if self.query("SELECT pg_try_advisory_lock(%s, %s);", (self.namespace, partition))[0][0]:
+                    self.owned.add(partition)
+                    acquired.add(partition)
+            if acquired:
+                log(f"Acquired partitions {sorted(acquired)}, holding {len(self.owned)} of {self.partitions} with {members} agents.")
+            return acquired
+        except Exception as e:
+            metrics.increment("errors")
+            log(f"Error rebalancing partition leases, writing nothing until reconnected: {e}")
+            self.close()
+            return set()
+
+    def verify(self):
+        """Return True if the lease connection, and with it the held locks, is still alive."""
+        if self.conn is None:
+            return False
+        try:
+            self.query("SELECT 1;", ())
+            return True
+        except Exception as e:
+            metrics.increment("errors")
+            log(f"Lost the partition leases: {e}")
+            self.close()
+            return False
+
+    def select(self, batch):
+        """The port calls of a PortCallBatch that belong to the held partitions."""
+        field = PARTITION_FIELDS[self.partition_by]
+        owned = self.owned
+        keys = batch.column(field)
+        return PortCallBatch.from_rows(
+            row for row, key in zip(batch.rows(), keys) if partition_of(key, self.partitions, self.partition_by) in owned
+        )
+
+    def close(self):
+        """Release all leases by closing the lease connection."""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass  # The session is gone either way, and its locks with it
+        self.conn = None
+        self.owned = set()
@@ -0,0 +1,195 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from config import EVENTS_CONFIG
+from portman_log import log
+from portman_metrics import metrics
+
+# Port call fields copied into arrival events
+EVENT_FIELDS = (
+    "portCallId", "portCallTimestamp", "imoLloyds", "vesselName", "portToVisit", "portAreaName", "berthName",
+    "eta", "etd", "atd", "passengersOnArrival", "passengersOnDeparture", "crewOnArrival", "crewOnDeparture"
+)
+
+OVERFLOW_POLICIES = ("block", "drop")
+
+def event_time(value):
+    """Return a timestamp (datetime or ISO-8601 string) as an ISO-8601 string."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def arrival_event(entry, ata):
+    """Build a JSON-serialisable arrival event from a processed port call and its new ata."""
+    event = {field: entry[field] for field in EVENT_FIELDS}
+    event["ata"] = event_time(ata)
+    return event
+
+def display_time(value):
+    """Format a timestamp (datetime or ISO-8601 string) as 'YYYY-MM-DD HH:MM' for display."""
+    if not value:
+        return "N/A"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    return value[:16].replace("T", " ")
+
+def format_arrival(event):
+    """Format an arrival event as the agent's multi-line text message."""
+    return (
+        f"-----------------------------\n"
+        f"Port Call ID: {event["portCallId"]}\n"
+        f"Port Call Time Stamp: {event["portCallTimestamp"]}\n\n"
+        f"Aluksen IMO/nimi: {event["imoLloyds"]}/{event["vesselName"]}\n\n"
+        f"Satamakoodi: {event["portToVisit"]}\n"
+        f"Satama: {event["portAreaName"]}\n"
+        f"Laituri: {event["berthName"]}\n\n"
+        f"Saapuminen\n"
+        f"Arvioitu saapumisaika (UTC): {display_time(event["eta"])}\n"
+        f"Toteutunut saapumisaika (UTC): {display_time(event["ata"])}\n"
+        f"Miehistön lukumäärä: {event["crewOnArrival"]}\n"
+        f"Matkustajien lukumäärä: {event["passengersOnArrival"]}\n\n"
+        f"Lähtö\n"
+        f"Arvioitu lähtöaika (UTC): {display_time(event["etd"])}\n"
+        f"Toteutunut lähtöaika (UTC): {display_time(event["atd"])}\n"
+        f"Miehistön lukumäärä: {event["crewOnDeparture"]}\n"
+        f"Matkustajien lukumäärä: {event["passengersOnDeparture"]}\n"
+    )
+
+class StdoutOutput:
+    """Print arrival events as text messages."""
+
+    def emit(self, events):
+        print("\n".join(format_arrival(event) for event in events), flush=True)
+
+    def close(self):
+        pass
+
+class JsonLinesOutput:
+    """Append arrival events to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def emit(self, events):
+        self.file.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class WebhookOutput:
+    """POST batches of arrival events as a JSON array to an HTTP endpoint."""
+
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.timeout = timeout or EVENTS_CONFIG["webhook_timeout"]
+        import requests  # Only loaded when the webhook output is configured
+        self.session = requests.Session()
+
+    def emit(self, events):
+        response = self.session.post(self.url, json=events, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+def outputs_from_config():
+    """Create the outputs listed in EVENTS_CONFIG["outputs"]."""
+    outputs = []
+    for name in EVENTS_CONFIG["outputs"]:
+        if name == "stdout":
+            outputs.append(StdoutOutput())
+        elif name == "jsonl" and EVENTS_CONFIG["jsonl_file"]:
+            outputs.append(JsonLinesOutput(EVENTS_CONFIG["jsonl_file"]))
+        elif name == "webhook" and EVENTS_CONFIG["webhook_url"]:
+            outputs.append(WebhookOutput(EVENTS_CONFIG["webhook_url"]))
+        else:
+            log(f"Ignoring arrival event output '{name}' (unknown or not configured).")
+    return outputs
+
+class ArrivalSink:
+    """Deliver arrival events to outputs from a background thread.
+
+    `publish` puts events on a bounded queue and returns; the worker takes up to
+    `batch_size` queued events at a time (waiting at most `flush_interval` seconds for
+    a batch to fill) and hands them to every output. When the queue is full, the 'block'
+    policy makes publishers wait for the worker (backpressure), 'drop' discards the event.
+    A failing output is logged and does not stop the others.
+    """
+
+    STOP = object()
+
+    def __init__(self, outputs=None, queue_size=None, batch_size=None, flush_interval=None, overflow=None):
+        self.outputs = outputs_from_config() if outputs is None else outputs
+        self.batch_size = batch_size or EVENTS_CONFIG["batch_size"]
+        self.flush_interval = EVENTS_CONFIG["flush_interval"] if flush_interval is None else flush_interval
+        self.overflow = overflow or EVENTS_CONFIG["overflow"]
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{self.overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.queue = queue.Queue(queue_size or EVENTS_CONFIG["queue_size"])
+        self.dropped = 0
+        self.worker = threading.Thread(target=self.run, name="portman-events", daemon=True)
+        self.worker.start()
+
+    def publish(self, event):
+        """Queue an event for delivery, return False if it was dropped."""
+        if self.overflow == "block":
+            self.queue.put(event)
+            return True
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.increment("arrival_events_dropped")
+            return False
+
+    def next_batch(self):
+        """Wait for one event, then collect more until the batch is full or flush_interval passed."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not self.STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """Worker loop delivering batches until the stop marker is received."""
+        while True:
+            batch = self.next_batch()
+            stop = batch[-1] is self.STOP
+            events = batch[:-1] if stop else batch
+            if events:
+                self.emit(events)
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def emit(self, events):
+        """Hand a batch to every output."""
+        with metrics.stage("emit"):
+            for output in self.outputs:
+                try:
+                    output.emit(events)
+                except Exception as e:
+                    metrics.increment("errors")
+                    log(f"Error emitting {len(events)} arrival events to {type(output).__name__}: {e}")
+        metrics.increment("arrival_events_emitted", len(events))
+
+    def flush(self):
+        """Wait until all queued events have been delivered."""
+        self.queue.join()
+
+    def close(self):
+        """Deliver the queued events, stop the worker and close the outputs."""
+        if self.worker.is_alive():
+            self.queue.put(self.STOP)
+            self.worker.join()
+        for output in self.outputs:
+            output.close()
+        if self.dropped:
+            log(f"Dropped {self.dropped} arrival events because the event queue was full.")
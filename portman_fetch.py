@@ -0,0 +1,132 @@
+import json
+import os
+from config import API_CONFIG
+from portman_metrics import metrics
+
+NOT_MODIFIED = object()  # Returned by PortCallFetcher.fetch() when the API answers 304
+
+class PortCallFetcher:
+    """Fetch port calls over a persistent HTTP session with conditional and incremental requests.
+
+    The session keeps connections alive and asks for gzip responses. ETag/Last-Modified
+    validators of the previous response are sent back so an unchanged feed costs a 304.
+    In delta mode the API's `from` parameter is set to the newest portCallTimestamp seen,
+    so only recently changed port calls are transferred. With a state file the validators
+    and the delta position survive restarts. `query` adds fixed query parameters, e.g.
+    {"locode": "FIHEL"} to fetch one slice of the port calls.
+
+    The validators and delta position of a response stay pending until `commit` is called
+    once its port calls are stored; `discard` drops them, so the next fetch asks for the
+    same port calls again.
+    """
+
+    def __init__(self, url=None, delta=None, timeout=None, state_file=None, session=None, query=None):
+        self.url = url or API_CONFIG["url"]
+        self.query = dict(query or {})
+        self.delta = API_CONFIG["delta"] if delta is None else delta
+        self.timeout = timeout or API_CONFIG["timeout"]
+        self.state_file = state_file if state_file is not None else API_CONFIG["state_file"]
+        if session is None:
+            import requests  # Loaded on first use, file mode runs never need it
+            session = requests.Session()
+        self.session = session
+        self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        self.etag = None
+        self.last_modified = None
+        self.validated_params = None  # Query parameters the validators belong to
+        self.last_timestamp = None
+        self.pending = None  # (etag, last_modified, params, last_timestamp) of the last response until committed
+        self.bytes_fetched = 0
+        self.load_state()
+
+    def params(self):
+        """Query parameters of the next request."""
+        params = dict(self.query)
+        if self.delta and self.last_timestamp:
+            params["from"] = self.last_timestamp
+        return params
+
+    def fetch(self):
+        """Fetch the port calls, returning the decoded JSON or NOT_MODIFIED. Raises requests exceptions."""
+        params = self.params()
+        headers = {}
+        if params == self.validated_params:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        with metrics.stage("fetch"):
+            response = self.session.get(self.url, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            metrics.increment("fetch_not_modified")
+            return NOT_MODIFIED
+        response.raise_for_status()
+
+        with metrics.stage("decode"):
+            data = response.json()
+        self.bytes_fetched = response.raw.tell() or len(response.content)  # Compressed bytes on the wire
+        metrics.increment("bytes_fetched", self.bytes_fetched)
+        self.pending = (response.headers.get("ETag"), response.headers.get("Last-Modified"), params, self.advance(data))
+        return data
+
+    def advance(self, data):
+        """Return the delta position after a response: its newest portCallTimestamp if newer than the current one."""
+        port_calls = data.get("portCalls", []) if isinstance(data, dict) else data
+        timestamps = [entry.get("portCallTimestamp") for entry in port_calls if isinstance(entry, dict)]
+        latest = max(filter(None, timestamps), default=None)
+        if latest and (self.last_timestamp is None or latest > self.last_timestamp):
+            return latest
+        return self.last_timestamp
+
+    def commit(self):
+        """Adopt the validators and delta position of the last response once its port calls are stored, and persist them."""
+        if self.pending is None:
+            return
+        self.etag, self.last_modified, self.validated_params, self.last_timestamp = self.pending
+        self.pending = None
+        self.save_state()
+
+    def discard(self):
+        """Drop the state of the last response after failing to store it, so the next fetch repeats it."""
+        self.pending = None
+
+    def load_state(self):
+        """Restore validators and the delta position from the state file."""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        with open(self.state_file, "r", encoding="utf-8") as file:
+            state = json.load(file)
+        if state.get("url") != self.url or state.get("query", {}) != self.query:
+            return
+        self.etag = state.get("etag")
+        self.last_modified = state.get("last_modified")
+        self.validated_params = state.get("params")
+        self.last_timestamp = state.get("last_timestamp")
+
+    def save_state(self):
+        """Persist validators and the delta position to the state file."""
+        if not self.state_file:
+            return
+        state = {
+            "url": self.url,
+            "query": self.query,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "params": self.validated_params,
+            "last_timestamp": self.last_timestamp
+        }
+        with open(self.state_file, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+
+    def reset(self):
+        """Forget the validators and the delta position, so the next fetch returns all port calls."""
+        self.etag = None
+        self.last_modified = None
+        self.validated_params = None
+        self.last_timestamp = None
+        self.pending = None
+
+    def close(self):
+        """Close the HTTP session."""
+        self.session.close()
@@ -0,0 +1,97 @@
+import json
+import os
+from config import INDEX_CONFIG
+from portman_log import log
+from portman_stream import JsonArrayStream
+
+INDEX_VERSION = 1
+
+def index_file(filepath):
+    """Return the index record of one snapshot file: size, mtime and byte ranges of the entries per IMO."""
+    stat = os.stat(filepath)
+    imos = {}
+    # latin-1 maps every byte to one character, so stream offsets are byte offsets
+    with open(filepath, "r", encoding="latin-1") as file:
+        for entry, start, end in JsonArrayStream(file).elements():
+            try:
+                imo = int(entry.get("imoLloyds"))
+            except (AttributeError, TypeError, ValueError):
+                continue  # Entries without an IMO never match tracked vessels
+            imos.setdefault(str(imo), []).append([start, end])
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "imos": imos}
+
+def iter_indexed_entries(filepath, ranges):
+    """Decode only the entries at the given byte ranges of a snapshot file."""
+    with open(filepath, "rb") as file:
+        for start, end in ranges:
+            file.seek(start)
+            yield json.loads(file.read(end - start))
+
+class SnapshotIndex:
+    """Sidecar index of which IMO numbers appear in the portnet*.json files of a directory.
+
+    For every file the index keeps its size and mtime and the byte ranges of the entries of
+    each IMO number, so tracked-vessel runs can skip files without matches and decode only
+    the matching entries. `update` indexes new and changed files and forgets removed ones;
+    the index is stored as JSON next to the snapshots.
+    """
+
+    def __init__(self, directory, filename=None):
+        self.path = os.path.join(directory, filename or INDEX_CONFIG["file"])
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """Read the index file, starting empty if it is missing, unreadable or outdated."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log(f"Ignoring unreadable snapshot index {self.path}: {e}")
+            return
+        if data.get("version") == INDEX_VERSION:
+            self.files = data.get("files", {})
+
+    def save(self):
+        """Write the index atomically."""
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump({"version": INDEX_VERSION, "files": self.files}, file, separators=(",", ":"))
+            os.replace(temporary, self.path)
+        except OSError as e:
+            log(f"Error writing snapshot index {self.path}: {e}")
+
+    def update(self, filepaths):
+        """Index new or changed files, drop removed ones and save if anything changed. Returns the number of files indexed."""
+        names = {os.path.basename(filepath): filepath for filepath in filepaths}
+        removed = [name for name in self.files if name not in names]
+        for name in removed:
+            del self.files[name]
+
+        indexed = 0
+        for name, filepath in names.items():
+            record = self.files.get(name)
+            try:
+                stat = os.stat(filepath)
+                if record and record["size"] == stat.st_size and record["mtime"] == stat.st_mtime:
+                    continue
+                self.files[name] = index_file(filepath)
+                indexed += 1
+            except Exception as e:
+                self.files.pop(name, None)
+                log(f"Could not index {filepath}, it will be read in full: {e}")
+
+        if indexed or removed:
+            self.save()
+        return indexed
+
+    def ranges(self, filepath, imos):
+        """Byte ranges of the entries of the given IMO numbers in file order, None if the file is not indexed."""
+        record = self.files.get(os.path.basename(filepath))
+        if record is None:
+            return None
+        ranges = [tuple(span) for imo in imos for span in record["imos"].get(str(imo), [])]
+        return sorted(ranges)
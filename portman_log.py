@@ -0,0 +1,6 @@
+from datetime import datetime
+
+def log(message):
+    """Log a message with a timestamp."""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
@@ -0,0 +1,200 @@
+import json
+import threading
+import time
+from config import METRICS_CONFIG
+from portman_log import log
+
+# Counters exported with HELP texts, present (as 0) from startup
+COUNTERS = {
+    "polls": "Polls started",
+    "polls_skipped": "Polls skipped because the previous poll was still running",
+    "bytes_fetched": "Response bytes received from the port calls API",
+    "fetch_not_modified": "API responses answered with 304 Not Modified",
+    "port_calls_parsed": "Port call entries read from the API or files",
+    "port_calls_filtered": "Port calls skipped because their vessel is not tracked",
+    "port_calls_invalid": "Port calls skipped because of an invalid portCallId",
+    "rows_written": "Voyage rows staged and upserted",
+    "rows_unchanged": "Voyage rows skipped by the state cache",
+    "arrivals_detected": "Arrivals inserted into the arrivals table",
+    "arrival_events_emitted": "Arrival events delivered to the event outputs",
+    "arrival_events_dropped": "Arrival events dropped because the event queue was full",
+    "db_round_trips": "Statements sent to the database",
+    "spool_bytes_written": "Bytes appended to the snapshot spool",
+    "spool_queue_overflows": "Spooled snapshots read back from disk because the writer queue was full",
+    "spool_batches_flushed": "Spooled snapshots written to the database",
+    "spool_batches_rejected": "Spooled snapshots moved aside because they cannot be written",
+    "api_requests": "Requests answered by the read API",
+    "errors": "Errors while fetching, reading or saving"
+}
+
+class StageTimer:
+    """Context manager adding the duration of one stage run to Metrics."""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullStage:
+    """Shared no-op stage used while metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_STAGE = NullStage()
+
+class CountingCursor:
+    """DB-API cursor proxy counting statements sent to the database."""
+
+    def __init__(self, cursor, metrics):
+        self.cursor = cursor
+        self.metrics = metrics
+
+    def execute(self, *args, **kwargs):
+        self.metrics.increment("db_round_trips")
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, query, params):
+        params = list(params)
+        self.metrics.increment("db_round_trips", len(params))
+        return self.cursor.executemany(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class Metrics:
+    """Process-wide counters and stage timers of the agent.
+
+    Stage timers record count, total and maximum duration per stage name. While disabled,
+    `increment` returns immediately and `stage` returns a shared no-op context manager,
+    so instrumented code costs two attribute checks. Export with `prometheus_text()`,
+    `serve(port)` (GET /metrics) or `dump_json(path)`. While a ProfileSession
+    (portman_profile.py) is set as `profiler`, stages are also profiled by it.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.stages = {}  # name -> [count, total seconds, max seconds]
+        self.started = time.time()
+        self.server = None
+        self.profiler = None
+
+    def increment(self, name, value=1):
+        """Add `value` to a counter."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stage(self, name):
+        """Context manager timing one run of a stage."""
+        if self.profiler is not None:
+            return self.profiler.stage(name, StageTimer(self, name) if self.enabled else None)
+        if not self.enabled:
+            return NULL_STAGE
+        return StageTimer(self, name)
+
+    def observe(self, name, seconds):
+        """Record one stage duration."""
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+
+    def cursor(self, cursor):
+        """Wrap a cursor to count database round trips while enabled."""
+        return CountingCursor(cursor, self) if self.enabled else cursor
+
+    def snapshot(self):
+        """Return counters and stage timings as a JSON-serialisable dict."""
+        with self.lock:
+            return {
+                "started": self.started,
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "stages": {
+                    name: {"count": count, "total_seconds": round(total, 6), "max_seconds": round(longest, 6)}
+                    for name, (count, total, longest) in self.stages.items()
+                }
+            }
+
+    def prometheus_text(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            metric = f"portman_{name}_total"
+            lines.append(f"# HELP {metric} {COUNTERS.get(name, name)}")
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        stages = snapshot["stages"]
+        lines.append("# HELP portman_stage_duration_seconds Time spent per agent stage")
+        lines.append("# TYPE portman_stage_duration_seconds summary")
+        for name, stage in stages.items():
+            lines.append(f'portman_stage_duration_seconds_sum{{stage="{name}"}} {stage["total_seconds"]}')
+            lines.append(f'portman_stage_duration_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines.append("# HELP portman_stage_duration_seconds_max Longest run per agent stage")
+        lines.append("# TYPE portman_stage_duration_seconds_max gauge")
+        for name, stage in stages.items():
+            lines.append(f'portman_stage_duration_seconds_max{{stage="{name}"}} {stage["max_seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path):
+        """Write the current snapshot to a JSON file."""
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(self.snapshot(), file, indent=2)
+        except OSError as e:
+            log(f"Error writing metrics to {path}: {e}")
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve GET /metrics from a background thread, return the bound port."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="portman-metrics", daemon=True).start()
+        log(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server.server_address[1]
+
+    def close(self):
+        """Stop the HTTP server."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+metrics = Metrics(METRICS_CONFIG["enabled"])
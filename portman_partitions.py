@@ -0,0 +1,139 @@
+import re
+from datetime import date, datetime, timedelta
+from config import PARTITION_CONFIG
+from portman_log import log
+
+# Partition key and name pattern of the range partitions per table
+PARTITION_KEYS = {"voyages": "portCallId", "arrivals": "ata"}
+ARRIVAL_PARTITION = re.compile(r"^arrivals_(\d{4})_(\d{2})$")
+VOYAGE_PARTITION = re.compile(r"^voyages_p(\d+)$")
+RETENTION_ACTIONS = ("archive", "detach", "drop")
+
+def add_months(month, months):
+    """First day of the month `months` after the month of `month`."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def arrival_partition_name(month):
+    return f"arrivals_{month.year:04d}_{month.month:02d}"
+
+def voyage_partition_name(low):
+    return f"voyages_p{low}"
+
+def is_partitioned(cursor, table):
+    """Return True if `table` (resolved via search_path) is a partitioned table."""
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s);", (table,))
+    return cursor.fetchone() is not None
+
+def list_partitions(cursor, table):
+    """Names of the partitions attached to `table`."""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s);",
+        (table,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+def bound_literal(value):
+    """SQL literal of a partition bound (internally generated dates and integers only)."""
+    return f"'{value.isoformat()}'" if isinstance(value, date) else str(int(value))
+
+def create_partition(cursor, table, name, low, high):
+    """Create the range partition [low, high) of `table`, moving matching rows out of its default partition."""
+    key = PARTITION_KEYS[table]
+    default = f"{table}_default"
+    bounds = f"{key} >= {bound_literal(low)} AND {key} < {bound_literal(high)}"
+    cursor.execute(f"SELECT count(*) FROM {default} WHERE {bounds};")
+    moving = cursor.fetchone()[0]
+    if moving:
+        # A new partition may not overlap rows in the default partition
+        cursor.execute(f"CREATE TEMP TABLE partition_moving (LIKE {table});")
+        cursor.execute(f"WITH moved AS (DELETE FROM {default} WHERE {bounds} RETURNING *) INSERT INTO partition_moving SELECT * FROM moved;")
+    cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({bound_literal(low)}) TO ({bound_literal(high)});")
+    if moving:
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM partition_moving;")
+        cursor.execute("DROP TABLE partition_moving;")
+    log(f"Created partition {name} of {table}" + (f", moved {moving} rows from {default}." if moving else "."))
+
+def retire_partition(cursor, table, name, action=None):
+    """Detach an old partition and archive (move to the archive schema), keep or drop it."""
+    action = action or PARTITION_CONFIG["retention_action"]
+    if action not in RETENTION_ACTIONS:
+        raise ValueError(f"Unknown retention action '{action}', expected one of {RETENTION_ACTIONS}")
+    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+    if action == "drop":
+        cursor.execute(f"DROP TABLE {name};")
+    elif action == "archive":
+        schema = PARTITION_CONFIG["archive_schema"]
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (f"{schema}.{name}",))
+        if cursor.fetchone()[0]:  # Retired before, e.g. a voyages range that got new rows later
+            cursor.execute(f"INSERT INTO {schema}.{name} SELECT * FROM {name};")
+            cursor.execute(f"DROP TABLE {name};")
+        else:
+            cursor.execute(f"ALTER TABLE {name} SET SCHEMA {schema};")
+    log(f"Retired partition {name} of {table} ({action}).")
+
+def maintain_arrival_partitions(cursor, today):
+    """Create monthly arrivals partitions up to `months_ahead`, split the default partition into months, retire old months."""
+    current = today.replace(day=1)
+    cutoff = add_months(current, -PARTITION_CONFIG["retention_months"])
+    existing = list_partitions(cursor, "arrivals")
+
+    cursor.execute("SELECT DISTINCT date_trunc('month', ata) FROM arrivals_default;")
+    months = {value.date() if isinstance(value, datetime) else value for (value,) in cursor.fetchall()}
+    months.update(add_months(current, offset) for offset in range(-1, PARTITION_CONFIG["months_ahead"] + 1))
+    for month in sorted(months):
+        name = arrival_partition_name(month)
+        if name not in existing:
+            create_partition(cursor, "arrivals", name, month, add_months(month, 1))
+
+    for name in sorted(list_partitions(cursor, "arrivals")):
+        match = ARRIVAL_PARTITION.match(name)
+        if match and add_months(date(int(match[1]), int(match[2]), 1), 1) <= cutoff:
+            retire_partition(cursor, "arrivals", name)
+
+def maintain_voyage_partitions(cursor, today):
+    """Create portCallId range partitions ahead of the newest port call, split the default, retire ranges untouched for the retention period."""
+    size = PARTITION_CONFIG["voyage_partition_size"]
+    existing = list_partitions(cursor, "voyages")
+
+    cursor.execute(f"SELECT DISTINCT portCallId / {size} FROM voyages_default;")
+    ranges = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT max(portCallId) FROM voyages;")
+    newest = cursor.fetchone()[0]
+    current = newest // size if newest is not None else None
+    if current is not None:
+        ranges.update(range(current, current + PARTITION_CONFIG["voyage_partitions_ahead"] + 1))
+    for number in sorted(ranges):
+        name = voyage_partition_name(number * size)
+        if name not in existing:
+            create_partition(cursor, "voyages", name, number * size, (number + 1) * size)
+
+    if current is None:
+        return
+    # Port calls leave the API feed long before this, so their rows are no longer updated
+    cutoff = today - timedelta(days=30 * PARTITION_CONFIG["retention_months"])
+    for name in sorted(list_partitions(cursor, "voyages")):
+        match = VOYAGE_PARTITION.match(name)
+        if not match or int(match[1]) + size > current * size:
+            continue  # Never retire the range of the newest port calls or later ones
+        cursor.execute(f"SELECT max(modified) FROM {name};")
+        modified = cursor.fetchone()[0]
+        if modified is None or modified.date() < cutoff:
+            retire_partition(cursor, "voyages", name)
+
+def maintain_partitions(cursor, today=None):
+    """Create the default and upcoming partitions, compact the default partitions and apply retention.
+
+    Does nothing (apart from a log line) if the tables exist but are not partitioned, as
+    existing tables are not converted.
+    """
+    today = today or date.today()
+    for table in PARTITION_KEYS:
+        if not is_partitioned(cursor, table):
+            log(f"Table {table} is not partitioned, skipping partition maintenance (existing tables are not converted).")
+            return
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+    maintain_arrival_partitions(cursor, today)
+    maintain_voyage_partitions(cursor, today)
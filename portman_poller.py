@@ -1,94 +1,310 @@
-import requests
+import argparse
+import asyncio
+import hashlib
 import json
-import time
+import os
+import requests
+from urllib.parse import parse_qsl
+from config import API_CONFIG, POLLER_CONFIG
+from portman_fetch import NOT_MODIFIED, PortCallFetcher
 
-def fetch_data_from_api():
-    """Fetch JSON data from the API."""
-    url = "https://meri.digitraffic.fi/api/port-call/v1/port-calls"
-    print("Fetching data from the API...")
-    response = requests.get(url)
-    response.raise_for_status()  # Raise an error if the request fails
-    return response.json()
+def parse_slices(text):
+    """Parse 'locode=FIHEL;imo=9606900&locode=FITKU' into a list of query dicts, [{}] (everything) if empty."""
+    slices = [dict(parse_qsl(part.strip())) for part in text.split(";") if part.strip()]
+    return slices or [{}]
 
-def format_port_calls(data):
-    """Format and display port call data."""
+# Fields shown per port call; portCallTimestamp changes with any update, so diffs ignore it
+DISPLAY_FIELDS = (
+    "portCallId", "portCallTimestamp", "imoLloyds", "vesselName", "portToVisit", "portAreaName", "berthName",
+    "eta", "ata", "arrivalCrew", "arrivalPassengers", "etd", "atd", "departureCrew", "departurePassengers"
+)
+DIFF_FIELDS = tuple(field for field in DISPLAY_FIELDS if field not in ("portCallId", "portCallTimestamp"))
+
+def port_call_list(data):
+    """Return the list of port calls of the JSON data, None (after printing why) if there is none."""
     # Ensure data is a list
     if isinstance(data, dict):  # If the root is a dictionary, try extracting an array
         if "portCalls" in data:
             data = data["portCalls"]
         else:
             print("Error: JSON data does not contain an array or 'portCalls' key.")
-            return
+            return None
 
     if not isinstance(data, list):  # Still not a list, abort
         print("Error: JSON data should be an array.")
-        return
+        return None
+    return data
+
+def port_call_fields(entry):
+    """Extract the displayed fields of a port call entry."""
+    # Extract portAreaName, berthName and timestamps from "portAreaDetails"
+    port_area_details = entry.get("portAreaDetails", [])
+    area = port_area_details[0] if port_area_details else {}
+
+    # Extract Arrival and Departure data from "imoInformation" array
+    imo_info = entry.get("imoInformation", [])
+    arrival_info = next((info for info in imo_info if info.get("imoGeneralDeclaration") == "Arrival"), {})
+    departure_info = next((info for info in imo_info if info.get("imoGeneralDeclaration") == "Departure"), {})
+
+    return {
+        "portCallId": entry.get("portCallId", "N/A"),
+        "portCallTimestamp": entry.get("portCallTimestamp", "N/A"),
+        "imoLloyds": entry.get("imoLloyds", "N/A"),
+        "vesselName": entry.get("vesselName", "N/A"),
+        "portToVisit": entry.get("portToVisit", "N/A"),
+        "portAreaName": area.get("portAreaName", "N/A"),
+        "berthName": area.get("berthName", "N/A"),
+        "eta": area.get("eta", "N/A"),
+        "ata": area.get("ata", "N/A"),
+        "arrivalCrew": arrival_info.get("numberOfCrew", "N/A"),
+        "arrivalPassengers": arrival_info.get("numberOfPassangers", "N/A"),
+        "etd": area.get("etd", "N/A"),
+        "atd": area.get("atd", "N/A"),
+        "departureCrew": departure_info.get("numberOfCrew", "N/A"),
+        "departurePassengers": departure_info.get("numberOfPassangers", "N/A")
+    }
+
+def format_port_call(fields):
+    """Format the fields of one port call as a text block."""
+    return (
+        f"-----------------------------\n"
+        f"Port Call ID: {fields["portCallId"]}\n"
+        f"Port Call Time Stamp: {fields["portCallTimestamp"]}\n\n"
+        f"Aluksen IMO/nimi: {fields["imoLloyds"]}/{fields["vesselName"]}\n\n"
+        f"Satamakoodi: {fields["portToVisit"]}\n"
+        f"Satama: {fields["portAreaName"]}\n"
+        f"Laituri: {fields["berthName"]}\n\n"
+        f"Saapuminen\n"
+        f"Arvioitu saapumisaika (UTC): {fields["eta"]}\n"
+        f"Toteutunut saapumisaika (UTC): {fields["ata"]}\n"
+        f"Miehistön lukumäärä: {fields["arrivalCrew"]}\n"
+        f"Matkustajien lukumäärä: {fields["arrivalPassengers"]}\n\n"
+        f"Lähtö\n"
+        f"Arvioitu lähtöaika (UTC): {fields["etd"]}\n"
+        f"Toteutunut lähtöaika (UTC): {fields["atd"]}\n"
+        f"Miehistön lukumäärä: {fields["departureCrew"]}\n"
+        f"Matkustajien lukumäärä: {fields["departurePassengers"]}\n"
+    )
 
+def format_port_calls(data):
+    """Format and display port call data."""
+    data = port_call_list(data)
+    if data is None:
+        return
     for entry in data:
-        # Extract required fields
-        port_call_id = entry.get("portCallId", "N/A")
-        port_call_timestamp = entry.get("portCallTimestamp", "N/A")
-        imo_lloyds = entry.get("imoLloyds", "N/A")
-        vessel_name = entry.get("vesselName", "N/A")
-        port_to_visit = entry.get("portToVisit", "N/A")
-
-        # Extract portAreaName and berthName from "portAreaDetails"
-        port_area_details = entry.get("portAreaDetails", [])
-        port_area_name = port_area_details[0].get("portAreaName", "N/A") if port_area_details else "N/A"
-        berth_name = port_area_details[0].get("berthName", "N/A") if port_area_details else "N/A"
-        eta = port_area_details[0].get("eta", "N/A") if port_area_details else "N/A"
-        ata = port_area_details[0].get("ata", "N/A") if port_area_details else "N/A"
-        etd = port_area_details[0].get("etd", "N/A") if port_area_details else "N/A"
-        atd = port_area_details[0].get("atd", "N/A") if port_area_details else "N/A"
-
-        # Extract Arrival and Departure data from "imoInformation" array
-        imo_info = entry.get("imoInformation", [])
-        arrival_info = next((info for info in imo_info if info.get("imoGeneralDeclaration") == "Arrival"), {})
-        departure_info = next((info for info in imo_info if info.get("imoGeneralDeclaration") == "Departure"), {})
-
-        arrival_crew = arrival_info.get("numberOfCrew", "N/A")
-        arrival_passengers = arrival_info.get("numberOfPassangers", "N/A")
-        departure_crew = departure_info.get("numberOfCrew", "N/A")
-        departure_passengers = departure_info.get("numberOfPassangers", "N/A")
-
-        # Format the output
-        print(
-            f"-----------------------------\n"
-            f"Port Call ID: {port_call_id}\n"
-            f"Port Call Time Stamp: {port_call_timestamp}\n\n"
-            f"Aluksen IMO/nimi: {imo_lloyds}/{vessel_name}\n\n"
-            f"Satamakoodi: {port_to_visit}\n"
-            f"Satama: {port_area_name}\n"
-            f"Laituri: {berth_name}\n\n"
-            f"Saapuminen\n"
-            f"Arvioitu saapumisaika (UTC): {eta}\n"
-            f"Toteutunut saapumisaika (UTC): {ata}\n"
-            f"Miehistön lukumäärä: {arrival_crew}\n"
-            f"Matkustajien lukumäärä: {arrival_passengers}\n\n"
-            f"Lähtö\n"
-            f"Arvioitu lähtöaika (UTC): {etd}\n"
-            f"Toteutunut lähtöaika (UTC): {atd}\n"
-            f"Miehistön lukumäärä: {departure_crew}\n"
-            f"Matkustajien lukumäärä: {departure_passengers}\n"
-        )
+        print(format_port_call(port_call_fields(entry)))
 
-def main():
-    print("Polling program started. Press Ctrl+C to stop.")
-    try:
+def field_hash(fields):
+    """Stable digest of the compared fields of a port call."""
+    encoded = json.dumps([fields.get(field) for field in DIFF_FIELDS], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=12).hexdigest()
+
+def format_change(fields, changes):
+    """Format a changed port call as a header and one line per changed field."""
+    lines = [
+        f"-----------------------------",
+        f"Port Call ID: {fields["portCallId"]} changed ({fields["imoLloyds"]}/{fields["vesselName"]}, {fields["portToVisit"]})"
+    ]
+    lines.extend(f"  {field}: {old} -> {new}" for field, (old, new) in changes.items())
+    return "\n".join(lines) + "\n"
+
+def format_removal(fields):
+    """Format a port call that disappeared from the feed."""
+    return (
+        f"-----------------------------\n"
+        f"Port Call ID: {fields["portCallId"]} removed ({fields["imoLloyds"]}/{fields["vesselName"]}, {fields["portToVisit"]})\n"
+    )
+
+class PortCallDiff:
+    """Previous poll's port calls keyed by portCallId, rendering only what changed.
+
+    Each port call is kept as its displayed fields plus a hash of the compared fields.
+    `render` prints new port calls in full, changed ones as the fields that changed and
+    port calls that disappeared from the feed (when `track_removed`). With a state file
+    the state survives restarts, so the first poll after one does not print everything.
+    """
+
+    def __init__(self, state_file=None, track_removed=True):
+        self.state_file = state_file if state_file is not None else POLLER_CONFIG["state_file"]
+        self.track_removed = track_removed
+        self.state = {}  # portCallId -> (field hash, fields)
+        self.load_state()
+
+    def changes(self, port_calls, complete=True):
+        """Update the state, return (new fields, [(fields, {field: (old, new)})], removed fields).
+
+        Removals are only detected when `complete` is set, i.e. `port_calls` is the whole feed.
+        """
+        new, changed, seen = [], [], set()
+        for entry in port_calls:
+            fields = port_call_fields(entry)
+            key = str(fields["portCallId"])
+            seen.add(key)
+            digest = field_hash(fields)
+            previous = self.state.get(key)
+            if previous is None:
+                new.append(fields)
+            elif previous[0] != digest:
+                old = previous[1]
+                changed.append((fields, {
+                    field: (old.get(field), fields[field]) for field in DIFF_FIELDS if old.get(field) != fields[field]
+                }))
+            self.state[key] = (digest, fields)
+
+        removed = []
+        if self.track_removed and complete:
+            removed = [self.state.pop(key)[1] for key in [key for key in self.state if key not in seen]]
+        self.save_state()
+        return new, changed, removed
+
+    def render(self, data, complete=True):
+        """Print the new, changed and removed port calls of a poll."""
+        port_calls = port_call_list(data)
+        if port_calls is None:
+            return
+        new, changed, removed = self.changes(port_calls, complete)
+        blocks = [format_port_call(fields) for fields in new]
+        blocks += [format_change(fields, field_changes) for fields, field_changes in changed]
+        blocks += [format_removal(fields) for fields in removed]
+        if blocks:
+            print("\n".join(blocks))
+        print(f"{len(new)} new, {len(changed)} changed, {len(removed)} removed port calls.")
+
+    def load_state(self):
+        """Restore the previous poll's port calls from the state file."""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                self.state = {key: tuple(value) for key, value in json.load(file).items()}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable poller state {self.state_file}: {e}")
+
+    def save_state(self):
+        """Persist the port calls atomically to the state file."""
+        if not self.state_file:
+            return
+        temporary = self.state_file + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.state, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporary, self.state_file)
+
+class AsyncPoller:
+    """Poll slices of the port calls API concurrently on a fixed-rate schedule.
+
+    Every slice (a set of query parameters such as {"locode": "FIHEL"}) has its own
+    PortCallFetcher, so conditional requests work per slice. Fetches run in threads, at
+    most `concurrency` at a time, each request limited by `timeout` seconds and retried
+    with exponential backoff. The port calls of a cycle, merged by portCallId, are put on
+    a queue for a formatting task, so slow output does not delay the next cycle. With a
+    PortCallDiff (`diff`), the task renders only the changes since the previous poll,
+    using the last successful response of slices that failed or were not modified.
+    """
+
+    def __init__(self, slices=None, url=None, concurrency=None, timeout=None, retries=None,
+                 retry_backoff=None, interval=None, queue_size=None, formatter=None, diff=None):
+        slices = parse_slices(POLLER_CONFIG["slices"]) if slices is None else slices
+        timeout = timeout or POLLER_CONFIG["timeout"]
+        self.fetchers = [PortCallFetcher(url=url, timeout=timeout, state_file="", query=query) for query in slices]
+        self.concurrency = concurrency or POLLER_CONFIG["concurrency"]
+        self.retries = POLLER_CONFIG["retries"] if retries is None else retries
+        self.retry_backoff = POLLER_CONFIG["retry_backoff"] if retry_backoff is None else retry_backoff
+        self.interval = interval or POLLER_CONFIG["interval"]
+        self.queue_size = queue_size or POLLER_CONFIG["queue_size"]
+        self.formatter = formatter or format_port_calls
+        self.diff = diff
+        self.latest = [None] * len(self.fetchers)  # Port calls of the last successful response per slice
+        self.semaphore = None
+        self.queue = None
+
+    async def fetch_slice(self, fetcher):
+        """Fetch one slice, retrying failed requests. Raises the last error when all attempts fail."""
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    return await asyncio.to_thread(fetcher.fetch)
+                except requests.RequestException as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = self.retry_backoff * 2 ** attempt
+                    print(f"Error fetching slice {fetcher.query or 'all'}, retrying in {delay:.1f}s: {e}")
+                    await asyncio.sleep(delay)
+
+    async def poll_once(self):
+        """Fetch all slices concurrently and queue their port calls for formatting, return the number queued."""
+        results = await asyncio.gather(*(self.fetch_slice(fetcher) for fetcher in self.fetchers), return_exceptions=True)
+        fetched = []
+        for index, (fetcher, result) in enumerate(zip(self.fetchers, results)):
+            if isinstance(result, Exception):
+                print(f"Error fetching slice {fetcher.query or 'all'} from the API: {result}")
+            elif result is not NOT_MODIFIED:
+                self.latest[index] = result.get("portCalls", []) if isinstance(result, dict) else result
+                fetched.append(self.latest[index])
+                fetcher.commit()  # Nothing to store, the next request may use the new validators
+
+        if not fetched:
+            print("No changes since the last poll.")
+            return 0
+        if self.diff is not None:
+            fetched = [entries for entries in self.latest if entries is not None]
+        port_calls = {}
+        for entries in fetched:
+            for entry in entries:
+                port_calls[entry.get("portCallId", id(entry))] = entry  # Slices may overlap
+        await self.queue.put((list(port_calls.values()), None not in self.latest))
+        return len(port_calls)
+
+    async def format_worker(self):
+        """Format queued port calls in a thread, one cycle at a time."""
         while True:
+            port_calls, complete = await self.queue.get()
             try:
-                # Fetch data from API
-                data = fetch_data_from_api()
-                # Format and print the data
-                format_port_calls(data)
-                print("\nWaiting for 5 minute before fetching data again...\n")
-            except requests.RequestException as e:
-                print(f"Error fetching data from the API: {e}")
+                if self.diff is not None:
+                    await asyncio.to_thread(self.diff.render, port_calls, complete)
+                else:
+                    await asyncio.to_thread(self.formatter, port_calls)
             except Exception as e:
-                print(f"An error occurred: {e}")
+                print(f"An error occurred while formatting port calls: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def run(self, cycles=None):
+        """Poll every `interval` seconds (forever, or `cycles` times), then wait for the formatting to finish."""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.queue = asyncio.Queue(self.queue_size)
+        worker = asyncio.create_task(self.format_worker())
+        loop = asyncio.get_running_loop()
+        next_run = loop.time()
+        try:
+            cycle = 0
+            while cycles is None or cycle < cycles:
+                print(f"Fetching {len(self.fetchers)} slices from the API...")
+                await self.poll_once()
+                cycle += 1
+                if cycles is not None and cycle >= cycles:
+                    break
+                next_run += self.interval
+                await asyncio.sleep(max(0.0, next_run - loop.time()))
+            await self.queue.join()
+        finally:
+            worker.cancel()
+            for fetcher in self.fetchers:
+                fetcher.close()
 
-            # Wait for 5 minute before polling again
-            time.sleep(300)
+def main():
+    parser = argparse.ArgumentParser(description="Poll the port calls API and print the port calls")
+    parser.add_argument("--diff", action="store_true", help="Only print new, changed and removed port calls")
+    parser.add_argument("--state-file", help="Keep the --diff state in this file between restarts")
+    args = parser.parse_args()
+
+    diff = None
+    if args.diff or POLLER_CONFIG["diff"]:
+        # Delta responses only hold changed port calls, so disappearances cannot be seen
+        diff = PortCallDiff(args.state_file, track_removed=not API_CONFIG["delta"])
+
+    print("Polling program started. Press Ctrl+C to stop.")
+    try:
+        asyncio.run(AsyncPoller(diff=diff).run())
     except KeyboardInterrupt:
         print("\nPolling program stopped by user.")
 
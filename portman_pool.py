@@ -0,0 +1,177 @@
+import contextlib
+import threading
+import time
+from config import DATABASE_CONFIG
+from portman_log import log
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+class ConnectionPool:
+    """Thread-safe pool of warm PostgreSQL connections.
+
+    Connections are checked with `SELECT 1` on checkout and replaced if they died.
+    New connections are opened with exponential backoff between failed attempts.
+    At most `max_size` connections exist; idle connections above `min_size` are
+    closed after `max_idle` seconds. Use `with pool.connection() as conn:`.
+    """
+
+    def __init__(self, database=None, min_size=None, max_size=None, timeout=None, connect=None,
+                 retries=None, backoff=None, max_idle=None):
+        self.database = database or DATABASE_CONFIG["dbname"]
+        self.min_size = DATABASE_CONFIG["pool_min_size"] if min_size is None else min_size
+        self.max_size = max(1, max_size or DATABASE_CONFIG["pool_max_size"], self.min_size)
+        self.timeout = timeout or DATABASE_CONFIG["pool_timeout"]
+        self.retries = DATABASE_CONFIG["connect_retries"] if retries is None else retries
+        self.backoff = DATABASE_CONFIG["connect_backoff"] if backoff is None else backoff
+        self.max_idle = DATABASE_CONFIG["pool_max_idle"] if max_idle is None else max_idle
+        self.connect_function = connect or self.connect_postgres
+        self.idle = []  # (connection, returned at) pairs, most recently returned last
+        self.size = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def connect_postgres(self):
+        """Open a pg8000 connection to the pool's database."""
+        import pg8000
+        return pg8000.connect(
+            database=self.database,
+            user=DATABASE_CONFIG["user"],
+            password=DATABASE_CONFIG["password"],
+            host=DATABASE_CONFIG["host"],
+            port=DATABASE_CONFIG["port"]
+        )
+
+    def connect(self):
+        """Open a new connection, retrying with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.connect_function()
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = min(self.backoff * 2 ** attempt, 30)
+                log(f"Error connecting to database '{self.database}': {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    @staticmethod
+    def is_alive(conn):
+        """Return True if the connection answers a trivial query."""
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchall()
+            cursor.close()
+            conn.rollback()  # Do not leave the ping's transaction open
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def discard(conn):
+        """Close a connection, ignoring errors from dead sockets."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def fill(self):
+        """Open connections until min_size exist."""
+        while True:
+            with self.condition:
+                if self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                raise
+            self.checkin(conn)
+
+    def checkout(self):
+        """Take a live connection from the pool, opening one if the pool is below max_size."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise PoolTimeout("Connection pool is closed")
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available within {self.timeout}s")
+                    self.condition.wait(remaining)
+                if self.idle:
+                    conn, _ = self.idle.pop()
+                else:
+                    conn = None
+                    self.size += 1
+
+            if conn is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    self.release_slot()
+                    raise
+
+            if self.is_alive(conn):
+                return conn
+            log(f"Discarding dead connection to database '{self.database}'.")
+            self.discard(conn)
+            self.release_slot()
+
+    def checkin(self, conn, broken=False):
+        """Return a connection to the pool, closing it if broken or no longer needed."""
+        if broken:
+            self.discard(conn)
+            self.release_slot()
+            return
+        with self.condition:
+            if self.closed:
+                self.size -= 1
+                expired = [conn]
+            else:
+                now = time.monotonic()
+                self.idle.append((conn, now))
+                expired = []
+                # Close the longest idle connections above min_size
+                while self.size > self.min_size and self.idle and now - self.idle[0][1] > self.max_idle:
+                    expired.append(self.idle.pop(0)[0])
+                    self.size -= 1
+            self.condition.notify()
+        for stale in expired:
+            self.discard(stale)
+
+    def release_slot(self):
+        """Forget a connection that was closed or never opened."""
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with-block."""
+        conn = self.checkout()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                self.checkin(conn, broken=True)
+                raise
+            self.checkin(conn)
+            raise
+        self.checkin(conn)
+
+    def close(self):
+        """Close all idle connections; connections in use are closed when returned."""
+        with self.condition:
+            self.closed = True
+            idle = [conn for conn, _ in self.idle]
+            self.idle = []
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for conn in idle:
+            self.discard(conn)
@@ -0,0 +1,227 @@
+import collections
+import cProfile
+import io
+import json
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from config import PROFILE_CONFIG
+from portman_log import log
+from portman_metrics import metrics
+
+class StageProfile:
+    """CPU profile, allocations and timing of one stage name, summed over its runs."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.runs = 0
+        self.profiled_runs = 0  # Runs that had the CPU profiler
+        self.seconds = 0.0
+        self.traced_growth = 0  # Net growth of the traced memory over all runs
+        self.allocations = []  # ((filename, lineno), bytes, blocks) of the sites that grew during the first run
+
+class ProfiledStage:
+    """Context manager profiling one run of a stage in a ProfileSession (and timing it for Metrics)."""
+
+    __slots__ = ("session", "name", "timer", "stage", "profiling", "snapshot", "traced", "start")
+
+    def __init__(self, session, name, timer=None):
+        self.session = session
+        self.name = name
+        self.timer = timer
+        self.profiling = False
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.timer.__enter__()
+        self.session.enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.session.exit(self)
+        if self.timer is not None:
+            self.timer.__exit__(exc_type, exc_value, traceback)
+        return False
+
+class ProfileSession:
+    """Profile of the metrics stages (fetch, decode, process, load_staging, merge, ...) run between `start` and `stop`.
+
+    While started, `metrics.stage` hands out ProfiledStages:
+    - CPU: a cProfile profile per stage name. Only one profiler can run at a time, so a
+      nested stage suspends the profile of the stage around it until it exits, and a stage
+      starting in another thread while one is profiled is only timed. The running profile
+      also records calls made by other threads.
+    - Memory: the growth of the traced memory of every run, and the allocation sites that
+      grew during the first run of each stage (grouping snapshots of the traced heap takes
+      too long to do around every run). Allocations of other threads are included.
+    - Stacks: a sampler thread records the stack of every thread inside a stage each
+      `sample_interval` seconds, rooted at the stage name, in the collapsed format of
+      flame graph tools.
+    `stop` writes <stage>.pstats, <stage>.txt (top functions and allocation sites),
+    stacks.collapsed and summary.json to a new directory under `directory`.
+    """
+
+    def __init__(self, directory, label="run", sample_interval=None, top=None):
+        self.directory = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}")
+        self.sample_interval = sample_interval or PROFILE_CONFIG["sample_interval"]
+        self.top = top or PROFILE_CONFIG["top"]
+        self.stages = collections.defaultdict(StageProfile)
+        self.active = {}  # thread ident -> stack of running ProfiledStages
+        self.owner = None  # ProfiledStage whose profile is enabled
+        self.lock = threading.Lock()
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.started_tracing = False
+
+    def start(self):
+        """Start tracing allocations and sampling stacks, and profile the stages from now on."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_CONFIG["trace_frames"])
+            self.started_tracing = True
+        self.sampler = threading.Thread(target=self.sample, name="portman-profile", daemon=True)
+        self.sampler.start()
+        metrics.profiler = self
+        return self
+
+    def stage(self, name, timer=None):
+        return ProfiledStage(self, name, timer)
+
+    def enter(self, run):
+        """Start profiling a stage run, taking over the CPU profiler from the stage around it."""
+        with self.lock:
+            run.stage = self.stages[run.name]
+            stack = self.active.setdefault(threading.get_ident(), [])
+            outer = stack[-1] if stack else None
+            if (self.owner is None or self.owner is outer) and (outer is None or outer.stage is not run.stage):
+                if self.owner is not None:
+                    self.owner.stage.profile.disable()
+                self.owner = run
+                run.profiling = True
+            first = run.stage.runs == 0 and not any(other.stage is run.stage for other in self.running())
+            stack.append(run)
+        run.snapshot = take_snapshot() if first else None
+        run.traced = tracemalloc.get_traced_memory()[0]
+        if run.profiling:
+            run.stage.profile.enable()
+        run.start = time.perf_counter()
+
+    def exit(self, run):
+        """Finish a stage run and hand the CPU profiler back to the stage around it."""
+        elapsed = time.perf_counter() - run.start
+        if run.profiling:
+            run.stage.profile.disable()
+        traced = tracemalloc.get_traced_memory()[0] - run.traced
+        grown = allocation_growth(run.snapshot, take_snapshot()) if run.snapshot is not None else None
+        with self.lock:
+            stage = run.stage
+            stage.runs += 1
+            stage.profiled_runs += run.profiling
+            stage.seconds += elapsed
+            stage.traced_growth += traced
+            if grown is not None:
+                stage.allocations = grown
+            stack = self.active[threading.get_ident()]
+            stack.pop()
+            if not stack:
+                del self.active[threading.get_ident()]
+            if self.owner is run:
+                outer = stack[-1] if stack else None
+                self.owner = outer if outer is not None and outer.profiling else None
+                if self.owner is not None:
+                    outer.stage.profile.enable()
+
+    def running(self):
+        """Stage runs in progress in all threads (lock held)."""
+        return [run for stack in self.active.values() for run in stack]
+
+    def sample(self):
+        """Sampler thread: count the stacks of the threads running a stage."""
+        while not self.stopped.wait(self.sample_interval):
+            frames = sys._current_frames()
+            with self.lock:
+                running = [(ident, stack[-1].name) for ident, stack in self.active.items()]
+            for ident, name in running:
+                frame = frames.get(ident)
+                names = []
+                while frame is not None:
+                    names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                names.append(name)
+                self.samples[";".join(reversed(names))] += 1
+
+    def stop(self):
+        """Stop profiling and write the reports, return their directory (None if writing failed)."""
+        if metrics.profiler is self:
+            metrics.profiler = None
+        self.stopped.set()
+        self.sampler.join()
+        if self.started_tracing:
+            tracemalloc.stop()
+        try:
+            self.write()
+        except OSError as e:
+            log(f"Error writing profile to {self.directory}: {e}")
+            return None
+        log(f"Profile of {len(self.stages)} stages written to {self.directory}")
+        return self.directory
+
+    def write(self):
+        """Write the per-stage reports, the collapsed stacks and a JSON summary."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            stages = sorted(self.stages.items())
+            samples = sorted(self.samples.items())
+        summary = {}
+        for name, stage in stages:
+            summary[name] = {
+                "runs": stage.runs,
+                "profiled_runs": stage.profiled_runs,
+                "seconds": round(stage.seconds, 6),
+                "traced_growth_bytes": stage.traced_growth,
+                "first_run_allocated_bytes": sum(size for _, size, _ in stage.allocations)
+            }
+            report = io.StringIO()
+            report.write(
+                f"Stage {name}: {stage.runs} runs in {stage.seconds:.3f} s, {stage.profiled_runs} CPU profiled, "
+                f"traced memory grew by {stage.traced_growth / 1024:.1f} KiB\n"
+            )
+            if stage.profiled_runs:
+                stage.profile.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+                pstats.Stats(stage.profile, stream=report).sort_stats("cumulative").print_stats(self.top)
+            report.write("\nTop allocation sites of the first run (bytes and blocks still allocated at its end):\n")
+            for (filename, lineno), size, count in stage.allocations[:self.top]:
+                report.write(f"{size / 1024:12.1f} KiB {count:9d}  {filename}:{lineno}  {linecache.getline(filename, lineno).strip()}\n")
+            with open(os.path.join(self.directory, f"{name}.txt"), "w", encoding="utf-8") as file:
+                file.write(report.getvalue())
+
+        with open(os.path.join(self.directory, "stacks.collapsed"), "w", encoding="utf-8") as file:
+            for stack, count in samples:
+                file.write(f"{stack} {count}\n")
+        with open(os.path.join(self.directory, "summary.json"), "w", encoding="utf-8") as file:
+            json.dump({
+                "stages": summary,
+                "samples": sum(count for _, count in samples),
+                "sample_interval": self.sample_interval
+            }, file, indent=2)
+
+IGNORED_FILES = frozenset({tracemalloc.__file__, __file__})
+
+def take_snapshot():
+    """Snapshot of the traced allocations, None if tracemalloc was stopped meanwhile."""
+    return tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+def allocation_growth(before, after):
+    """(filename, lineno), bytes and blocks of the allocation sites that grew between two snapshots, largest first."""
+    if after is None:
+        return []
+    return [
+        ((diff.traceback[0].filename, diff.traceback[0].lineno), diff.size_diff, diff.count_diff)
+        for diff in after.compare_to(before, "lineno")  # Sorted by size_diff
+        if diff.size_diff > 0 and diff.traceback[0].filename not in IGNORED_FILES
+    ]
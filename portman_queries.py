@@ -0,0 +1,66 @@
+from datetime import datetime
+from portman_agent import get_pool, is_sqlite_connection
+
+# Columns returned by get_vessel_route and get_arrivals
+ROUTE_COLUMNS = ("portCallId", "portToVisit", "prevPort", "nextPort", "ata", "atd")
+ARRIVAL_QUERY_COLUMNS = ("portCallId", "imoLloyds", "vesselName", "portToVisit", "portAreaName", "berthName", "eta", "old_ata", "ata")
+
+def query_value(conn, value):
+    """Adapt a timestamp parameter to the connection (sqlite stores ISO-8601 strings)."""
+    if isinstance(value, datetime) and is_sqlite_connection(conn):
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    return value
+
+def run_query(query, params, conn=None):
+    """Run a read query written with %s placeholders on `conn` or a pooled connection, return all rows."""
+    if conn is None:
+        with get_pool().connection() as conn:
+            try:
+                return run_query(query, params, conn)
+            finally:
+                conn.rollback()  # Do not return the connection idle in a transaction
+
+    if is_sqlite_connection(conn):
+        query = query.replace("%s", "?")
+    cursor = conn.cursor()
+    cursor.execute(query, tuple(query_value(conn, value) for value in params))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def get_vessel_route(imo, conn=None):
+    """Return the port calls of a vessel ordered by arrival and departure (uses voyages_imo_route_idx)."""
+    return run_query(
+        f"SELECT {', '.join(ROUTE_COLUMNS)} FROM voyages WHERE imoLloyds = %s ORDER BY ata, atd;",
+        (imo,), conn
+    )
+
+def get_arrivals(port=None, since=None, until=None, conn=None):
+    """Return arrivals in [since, until), optionally at one port (LOCODE), ordered by ata (uses arrivals_ata_idx)."""
+    conditions = []
+    params = []
+    if port is not None:
+        conditions.append("voyages.portToVisit = %s")
+        params.append(port)
+    if since is not None:
+        conditions.append("arrivals.ata >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("arrivals.ata < %s")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}\n" if conditions else ""
+    return run_query(
+        f"SELECT arrivals.portCallId, voyages.imoLloyds, arrivals.vesselName, voyages.portToVisit, arrivals.portAreaName,\n"
+        f"    arrivals.berthName, arrivals.eta, arrivals.old_ata, arrivals.ata\n"
+        f"FROM arrivals JOIN voyages ON voyages.portCallId = arrivals.portCallId\n"
+        f"{where}"
+        f"ORDER BY arrivals.ata, arrivals.id;",
+        params, conn
+    )
+
+def get_port_call_arrivals(port_call_id, conn=None):
+    """Return the arrival history of one port call (uses arrivals_portcallid_idx)."""
+    return run_query(
+        "SELECT eta, old_ata, ata, created FROM arrivals WHERE portCallId = %s ORDER BY id;",
+        (port_call_id,), conn
+    )
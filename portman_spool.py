@@ -0,0 +1,279 @@
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+from config import SPOOL_CONFIG
+from portman_batch import PortCallBatch
+from portman_log import log
+from portman_metrics import metrics
+
+RECORD_HEADER = struct.Struct(">II")  # Payload length and CRC-32 of the payload
+SEGMENT_PATTERN = "spool-{:012d}.log"
+
+class UnwritableBatches(Exception):
+    """Raised by the `save` function of a SpoolWriter for batches that retrying cannot write."""
+
+def encode_batch(batch):
+    """Serialise a PortCallBatch as compressed JSON rows."""
+    return zlib.compress(json.dumps(list(batch.rows()), separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 1)
+
+def decode_batch(payload):
+    """Inverse of encode_batch."""
+    return PortCallBatch.from_rows(map(tuple, json.loads(zlib.decompress(payload))))
+
+class Spool:
+    """Append-only on-disk spool of PortCallBatches in numbered segment files.
+
+    Every record is a header (payload length, CRC-32) followed by the payload. Segments
+    are rotated after `segment_bytes`. Positions are (segment, offset) pairs; `ack`
+    stores the position up to which records were written to the database and deletes
+    segments that are fully acknowledged. On open, a torn or corrupt record at the end
+    of the last segment (a crash during a write) is truncated away. `reject` copies a
+    record that cannot be written to the database to the `rejected` subdirectory.
+    """
+
+    def __init__(self, directory=None, segment_bytes=None, fsync=None):
+        self.directory = directory or SPOOL_CONFIG["directory"]
+        self.segment_bytes = segment_bytes or SPOOL_CONFIG["segment_bytes"]
+        self.fsync = SPOOL_CONFIG["fsync"] if fsync is None else fsync
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.acked = self.load_ack()
+        segments = self.segments()
+        self.segment = segments[-1] if segments else self.acked[0]
+        self.file = open(self.segment_path(self.segment), "ab")
+        self.recover()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_PATTERN.format(segment))
+
+    def segments(self):
+        """Numbers of the segment files on disk, in order."""
+        return sorted(int(os.path.basename(path)[6:-4]) for path in glob.glob(os.path.join(self.directory, "spool-*.log")))
+
+    def load_ack(self):
+        """Acknowledged position from the ack file, (0, 0) if there is none."""
+        try:
+            with open(os.path.join(self.directory, "spool.ack"), "r", encoding="utf-8") as file:
+                state = json.load(file)
+            return state["segment"], state["offset"]
+        except FileNotFoundError:
+            return 0, 0
+
+    def recover(self):
+        """Truncate the current segment after its last valid record."""
+        end = 0
+        for _, position, _ in self.iter_segment(self.segment, 0):
+            end = position[1]
+        size = os.path.getsize(self.segment_path(self.segment))
+        if size != end:
+            log(f"Truncating {size - end} bytes of a torn record at the end of {self.segment_path(self.segment)}.")
+            self.file.truncate(end)
+
+    def iter_segment(self, segment, offset):
+        """Yield (position, next position, payload) of the valid records of one segment from `offset`."""
+        try:
+            file = open(self.segment_path(segment), "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            file.seek(offset)
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    log(f"Stopping at a corrupt spool record in segment {segment} at offset {offset}.")
+                    return
+                end = offset + RECORD_HEADER.size + length
+                yield (segment, offset), (segment, end), payload
+                offset = end
+
+    def append(self, batch):
+        """Append a batch durably, return (position, next position)."""
+        payload = encode_batch(batch)
+        with self.lock:
+            if self.file.tell() and self.file.tell() + len(payload) > self.segment_bytes:
+                self.file.close()
+                self.segment += 1
+                self.file = open(self.segment_path(self.segment), "ab")
+            start = (self.segment, self.file.tell())
+            self.file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            metrics.increment("spool_bytes_written", RECORD_HEADER.size + len(payload))
+            return start, (self.segment, self.file.tell())
+
+    def end(self):
+        """Position after the last appended record."""
+        with self.lock:
+            return self.segment, self.file.tell()
+
+    def read(self, start=None, limit=None):
+        """Return up to `limit` (position, next position, batch) records from `start` (the acknowledged position)."""
+        segment, offset = start or self.acked
+        records = []
+        for number in [number for number in self.segments() if number >= segment]:
+            for position, end, payload in self.iter_segment(number, offset if number == segment else 0):
+                records.append((position, end, decode_batch(payload)))
+                if limit and len(records) >= limit:
+                    return records
+        return records
+
+    def ack(self, position):
+        """Mark everything before `position` as written and delete fully acknowledged segments."""
+        with self.lock:
+            temporary = os.path.join(self.directory, "spool.ack.tmp")
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump({"segment": position[0], "offset": position[1]}, file)
+            os.replace(temporary, os.path.join(self.directory, "spool.ack"))
+            self.acked = position
+            for number in self.segments():
+                if number < position[0] and number != self.segment:
+                    os.remove(self.segment_path(number))
+
+    def reject(self, position, batch, reason):
+        """Copy a record to rejected/spool-<segment>-<offset>.log (same record format) with the reason next to it."""
+        directory = os.path.join(self.directory, "rejected")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"spool-{position[0]:012d}-{position[1]:012d}.log")
+        payload = encode_batch(batch)
+        with open(path, "wb") as file:
+            file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(path[:-4] + ".reason", "w", encoding="utf-8") as file:
+            file.write(f"{reason}\n")
+        return path
+
+    def close(self):
+        self.file.close()
+
+class SpoolWriter:
+    """Writer stage between snapshot processing and the database.
+
+    `put` appends a batch to the Spool (so it survives crashes and database outages) and
+    hands it to the writer thread through a bounded queue without waiting; if the queue is
+    full the writer reads the batch back from the spool instead. The writer passes all
+    pending batches, oldest first and at most `max_batches` at a time, to `save` (a
+    function returning True once they are committed) and acknowledges them. While `save`
+    returns False (a transient error such as a lost connection), the batches stay spooled
+    and are retried every `retry_interval` seconds. When it raises UnwritableBatches (an
+    error retrying cannot fix, such as a constraint or schema error), the batches are
+    written one at a time and the failing ones are moved aside with Spool.reject, so one
+    bad snapshot cannot block the spool.
+    """
+
+    STOP = object()
+
+    def __init__(self, spool, save, queue_size=None, max_batches=None, retry_interval=None):
+        self.spool = spool
+        self.save = save
+        self.queue = queue.Queue(queue_size or SPOOL_CONFIG["queue_size"])
+        self.max_batches = max_batches or SPOOL_CONFIG["max_batches"]
+        self.retry_interval = SPOOL_CONFIG["retry_interval"] if retry_interval is None else retry_interval
+        self.position = spool.acked  # First record not written to the database yet
+        self.condition = threading.Condition()
+        self.pending = []  # (position, next position, batch) received through the queue
+        self.isolating = 0  # Records still to write one at a time after an UnwritableBatches
+        self.stopping = False
+        self.worker = threading.Thread(target=self.run, name="portman-spool", daemon=True)
+        self.worker.start()
+
+    def put(self, batch):
+        """Spool a batch and queue it for the writer, never waiting for the database."""
+        start, end = self.spool.append(batch)
+        try:
+            self.queue.put_nowait((start, end, batch))
+        except queue.Full:
+            metrics.increment("spool_queue_overflows")  # The writer reads it back from the spool
+
+    def receive(self, timeout):
+        """Move queued batches to `pending`, waiting up to `timeout` seconds (None: forever) for the first one."""
+        try:
+            item = self.queue.get(timeout=timeout)
+            while True:
+                if item is self.STOP:
+                    self.stopping = True
+                else:
+                    self.pending.append(item)
+                item = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def next_records(self):
+        """Unwritten records from memory if they continue at `position`, otherwise from the spool."""
+        self.pending = [record for record in self.pending if record[0] >= self.position]
+        limit = 1 if self.isolating else self.max_batches
+        if self.pending and self.pending[0][0] == self.position and all(
+            previous[1] == record[0] for previous, record in zip(self.pending, self.pending[1:])
+        ):
+            return self.pending[:limit]
+        return self.spool.read(self.position, limit)
+
+    def advance(self, records):
+        """Acknowledge records and move `position` past them."""
+        self.spool.ack(records[-1][1])
+        with self.condition:
+            self.position = records[-1][1]
+            self.condition.notify_all()
+        self.isolating = max(self.isolating - len(records), 0)
+
+    def flush_once(self):
+        """Write pending records until none are left, return False if saving failed."""
+        while True:
+            records = self.next_records()
+            if not records:
+                return True
+            try:
+                with metrics.stage("spool_flush"):
+                    saved = self.save([batch for _, _, batch in records])
+            except UnwritableBatches as e:
+                if len(records) > 1:
+                    log(f"Spooled snapshots cannot be written ({e}), writing the {len(records)} snapshots one at a time.")
+                    self.isolating = len(records)
+                    continue
+                position, _, batch = records[0]
+                path = self.spool.reject(position, batch, e)
+                self.advance(records)
+                metrics.increment("spool_batches_rejected")
+                log(f"Moved a spooled snapshot that cannot be written ({e}) to {path}.")
+                continue
+            if not saved:
+                return False
+            self.advance(records)
+            metrics.increment("spool_batches_flushed", len(records))
+            log(f"Flushed {len(records)} spooled snapshots to the database.")
+
+    def run(self):
+        """Writer loop: flush when batches arrive, retry failed flushes, stop after STOP."""
+        while True:
+            try:
+                done = self.flush_once()
+            except Exception as e:
+                metrics.increment("errors")
+                log(f"Error flushing the spool: {e}")
+                done = False
+            if self.stopping:
+                return
+            self.receive(None if done else self.retry_interval)
+
+    def flush(self, timeout=None):
+        """Wait until everything spooled so far is written, return False on timeout."""
+        target = self.spool.end()
+        with self.condition:
+            return self.condition.wait_for(lambda: self.position >= target, timeout)
+
+    def close(self, timeout=None):
+        """Try to write the remaining batches within `timeout`, then stop; unwritten batches stay spooled."""
+        if self.worker.is_alive():
+            self.flush(timeout)
+            self.queue.put(self.STOP)
+            self.worker.join(timeout)
+        self.spool.close()
@@ -0,0 +1,245 @@
+import sys
+from datetime import date
+from config import DATABASE_CONFIG, PARTITION_CONFIG, SQLITE_CONFIG
+from portman_partitions import maintain_partitions
+
+BACKENDS = ("postgresql", "sqlite")
+
+# Version of the DDL in create_tables; bump it when tables or INDEXES change so startup reruns the setup
+SCHEMA_VERSION = 1
+
+# One arrival per port call and ata however many agents detect it, created in cluster mode only
+ARRIVALS_UNIQUE_INDEX = "arrivals_portcallid_ata_key"
+
+# Secondary indexes of the read path (see portman_queries.py), valid for PostgreSQL and SQLite
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS voyages_imo_route_idx ON voyages (imoLloyds, ata, atd);",
+    "CREATE INDEX IF NOT EXISTS voyages_port_ata_idx ON voyages (portToVisit, ata);",
+    "CREATE INDEX IF NOT EXISTS arrivals_portcallid_idx ON arrivals (portCallId);",
+    "CREATE INDEX IF NOT EXISTS arrivals_ata_idx ON arrivals (ata);"
+)
+
+# SQLite stores timestamps as the ISO-8601 strings of the API, which sort and compare like timestamps
+SQLITE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS voyages (
+        portCallId INTEGER PRIMARY KEY,
+        imoLloyds INTEGER,
+        vesselTypeCode TEXT,
+        vesselName TEXT,
+        prevPort TEXT,
+        portToVisit TEXT,
+        nextPort TEXT,
+        agentName TEXT,
+        shippingCompany TEXT,
+        eta TEXT,
+        ata TEXT,
+        portAreaCode TEXT,
+        portAreaName TEXT,
+        berthCode TEXT,
+        berthName TEXT,
+        etd TEXT,
+        atd TEXT,
+        passengersOnArrival INTEGER DEFAULT 0,
+        passengersOnDeparture INTEGER DEFAULT 0,
+        crewOnArrival INTEGER DEFAULT 0,
+        crewOnDeparture INTEGER DEFAULT 0,
+        created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS arrivals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        portCallId INTEGER,
+        eta TEXT,
+        old_ata TEXT,
+        ata TEXT,
+        vesselName TEXT,
+        portAreaName TEXT,
+        berthName TEXT,
+        created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+)
+
+# PostgreSQL errors that can succeed when retried: SQLSTATE classes connection exception,
+# transaction rollback (serialization failure, deadlock), insufficient resources and
+# operator intervention (shutdown, cancelled query), and lock_not_available
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+TRANSIENT_SQLSTATES = ("55P03",)
+
+# sqlite3 raises OperationalError for both locks and schema problems, told apart by the message
+SQLITE_TRANSIENT_MESSAGES = ("locked", "busy", "disk i/o", "full", "unable to open")
+
+def is_transient_error(error):
+    """Return True if a database error may go away on retry: a lost connection, lock, deadlock or shutdown.
+
+    Schema errors, constraint violations and bad data return False. Like is_sqlite_connection,
+    this never imports a driver.
+    """
+    if isinstance(error, OSError) or (type(error).__name__ == "InterfaceError" and type(error).__module__.startswith("pg8000")):
+        return True  # Socket errors, pg8000 reports a lost connection as InterfaceError('network error')
+    fields = error.args[0] if error.args else None
+    if isinstance(fields, dict):  # pg8000 server errors carry the fields of the error message, C is the SQLSTATE
+        code = fields.get("C", "")
+        return code[:2] in TRANSIENT_SQLSTATE_CLASSES or code in TRANSIENT_SQLSTATES
+    if type(error).__name__ == "OperationalError":
+        return any(text in str(error).lower() for text in SQLITE_TRANSIENT_MESSAGES)
+    return False
+
+def using_sqlite():
+    """Return True if config.py selects the SQLite backend."""
+    backend = DATABASE_CONFIG["backend"]
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{backend}', expected one of {BACKENDS}")
+    return backend == "sqlite"
+
+def is_sqlite_connection(conn):
+    """Return True if the connection is a sqlite3 connection."""
+    sqlite3 = sys.modules.get("sqlite3")  # Not imported here, no sqlite3 connection can exist without it
+    return sqlite3 is not None and isinstance(conn, sqlite3.Connection)
+
+def connect_sqlite(path=None):
+    """Open a SQLite connection with the pragmas in SQLITE_CONFIG.
+
+    WAL lets readers (portman_queries) run during writes and, with synchronous=NORMAL,
+    a commit only appends to the log instead of syncing the database file. Write
+    transactions start with BEGIN IMMEDIATE so concurrent writers wait for the lock
+    (up to busy_timeout) instead of failing when upgrading a read transaction. The
+    connection keeps up to `cached_statements` prepared statements, so pooled
+    connections reuse the upsert and merge statements across polls.
+    """
+    import sqlite3
+    conn = sqlite3.connect(
+        path or SQLITE_CONFIG["path"],
+        timeout=SQLITE_CONFIG["busy_timeout"],
+        isolation_level="IMMEDIATE",
+        check_same_thread=False,  # Pooled connections move between the poll and spool writer threads
+        cached_statements=SQLITE_CONFIG["cached_statements"]
+    )
+    conn.execute(f"PRAGMA journal_mode = {SQLITE_CONFIG['journal_mode']};")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_CONFIG['synchronous']};")
+    conn.execute(f"PRAGMA cache_size = -{int(SQLITE_CONFIG['cache_kb'])};")
+    conn.execute(f"PRAGMA mmap_size = {int(SQLITE_CONFIG['mmap_bytes'])};")
+    conn.execute("PRAGMA temp_store = MEMORY;")  # voyages_staging never touches the disk
+    return conn
+
+def table_exists(cursor, table, sqlite=False):
+    """Return True if `table` exists (in the search_path on PostgreSQL)."""
+    if sqlite:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;", (table,))
+        return cursor.fetchone() is not None
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cursor.fetchone()[0]
+
+def index_exists(cursor, index, sqlite=False):
+    """Return True if `index` exists (in the search_path on PostgreSQL)."""
+    if sqlite:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?;", (index,))
+        return cursor.fetchone() is not None
+    return table_exists(cursor, index)
+
+def schema_is_current(cursor, sqlite=False):
+    """Return True if portman_schema records SCHEMA_VERSION (and partitions maintained today, if enabled)."""
+    if not table_exists(cursor, "portman_schema", sqlite):
+        return False
+    cursor.execute("SELECT version, maintained FROM portman_schema;")
+    row = cursor.fetchone()
+    partitioned = PARTITION_CONFIG["enabled"] and not sqlite
+    return row is not None and row[0] == SCHEMA_VERSION and (not partitioned or row[1] == date.today())
+
+def create_tables(cursor, sqlite=False):
+    """Create the voyages and arrivals tables (partitioned if enabled on PostgreSQL) and their indexes if they don't exist."""
+    partitioned = PARTITION_CONFIG["enabled"] and not sqlite
+
+    if sqlite:
+        for statement in SQLITE_TABLES:
+            cursor.execute(statement)
+    else:
+        # Create the 'voyages' table
+        create_voyages_table = f"""
+        CREATE TABLE IF NOT EXISTS voyages (
+            portCallId INTEGER PRIMARY KEY,
+            imoLloyds INTEGER,
+            vesselTypeCode TEXT,
+            vesselName TEXT,
+            prevPort TEXT,
+            portToVisit TEXT,
+            nextPort TEXT,
+            agentName TEXT,
+            shippingCompany TEXT,
+            eta TIMESTAMP NULL,
+            ata TIMESTAMP NULL,
+            portAreaCode TEXT,
+            portAreaName TEXT,
+            berthCode TEXT,
+            berthName TEXT,
+            etd TIMESTAMP NULL,
+            atd TIMESTAMP NULL,
+            passengersOnArrival INTEGER DEFAULT 0,
+            passengersOnDeparture INTEGER DEFAULT 0,
+            crewOnArrival INTEGER DEFAULT 0,
+            crewOnDeparture INTEGER DEFAULT 0,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ){" PARTITION BY RANGE (portCallId)" if partitioned else ""};
+        """
+        cursor.execute(create_voyages_table)
+
+        # Create the 'arrivals' table
+        create_arrivals_table = f"""
+        CREATE TABLE IF NOT EXISTS arrivals (
+            id SERIAL{"" if partitioned else " PRIMARY KEY"},
+            portCallId INTEGER,
+            eta TIMESTAMP NULL,
+            old_ata TIMESTAMP NULL,
+            ata TIMESTAMP NOT NULL,
+            vesselName TEXT,
+            portAreaName TEXT,
+            berthName TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP{",\n            PRIMARY KEY (id, ata)" if partitioned else ""}
+        ){" PARTITION BY RANGE (ata)" if partitioned else ""};
+        """
+        cursor.execute(create_arrivals_table)
+
+    create_indexes(cursor)
+    if partitioned:
+        maintain_partitions(cursor)
+    record_schema_version(cursor, sqlite)
+
+def record_schema_version(cursor, sqlite=False):
+    """Store SCHEMA_VERSION (and today as the partition maintenance date) in the one-row portman_schema table."""
+    placeholder = "?" if sqlite else "%s"
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS portman_schema (
+        version INTEGER NOT NULL,
+        maintained DATE,
+        updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cursor.execute("DELETE FROM portman_schema;")
+    cursor.execute(
+        f"INSERT INTO portman_schema (version, maintained) VALUES ({placeholder}, {placeholder});",
+        (SCHEMA_VERSION, date.today() if PARTITION_CONFIG["enabled"] and not sqlite else None)
+    )
+
+def create_indexes(cursor):
+    """Create the read-path indexes if they don't exist."""
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+def create_arrivals_unique_index(cursor, sqlite=False):
+    """Create the unique (portCallId, ata) arrivals index of cluster mode if it doesn't exist.
+
+    The index includes the partition key ata, so it also works on partitioned tables. Arrivals
+    recorded before it may hold the same (portCallId, ata) twice, either detected twice or a
+    port call arriving again at an earlier ata; only the first of them is kept. Returns the
+    number of arrivals removed.
+    """
+    if index_exists(cursor, ARRIVALS_UNIQUE_INDEX, sqlite):
+        return 0
+    cursor.execute("DELETE FROM arrivals WHERE id NOT IN (SELECT min(id) FROM arrivals GROUP BY portCallId, ata);")
+    removed = cursor.rowcount
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {ARRIVALS_UNIQUE_INDEX} ON arrivals (portCallId, ata);")
+    return removed
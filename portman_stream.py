@@ -0,0 +1,102 @@
+import json
+import re
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+class JsonArrayStream:
+    """Incrementally decode the elements of one top-level array of a JSON document.
+
+    Only the element being decoded and one read buffer are held in memory. Elements are
+    yielded with their (start, end) character offsets in the file; open the file with
+    encoding "latin-1" to get byte offsets instead.
+    """
+
+    def __init__(self, file, key="portCalls", chunk_size=1 << 16):
+        self.file = file
+        self.key = key
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.offset = 0  # File position of buffer[0]
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk to the buffer, dropping consumed data. Returns False at EOF."""
+        if self.eof:
+            return False
+        # Read at least as much as is buffered so one large element does not decode quadratically
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        """Advance to the next non-whitespace character, return it or None at EOF."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, characters):
+        """Consume one of the given structural characters and return it."""
+        char = self.skip_whitespace()
+        if char is None or char not in characters:
+            raise ValueError(f"Expected one of {characters!r} at offset {self.offset + self.pos}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """Decode the JSON value at the current position, reading more data as needed."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.buffer) and self.fill():
+                continue  # A number may continue in the next chunk
+            start = self.offset + self.pos
+            self.pos = end
+            return value, start, self.offset + end
+
+    def elements(self):
+        """Yield (value, start, end) for each element of the array."""
+        if self.expect("{[") == "{":
+            if not self.find_key():
+                return
+            self.expect("[")
+
+        if self.skip_whitespace() == "]":
+            return
+        while True:
+            yield self.decode()
+            if self.expect(",]") == "]":
+                return
+
+    def find_key(self):
+        """Skip members of the top-level object until the array key, return False if it is missing."""
+        if self.skip_whitespace() == "}":
+            return False
+        while True:
+            name, _, _ = self.decode()
+            self.expect(":")
+            if name == self.key:
+                return True
+            self.decode()  # Skip values of other members
+            if self.expect(",}") == "}":
+                return False
+
+def iter_port_calls(filepath, key="portCalls"):
+    """Yield port call entries of a portnet*.json file one by one."""
+    with open(filepath, "r", encoding="utf-8") as file:
+        for value, _, _ in JsonArrayStream(file, key).elements():
+            yield value
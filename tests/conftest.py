@@ -1,5 +1,12 @@
+import os
+import sys
 import pytest
 
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from portman_storage import connect_sqlite, create_tables
+
 def pytest_addoption(parser):
     """Add custom command-line options for pytest."""
     parser.addoption("--input-dir", action="store", help="Directory containing test JSON files")
@@ -35,3 +42,28 @@ def input_file(request):
 def tracked_vessels(request):
     """Fixture to get IMO numbers from pytest command-line options."""
     return set(map(int, request.config.getoption("--imo").split(",")))
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+def sqlite_connection():
+    """Open an in-memory sqlite database with the portman schema."""
+    conn = connect_sqlite(":memory:")
+    create_tables(conn.cursor(), sqlite=True)
+    conn.commit()
+    return conn
+
+@pytest.fixture
+def sqlite_db():
+    """Fresh in-memory sqlite database with the portman schema."""
+    conn = sqlite_connection()
+    yield conn
+    conn.close()
+
+def table_contents(conn):
+    """Return voyages and arrivals without the created/modified bookkeeping columns."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM voyages ORDER BY portCallId")
+    voyages = [row[:-2] for row in cursor.fetchall()]
+    cursor.execute("SELECT portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName FROM arrivals ORDER BY id")
+    arrivals = cursor.fetchall()
+    return voyages, arrivals
@@ -0,0 +1,95 @@
+import sys
+import os
+import http.client
+import json
+import threading
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR
+from portman_agent import read_json_from_directory
+from portman_api import ReadCache, route, serve
+
+RETENTION_DAYS = 100000  # The test snapshots are from 2025
+
+def ingest_with_cache(conn, monkeypatch):
+    """Ingest the test snapshots with a warmed ReadCache listening to the commits."""
+    monkeypatch.setattr(portman_agent, "commit_listeners", [])
+    cache = ReadCache(RETENTION_DAYS)
+    cache.warm(conn)
+    portman_agent.add_commit_listener(cache.apply)
+    read_json_from_directory(DATA_DIR, None, conn)
+    return cache
+
+def test_live_updates_match_warm_up(sqlite_db, monkeypatch):
+    """A cache updated on every commit holds the same voyages and arrivals as one warmed from the tables afterwards."""
+    live = ingest_with_cache(sqlite_db, monkeypatch)
+    warmed = ReadCache(RETENTION_DAYS)
+    warmed.warm(sqlite_db)
+    assert live.arrivals, "Expected arrivals in the test snapshots"
+    assert live.voyages == warmed.voyages
+    assert list(live.arrivals) == list(warmed.arrivals)
+    assert live.indexes == warmed.indexes
+
+def test_queries(sqlite_db, monkeypatch):
+    """Index lookups agree with scanning the cached voyages."""
+    cache = ingest_with_cache(sqlite_db, monkeypatch)
+    records = list(cache.voyages.values())
+    port = records[0]["portToVisit"]
+    imo = records[0]["imoLloyds"]
+
+    assert {record["portCallId"] for record in cache.port_calls(port=port)} == {
+        record["portCallId"] for record in records if record["portToVisit"] == port
+    }
+    in_port = cache.port_calls(port=port, in_port=True)
+    assert all(record["ata"] and not record["atd"] for record in in_port)
+    assert all(record["imoLloyds"] == imo for record in cache.port_calls(imo=imo))
+    assert len(cache.port_calls(limit=3)) == 3
+
+    arrivals = cache.latest_arrivals(limit=5)
+    assert arrivals == list(reversed(cache.arrivals))[:5]
+    assert cache.latest_arrivals(port=port, limit=1000) == [arrival for arrival in reversed(cache.arrivals) if arrival["portToVisit"] == port]
+    assert all(arrival["imoLloyds"] == imo and arrival["portToVisit"] == port for arrival in cache.latest_arrivals(port=port, imo=imo))
+
+    assert route(cache, f"/port-calls/{records[0]['portCallId']}") == (200, records[0])
+    assert route(cache, "/port-calls/0")[0] == 404
+    assert route(cache, "/arrivals?limit=x")[0] == 400
+    assert route(cache, "/unknown")[0] == 404
+
+def test_departed_port_calls_are_evicted(sqlite_db, monkeypatch):
+    """Port calls that departed before the retention window leave the cache and its indexes."""
+    cache = ingest_with_cache(sqlite_db, monkeypatch)
+    departed = [record for record in cache.voyages.values() if record["atd"]]
+    assert departed
+    cache.retention_days = 0
+    with cache.lock:
+        assert cache.evict() == len(departed)
+    assert all(not record["atd"] for record in cache.port_calls())
+    assert sum(len(ids) for ids in cache.indexes["portToVisit"].values()) == len(cache.voyages)
+
+def test_concurrent_http_clients(sqlite_db, monkeypatch):
+    """Concurrent keep-alive clients all get complete answers."""
+    cache = ingest_with_cache(sqlite_db, monkeypatch)
+    server = serve(cache, 0)
+    port = server.server_address[1]
+    expected = json.loads(json.dumps(cache.latest_arrivals(limit=20)))
+    failures = []
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        for _ in range(50):
+            conn.request("GET", "/arrivals?limit=20")
+            response = conn.getresponse()
+            if response.status != 200 or json.loads(response.read()) != expected:
+                failures.append(response.status)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    assert not failures
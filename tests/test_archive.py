@@ -0,0 +1,65 @@
+import sys
+import os
+import gzip
+import shutil
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import iter_port_calls, read_json_from_directory
+from portman_archive import convert_directory, iter_archive, iter_snapshots, port_call_key, replay_archive
+
+def archive_test_data(tmp_path):
+    """Archive the test snapshots, return the archive path."""
+    path = str(tmp_path / "portnet.jsonl.gz")
+    assert convert_directory(DATA_DIR, path) == 5
+    return path
+
+def test_archive_restores_snapshots(tmp_path):
+    """Every snapshot can be restored from the archive with the same port calls."""
+    path = archive_test_data(tmp_path)
+    names = []
+    for name, entries in iter_snapshots(path):
+        names.append(name)
+        assert entries == {port_call_key(entry): entry for entry in iter_port_calls(os.path.join(DATA_DIR, name))}
+    assert names == sorted(name for name in os.listdir(DATA_DIR) if name.startswith("portnet"))
+
+def test_archive_stores_only_changes(tmp_path):
+    """Snapshots after the first store only changed port calls and the archive is smaller than the raw files."""
+    path = archive_test_data(tmp_path)
+    counts = [sum(1 for _ in upserts) for _, upserts, _ in iter_archive(path)]
+    first = sum(1 for _ in iter_port_calls(os.path.join(DATA_DIR, "portnet-20250101000032.json")))
+    assert counts[0] == first
+    assert all(count < first for count in counts[1:])
+    raw_size = sum(os.path.getsize(os.path.join(DATA_DIR, name)) for name in os.listdir(DATA_DIR) if name.startswith("portnet") and name.endswith(".json"))
+    assert os.path.getsize(path) < raw_size / 10
+
+def test_archive_appends_new_snapshots(tmp_path):
+    """Converting again only appends snapshots that are not archived yet."""
+    snapshots = tmp_path / "snapshots"
+    snapshots.mkdir()
+    names = sorted(name for name in os.listdir(DATA_DIR) if name.startswith("portnet") and name.endswith(".json"))
+    for name in names[:2]:
+        shutil.copy(os.path.join(DATA_DIR, name), snapshots)
+    path = str(tmp_path / "archive.jsonl.gz")
+    assert convert_directory(str(snapshots), path) == 2
+    for name in names[2:]:
+        shutil.copy(os.path.join(DATA_DIR, name), snapshots)
+    assert convert_directory(str(snapshots), path) == 3
+
+    full = archive_test_data(tmp_path)
+    with gzip.open(path, "rt", encoding="utf-8") as appended, gzip.open(full, "rt", encoding="utf-8") as converted:
+        assert appended.read() == converted.read()
+
+def test_replay_matches_raw_files(tmp_path, sqlite_db):
+    """Replaying the archive gives the same voyages and arrivals as replaying the raw files."""
+    path = archive_test_data(tmp_path)
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+
+    replay_db = sqlite_connection()
+    replay_archive(path, None, replay_db)
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(replay_db) == (voyages, arrivals)
+    replay_db.close()
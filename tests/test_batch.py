@@ -0,0 +1,41 @@
+import sys
+import os
+import pickle
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import process_query, read_json_from_file, save_results_to_db
+from portman_batch import RESULT_FIELDS, PortCallBatch
+
+def load_results():
+    return process_query(read_json_from_file(os.path.join(DATA_DIR, "portnet-20250101000032.json")), None)
+
+def test_batch_behaves_like_list_of_dicts():
+    """Views of a batch compare equal to the result dicts and round-trip through pickle."""
+    results = load_results()
+    assert isinstance(results, PortCallBatch)
+    dicts = [dict(entry) for entry in results]
+    assert len(results) == len(dicts) > 0
+    assert list(dicts[0]) == list(RESULT_FIELDS)
+    assert results[-1] == dicts[-1]
+    assert results[-1].get("missing") is None
+    assert list(results[1:3]) == dicts[1:3]
+    assert list(pickle.loads(pickle.dumps(results))) == dicts
+
+    rebuilt = PortCallBatch.from_dicts(dicts)
+    names = [entry["portAreaName"] for entry in rebuilt if entry["portAreaName"]]
+    assert all(name is names[0] for name in names if name == names[0])  # Repeated strings are shared
+
+def test_batch_and_dicts_save_identically():
+    """Saving a batch writes the same rows as saving the equivalent list of dicts."""
+    results = load_results()
+    contents = []
+    for payload in (results, [dict(entry) for entry in results]):
+        conn = sqlite_connection()
+        save_results_to_db(payload, conn)
+        contents.append(table_contents(conn))
+        conn.close()
+    assert contents[0] == contents[1]
+    assert contents[0][0]
@@ -0,0 +1,211 @@
+import sys
+import os
+import collections
+import contextlib
+import glob
+import json
+import multiprocessing
+import random
+import pg8000
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from config import CLUSTER_CONFIG, DATABASE_CONFIG
+from conftest import DATA_DIR, table_contents
+from portman_agent import AgentDaemon, create_tables, process_query, save_results_to_db
+from portman_cluster import PartitionLeases, lock_maintenance, partition_of
+from portman_storage import create_arrivals_unique_index
+
+SCHEMA = "portman_cluster_test"
+BASELINE_SCHEMA = "portman_cluster_test_baseline"
+PARTITIONS = 16
+
+def connect(schema=None):
+    conn = pg8000.connect(database=DATABASE_CONFIG["dbname"], user=DATABASE_CONFIG["user"], password=DATABASE_CONFIG["password"],
+                          host=DATABASE_CONFIG["host"], port=DATABASE_CONFIG["port"])
+    if schema:
+        cursor = conn.cursor()
+        cursor.execute(f"SET search_path TO {schema};")
+        conn.commit()
+    return conn
+
+def snapshot_files():
+    return sorted(path for path in glob.glob(os.path.join(DATA_DIR, "portnet*.json")))
+
+def load_batch(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return process_query(json.load(file), None)
+
+@pytest.fixture
+def postgres():
+    """Scratch schemas in the local PostgreSQL, skipped when it is not reachable.
+
+    Yields a random lock namespace and a function opening connections to a schema, which are closed afterwards.
+    """
+    try:
+        conn = connect()
+    except Exception as e:
+        pytest.skip(f"Local PostgreSQL not available: {e}")
+    cursor = conn.cursor()
+    for schema in (SCHEMA, BASELINE_SCHEMA):
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cursor.execute(f"CREATE SCHEMA {schema};")
+        cursor.execute(f"SET search_path TO {schema};")
+        create_tables(cursor)
+        if schema == SCHEMA:
+            create_arrivals_unique_index(cursor)  # As agents started with --cluster; the baseline is a single agent
+    conn.commit()
+    opened = []
+
+    def open_connection(schema=SCHEMA):
+        opened.append(connect(schema))
+        return opened[-1]
+
+    yield random.randrange(1, 2 ** 31 - 1), open_connection
+    for connection in opened:
+        connection.close()
+    for schema in (SCHEMA, BASELINE_SCHEMA):
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    conn.commit()
+    conn.close()
+
+def test_partitioning_covers_every_port_call():
+    """Every port call falls in exactly one partition, and selecting all partitions keeps the batch."""
+    batch = load_batch(snapshot_files()[0])
+    leases = PartitionLeases(PARTITIONS)
+    counts = [0] * PARTITIONS
+    for port_call_id in batch.column("portCallId"):
+        counts[partition_of(port_call_id, PARTITIONS)] += 1
+    assert sum(counts) == len(batch) and min(counts) > 0
+    leases.owned = set(range(PARTITIONS))
+    assert len(leases.select(batch)) == len(batch)
+    leases.owned = {0}
+    assert all(port_call_id % PARTITIONS == 0 for port_call_id in leases.select(batch).column("portCallId"))
+    assert partition_of("FIHEL", PARTITIONS, "port") == partition_of("FIHEL", PARTITIONS, "port")
+
+def rebalance_rounds(agents, rounds=3):
+    for _ in range(rounds):
+        for agent in agents:
+            agent.rebalance()
+
+def test_leases_are_shared_and_taken_over(postgres):
+    """Agents converge to disjoint, covering, even shares; the partitions of a dead agent are taken over."""
+    namespace, _ = postgres
+    agents = [PartitionLeases(PARTITIONS, namespace=namespace) for _ in range(3)]
+    rebalance_rounds(agents)
+    owned = [agent.owned for agent in agents]
+    assert sorted(len(partitions) for partitions in owned) == [4, 6, 6]
+    assert set().union(*owned) == set(range(PARTITIONS))
+
+    agents[1].conn.close()  # The session ends as if the process died, releasing its locks
+    survivors = [agents[0], agents[2]]
+    rebalance_rounds(survivors)
+    assert [len(agent.owned) for agent in survivors] == [8, 8]
+    assert agents[0].owned | agents[2].owned == set(range(PARTITIONS))
+    assert not agents[1].verify()
+    for agent in survivors:
+        agent.close()
+
+def run_agent(index, namespace, barrier, owned_counts):
+    """Agent process: converge the leases before every snapshot, then save the port calls of its partitions."""
+    conn = connect(SCHEMA)
+    leases = PartitionLeases(PARTITIONS, namespace=namespace)
+    for path in snapshot_files():
+        while True:
+            barrier.wait()
+            leases.rebalance()
+            owned_counts[index] = len(leases.owned)
+            barrier.wait()
+            if sum(owned_counts) == PARTITIONS:
+                break
+        assert leases.verify()
+        save_results_to_db(leases.select(load_batch(path)), conn)
+    leases.close()
+    conn.close()
+
+def test_agent_processes_write_like_one_agent(postgres):
+    """Three agent processes sharing the partitions produce the voyages and arrivals of a single agent."""
+    namespace, open_connection = postgres
+    baseline = open_connection(BASELINE_SCHEMA)
+    for path in snapshot_files():
+        save_results_to_db(load_batch(path), baseline)
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(3)
+    owned_counts = context.Array("i", 3)
+    agents = [context.Process(target=run_agent, args=(index, namespace, barrier, owned_counts)) for index in range(3)]
+    for agent in agents:
+        agent.start()
+    for agent in agents:
+        agent.join(timeout=120)
+    assert [agent.exitcode for agent in agents] == [0, 0, 0]
+
+    voyages, arrivals = table_contents(open_connection())
+    expected_voyages, expected_arrivals = table_contents(baseline)
+    assert voyages == expected_voyages
+    assert collections.Counter(map(tuple, arrivals)) == collections.Counter(map(tuple, expected_arrivals))  # Inserted in another order
+
+def test_duplicate_arrival_is_not_recorded(postgres):
+    """An agent with a stale view of a port call does not insert an arrival that is already recorded."""
+    conn = postgres[1]()
+    first, second = snapshot_files()[:2]
+    save_results_to_db(load_batch(first), conn)
+    save_results_to_db(load_batch(second), conn)
+    _, arrivals = table_contents(conn)
+
+    cursor = conn.cursor()
+    cursor.execute("UPDATE voyages SET ata = NULL;")  # As seen by an agent that read the voyages before the first save
+    conn.commit()
+    save_results_to_db(load_batch(second), conn)
+    assert table_contents(conn)[1] == arrivals
+
+def unique_index_exists(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = 'arrivals_portcallid_ata_key' AND schemaname = %s;", (SCHEMA,))
+    exists = cursor.fetchone()[0] == 1
+    conn.rollback()
+    return exists
+
+class SchemaPool:
+    """Stands in for the connection pool, handing out one connection to the scratch schema."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.conn
+
+    def fill(self):
+        pass
+
+def test_maintenance_runs_in_one_agent_at_a_time(postgres, monkeypatch):
+    """While one agent holds the maintenance lock, the others skip partition maintenance and index creation."""
+    namespace, open_connection = postgres
+    monkeypatch.setitem(CLUSTER_CONFIG, "lock_namespace", namespace)
+    holder, other = open_connection(), open_connection()
+    other.cursor().execute("DROP INDEX arrivals_portcallid_ata_key;")
+    other.commit()
+    assert lock_maintenance(holder.cursor())
+    assert not lock_maintenance(other.cursor())
+    other.rollback()
+
+    maintained = []
+    monkeypatch.setattr(portman_agent, "maintain_partitions", lambda cursor: maintained.append(cursor))
+    monkeypatch.setattr(portman_agent, "get_pool", lambda: SchemaPool(other))
+    daemon = AgentDaemon(None, interval=60, leases=PartitionLeases(PARTITIONS, namespace=namespace))
+    daemon.maintained = None
+    daemon.maintain_partitions()
+    assert maintained == [] and daemon.maintained is not None  # Skipped for the day
+    portman_agent.create_cluster_index()
+    assert not unique_index_exists(other)
+
+    holder.commit()  # A transaction-level lock ends with the transaction
+    daemon.maintained = None
+    daemon.maintain_partitions()
+    assert len(maintained) == 1
+    portman_agent.create_cluster_index()
+    assert unique_index_exists(other)
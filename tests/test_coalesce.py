@@ -0,0 +1,127 @@
+import sys
+import os
+import glob
+import json
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import process_query, read_json_from_directory, save_results_to_db, save_spooled_batches
+from portman_batch import FIELD_INDEX, PortCallBatch
+from portman_storage import create_arrivals_unique_index
+
+class RecordingSink:
+    """Stands in for the ArrivalSink and records the published events."""
+
+    def __init__(self):
+        self.events = []
+
+    def publish(self, event):
+        self.events.append(event)
+
+def recording_sink(monkeypatch):
+    sink = RecordingSink()
+    monkeypatch.setattr(portman_agent, "get_sink", lambda: sink)
+    return sink
+
+def load_batch(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return process_query(json.load(file), None)
+
+def replay(monkeypatch, conn, coalesce, workers=1):
+    """Replay the test snapshots, return the published arrival events."""
+    sink = recording_sink(monkeypatch)
+    read_json_from_directory(DATA_DIR, None, conn, workers=workers, coalesce=coalesce)
+    return sink.events
+
+def test_coalesced_replay_matches_per_file_replay(sqlite_db, monkeypatch):
+    """Folding all snapshots gives the same voyages, arrivals and arrival events as saving file by file."""
+    events = replay(monkeypatch, sqlite_db, coalesce=False)
+
+    coalesced_db = sqlite_connection()
+    coalesced_events = replay(monkeypatch, coalesced_db, coalesce=True)
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(coalesced_db) == (voyages, arrivals)
+    assert coalesced_events == events
+
+    # Replaying on top of existing data only adds what the per-file path would add
+    events = replay(monkeypatch, sqlite_db, coalesce=False)
+    assert replay(monkeypatch, coalesced_db, coalesce=True) == events
+    assert table_contents(coalesced_db) == table_contents(sqlite_db)
+    coalesced_db.close()
+
+def test_coalesced_replay_over_overlapping_backfill(sqlite_db, monkeypatch):
+    """Replaying all snapshots over the first two publishes the events of the per-file path, each for its port call."""
+    coalesced_db = sqlite_connection()
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "portnet*.json")))[:2]:
+        save_results_to_db(load_batch(path), sqlite_db)
+        save_results_to_db(load_batch(path), coalesced_db)
+
+    events = replay(monkeypatch, sqlite_db, coalesce=False)
+    assert events, "Expected arrivals after the first two snapshots"
+    assert replay(monkeypatch, coalesced_db, coalesce=True) == events
+    assert table_contents(coalesced_db) == table_contents(sqlite_db)
+    coalesced_db.close()
+
+@pytest.mark.parametrize("cluster", [False, True])
+def test_coalesced_arrival_back_at_earlier_ata(sqlite_db, monkeypatch, cluster):
+    """A port call arriving at A, B and A again, then another one arriving, gives the events of the per-file path.
+
+    The second arrival at A is recorded, except in cluster mode where the unique arrivals index skips it.
+    """
+    base = next(load_batch(path)[0] for path in sorted(glob.glob(os.path.join(DATA_DIR, "portnet*.json"))))
+
+    def chunk(port_call_id, ata):
+        row = list(base.values())
+        row[FIELD_INDEX["portCallId"]] = port_call_id
+        row[FIELD_INDEX["ata"]] = ata
+        return PortCallBatch.from_rows([tuple(row)])
+
+    chunks = [
+        chunk(1, "2025-01-01T01:00:00.000Z"), chunk(1, "2025-01-01T02:00:00.000Z"),
+        chunk(1, "2025-01-01T01:00:00.000Z"), chunk(2, "2025-01-01T03:00:00.000Z")
+    ]
+    coalesced_db = sqlite_connection()
+    if cluster:
+        create_arrivals_unique_index(sqlite_db.cursor(), sqlite=True)
+        create_arrivals_unique_index(coalesced_db.cursor(), sqlite=True)
+    sink = recording_sink(monkeypatch)
+    for batch in chunks:
+        save_results_to_db(batch, sqlite_db)
+    events = list(sink.events)
+    assert [event["portCallId"] for event in events] == ([1, 1, 2] if cluster else [1, 1, 1, 2])
+
+    sink.events.clear()
+    assert save_spooled_batches(chunks, coalesced_db)
+    assert sink.events == events
+    assert table_contents(coalesced_db) == table_contents(sqlite_db)
+    coalesced_db.close()
+
+def test_coalesced_replay_with_workers(sqlite_db, monkeypatch):
+    """Files decoded in worker processes fold to the same result."""
+    replay(monkeypatch, sqlite_db, coalesce=False)
+    coalesced_db = sqlite_connection()
+    replay(monkeypatch, coalesced_db, coalesce=True, workers=2)
+    assert table_contents(coalesced_db) == table_contents(sqlite_db)
+    coalesced_db.close()
+
+def test_coalesced_replay_uses_one_transaction(sqlite_db, monkeypatch):
+    """All files are written with a single commit."""
+    commits = []
+    class CountingConnection:
+        def __init__(self, conn):
+            self.conn = conn
+        def commit(self):
+            commits.append(1)
+            self.conn.commit()
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+    monkeypatch.setattr(portman_agent, "is_sqlite_connection", lambda conn: True)
+    replay(monkeypatch, CountingConnection(sqlite_db), coalesce=True)
+    assert len(commits) == 1
+    assert table_contents(sqlite_db)[1]
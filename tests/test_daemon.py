@@ -0,0 +1,80 @@
+import sys
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from portman_agent import AgentDaemon
+
+class FakePool:
+    """Stands in for the connection pool, the polls in this test do not touch the database."""
+
+    def fill(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeClock:
+    """Clock the test moves by hand."""
+
+    def __init__(self):
+        self.now = datetime(2025, 1, 1, 12, 0, 0)
+
+    def __call__(self):
+        return self.now
+
+def test_next_run_stays_on_the_interval_grid():
+    """The next poll is due on the grid from startup, however long the previous poll took."""
+    clock = FakeClock()
+    daemon = AgentDaemon(None, interval=300, clock=clock)
+    daemon.anchor = clock()
+    for elapsed, due in ((0, 300), (0.5, 300), (299.9, 300), (300, 600), (742, 900)):
+        clock.now = daemon.anchor + timedelta(seconds=elapsed)
+        assert daemon.next_run() == daemon.anchor + timedelta(seconds=due)
+
+def test_poll_is_skipped_while_the_previous_one_runs():
+    """A job firing while the previous poll still runs is skipped, the next one after it polls again."""
+    daemon = AgentDaemon(None, interval=300)
+    release = threading.Event()
+    polls = []
+
+    def blocking_poll():
+        polls.append(len(polls))
+        release.wait(5)
+
+    daemon.poll = blocking_poll
+    daemon.job()
+    daemon.job()  # Overruns: the first poll is still waiting
+    release.set()
+    daemon.worker.join(5)
+    daemon.job()
+    daemon.worker.join(5)
+    assert polls == [0, 1]
+
+def test_daemon_polls_until_stopped(monkeypatch):
+    """The scheduler loop polls at startup and on schedule, and stops after the running poll."""
+    polled = threading.Event()
+    polls = []
+
+    def quick_poll(tracked_vessels, conn=None, cache=None, leases=None):
+        polls.append(time.monotonic())
+        if len(polls) == 2:
+            polled.set()
+
+    monkeypatch.setattr(portman_agent, "poll", quick_poll)
+    monkeypatch.setattr(portman_agent, "get_pool", lambda: FakePool())
+    daemon = AgentDaemon(None, interval=0.05)
+
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    assert polled.wait(10)
+    daemon.stop()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert polls == sorted(polls)
@@ -0,0 +1,122 @@
+import sys
+import os
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR, table_contents
+from portman_agent import process_query, read_json_from_file, save_results_to_db
+from portman_events import ArrivalSink, JsonLinesOutput, WebhookOutput, format_arrival
+
+class RecordingOutput:
+    """Output collecting batches, optionally blocking until released."""
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.release = release
+
+    def emit(self, events):
+        if self.release is not None:
+            self.release.wait()
+        self.batches.append(list(events))
+
+    def close(self):
+        pass
+
+def make_event(number):
+    return {"portCallId": number, "ata": "2025-01-01T10:00:00.000Z"}
+
+def test_events_are_batched_to_all_outputs(tmp_path):
+    """Queued events reach every output in order, in batches of at most batch_size."""
+    recorder = RecordingOutput()
+    path = tmp_path / "arrivals.jsonl"
+    sink = ArrivalSink([recorder, JsonLinesOutput(str(path))], batch_size=3, flush_interval=0.2)
+    for number in range(7):
+        sink.publish(make_event(number))
+    sink.close()
+
+    assert all(len(batch) <= 3 for batch in recorder.batches)
+    assert [event["portCallId"] for batch in recorder.batches for event in batch] == list(range(7))
+    assert [json.loads(line)["portCallId"] for line in path.read_text().splitlines()] == list(range(7))
+
+def test_full_queue_blocks_or_drops():
+    """A full queue makes publishers wait under 'block' and discards events under 'drop'."""
+    release = threading.Event()
+    dropping = ArrivalSink([RecordingOutput(release)], queue_size=2, batch_size=1, flush_interval=0, overflow="drop")
+    published = [dropping.publish(make_event(number)) for number in range(10)]
+    assert not all(published) and dropping.dropped == published.count(False)
+    release.set()
+    dropping.close()
+
+    release = threading.Event()
+    blocking = ArrivalSink([RecordingOutput(release)], queue_size=2, batch_size=1, flush_interval=0)
+    publisher = threading.Thread(target=lambda: [blocking.publish(make_event(number)) for number in range(10)])
+    publisher.start()
+    publisher.join(0.2)
+    assert publisher.is_alive()  # Waiting for the output to catch up
+    release.set()
+    publisher.join(2)
+    blocking.close()
+    assert not publisher.is_alive()
+    assert sum(len(batch) for batch in blocking.outputs[0].batches) == 10
+
+def test_webhook_receives_json_batches():
+    """The webhook output POSTs each batch as a JSON array."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sink = ArrivalSink([WebhookOutput(f"http://127.0.0.1:{server.server_address[1]}/arrivals")], batch_size=10, flush_interval=0.2)
+        for number in range(4):
+            sink.publish(make_event(number))
+        sink.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [event["portCallId"] for batch in received for event in batch] == [0, 1, 2, 3]
+
+def test_save_does_not_wait_for_outputs(sqlite_db, monkeypatch):
+    """Saving commits while the event output is blocked; the events follow once it is released."""
+    release = threading.Event()
+    recorder = RecordingOutput(release)
+    monkeypatch.setattr(portman_agent, "sink", ArrivalSink([recorder], flush_interval=0))
+
+    results = process_query(read_json_from_file(os.path.join(DATA_DIR, "portnet-20250101000032.json")), None)
+    start = time.perf_counter()
+    save_results_to_db(results, sqlite_db)
+    assert time.perf_counter() - start < 5
+    _, arrivals = table_contents(sqlite_db)
+    assert arrivals
+
+    release.set()
+    portman_agent.close_sink()
+    events = [event for batch in recorder.batches for event in batch]
+    assert [(event["portCallId"], event["ata"]) for event in events] == [(row[0], row[3]) for row in arrivals]
+
+def test_format_arrival_accepts_strings_and_datetimes():
+    """Arrival text formats API strings and database datetimes the same way."""
+    event = {
+        "portCallId": 1, "portCallTimestamp": "2025-01-01T10:00:00.000+00:00", "imoLloyds": 9606900, "vesselName": "Test",
+        "portToVisit": "FIHEL", "portAreaName": "Area", "berthName": "Berth", "eta": "2025-01-01T09:30:00.000+00:00",
+        "etd": None, "atd": None, "passengersOnArrival": 1, "passengersOnDeparture": 2, "crewOnArrival": 3, "crewOnDeparture": 4
+    }
+    as_string = format_arrival(dict(event, ata="2025-01-01T09:41:00.000Z"))
+    assert "Toteutunut saapumisaika (UTC): 2025-01-01 09:41" in as_string
+    assert "Arvioitu lähtöaika (UTC): N/A" in as_string
+    assert format_arrival(dict(event, ata=datetime(2025, 1, 1, 9, 41))) == as_string
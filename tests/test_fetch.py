@@ -0,0 +1,125 @@
+import sys
+import os
+import gzip
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from config import SPOOL_CONFIG
+from portman_fetch import NOT_MODIFIED, PortCallFetcher
+
+PORT_CALLS = [
+    {"portCallId": 1, "portCallTimestamp": "2025-01-01T10:00:00.000+00:00"},
+    {"portCallId": 2, "portCallTimestamp": "2025-01-01T11:00:00.000+00:00"},
+    {"portCallId": 3, "portCallTimestamp": "2025-01-01T12:00:00.000+00:00"},
+]
+
+class StubPortCallHandler(BaseHTTPRequestHandler):
+    """Serves PORT_CALLS gzip-compressed with an ETag and honours `from` and If-None-Match."""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        since = query.get("from", [""])[0]
+        body = json.dumps({"portCalls": [entry for entry in PORT_CALLS if entry["portCallTimestamp"] >= since]}).encode()
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        self.server.requests.append({"query": query, "headers": dict(self.headers)})
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        payload = gzip.compress(body) if "gzip" in self.headers.get("Accept-Encoding", "") else body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if payload is not body:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub_api():
+    """Local stub of the port calls API, yields (url, server)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubPortCallHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/port-calls", server
+    server.shutdown()
+    server.server_close()
+
+def test_conditional_fetch_returns_not_modified(stub_api):
+    """The second fetch sends the ETag back and short-circuits on 304."""
+    url, server = stub_api
+    fetcher = PortCallFetcher(url=url, delta=False, state_file="")
+
+    data = fetcher.fetch()
+    assert [entry["portCallId"] for entry in data["portCalls"]] == [1, 2, 3]
+    assert fetcher.bytes_fetched < len(json.dumps(data))  # Transferred gzip-compressed
+    fetcher.commit()
+
+    assert fetcher.fetch() is NOT_MODIFIED
+    assert server.requests[1]["headers"]["If-None-Match"] == fetcher.etag
+
+def test_delta_fetch_uses_latest_port_call_timestamp(stub_api, tmp_path):
+    """Delta mode asks only for port calls since the newest timestamp seen, also after a restart."""
+    url, server = stub_api
+    state_file = str(tmp_path / "fetch-state.json")
+    fetcher = PortCallFetcher(url=url, delta=True, state_file=state_file)
+    assert len(fetcher.fetch()["portCalls"]) == 3
+    fetcher.commit()
+
+    PORT_CALLS.append({"portCallId": 4, "portCallTimestamp": "2025-01-01T13:00:00.000+00:00"})
+    try:
+        data = fetcher.fetch()
+        assert server.requests[1]["query"]["from"] == ["2025-01-01T12:00:00.000+00:00"]
+        assert "If-None-Match" not in server.requests[1]["headers"]  # Validators belong to the full list
+        assert [entry["portCallId"] for entry in data["portCalls"]] == [3, 4]
+        fetcher.commit()
+
+        restarted = PortCallFetcher(url=url, delta=True, state_file=state_file)
+        assert [entry["portCallId"] for entry in restarted.fetch()["portCalls"]] == [4]
+        restarted.commit()
+        assert server.requests[2]["query"]["from"] == ["2025-01-01T13:00:00.000+00:00"]
+        assert restarted.fetch() is NOT_MODIFIED
+    finally:
+        PORT_CALLS.pop()
+
+def test_failed_save_is_fetched_again(stub_api, tmp_path, monkeypatch):
+    """When a poll cannot save a delta response, the next fetch asks from the old position, also after a restart."""
+    url, server = stub_api
+    state_file = str(tmp_path / "fetch-state.json")
+    fetcher = PortCallFetcher(url=url, delta=True, state_file=state_file)
+    fetcher.fetch()
+    fetcher.commit()
+    monkeypatch.setattr(portman_agent, "fetcher", fetcher)
+    monkeypatch.setitem(SPOOL_CONFIG, "enabled", False)
+
+    PORT_CALLS.append({"portCallId": 4, "portCallTimestamp": "2025-01-01T13:00:00.000+00:00"})
+    try:
+        monkeypatch.setattr(portman_agent, "save_results_to_db", lambda results, conn, cache=None: False)
+        portman_agent.poll(None, conn=object())
+        assert server.requests[1]["query"]["from"] == ["2025-01-01T12:00:00.000+00:00"]
+
+        restarted = PortCallFetcher(url=url, delta=True, state_file=state_file)
+        assert restarted.params()["from"] == "2025-01-01T12:00:00.000+00:00"
+
+        saved = []
+        monkeypatch.setattr(portman_agent, "save_results_to_db", lambda results, conn, cache=None: saved.append(len(results)) or True)
+        portman_agent.poll(None, conn=object())
+        assert server.requests[2]["query"]["from"] == ["2025-01-01T12:00:00.000+00:00"]
+        assert saved == [2]
+        assert fetcher.params()["from"] == "2025-01-01T13:00:00.000+00:00"
+    finally:
+        PORT_CALLS.pop()
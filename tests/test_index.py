@@ -0,0 +1,64 @@
+import sys
+import os
+import shutil
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from config import INDEX_CONFIG
+from portman_agent import iter_port_calls, read_json_from_directory
+from portman_index import SnapshotIndex, iter_indexed_entries
+
+def copy_snapshots(directory):
+    """Copy the test snapshots to `directory` and return their paths."""
+    paths = []
+    for name in sorted(os.listdir(DATA_DIR)):
+        if name.startswith("portnet") and name.endswith(".json"):
+            paths.append(shutil.copy(os.path.join(DATA_DIR, name), directory))
+    return paths
+
+def test_indexed_entries_match_full_decode(tmp_path, tracked_vessels):
+    """The entries read through the index are exactly the tracked entries of a full decode."""
+    paths = copy_snapshots(tmp_path)
+    index = SnapshotIndex(tmp_path)
+    assert index.update(paths) == len(paths)
+
+    for path in paths:
+        expected = [entry for entry in iter_port_calls(path) if entry.get("imoLloyds") in tracked_vessels]
+        assert list(iter_indexed_entries(path, index.ranges(path, tracked_vessels))) == expected
+
+def test_indexed_run_matches_full_run(tmp_path, sqlite_db, tracked_vessels, monkeypatch):
+    """A tracked run using the index writes the same voyages and arrivals as a full read."""
+    copy_snapshots(tmp_path)
+    monkeypatch.setitem(INDEX_CONFIG, "enabled", False)
+    read_json_from_directory(str(tmp_path), tracked_vessels, sqlite_db)
+    assert not os.path.exists(tmp_path / INDEX_CONFIG["file"])
+
+    monkeypatch.setitem(INDEX_CONFIG, "enabled", True)
+    indexed_db = sqlite_connection()
+    read_json_from_directory(str(tmp_path), tracked_vessels, indexed_db)
+    assert os.path.exists(tmp_path / INDEX_CONFIG["file"])
+    assert table_contents(indexed_db) == table_contents(sqlite_db)
+    indexed_db.close()
+
+def test_index_updates_incrementally(tmp_path):
+    """Only new or changed files are reindexed and removed files are forgotten."""
+    paths = copy_snapshots(tmp_path)
+    assert SnapshotIndex(tmp_path).update(paths) == len(paths)
+    assert SnapshotIndex(tmp_path).update(paths) == 0
+
+    with open(paths[0], "a", encoding="utf-8") as file:
+        file.write("\n")
+    os.remove(paths[-1])
+    index = SnapshotIndex(tmp_path)
+    assert index.update(paths[:-1]) == 1
+    assert index.ranges(paths[-1], [1]) is None
+    assert SnapshotIndex(tmp_path).files.keys() == {os.path.basename(path) for path in paths[:-1]}
+
+def test_files_without_tracked_vessels_have_no_ranges(tmp_path):
+    """Unknown IMO numbers give empty ranges, so their files are skipped."""
+    paths = copy_snapshots(tmp_path)
+    index = SnapshotIndex(tmp_path)
+    index.update(paths)
+    assert all(index.ranges(path, [1]) == [] for path in paths)
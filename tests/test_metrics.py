@@ -0,0 +1,50 @@
+import sys
+import os
+import json
+import urllib.request
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR
+from portman_agent import process_query, read_json_from_file, save_results_to_db
+from portman_metrics import NULL_STAGE, Metrics
+
+def test_disabled_metrics_are_no_ops():
+    """Disabled metrics hand out the shared no-op stage and record nothing."""
+    metrics = Metrics(enabled=False)
+    assert metrics.stage("fetch") is NULL_STAGE
+    cursor = object()
+    assert metrics.cursor(cursor) is cursor
+    metrics.increment("polls")
+    assert metrics.snapshot()["counters"]["polls"] == 0
+
+def test_pipeline_stages_are_counted_and_exported(sqlite_db, monkeypatch, tmp_path):
+    """A processed and saved snapshot shows up in counters, stage timers, Prometheus text and JSON."""
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(portman_agent, "metrics", metrics)
+
+    results = process_query(read_json_from_file(os.path.join(DATA_DIR, "portnet-20250101000032.json")), None)
+    save_results_to_db(results, sqlite_db)
+
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    assert counters["port_calls_parsed"] == len(results)
+    assert counters["rows_written"] == len(results)
+    assert counters["arrivals_detected"] > 0
+    assert counters["db_round_trips"] >= 4  # Staging table, load, arrivals, upsert, commit
+    assert {"read_file", "process", "load_staging", "merge", "commit"} <= set(snapshot["stages"])
+
+    port = metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            text = response.read().decode("utf-8")
+    finally:
+        metrics.close()
+    assert f"portman_rows_written_total {len(results)}" in text
+    assert 'portman_stage_duration_seconds_count{stage="merge"} 1' in text
+
+    path = tmp_path / "metrics.json"
+    metrics.dump_json(str(path))
+    assert json.loads(path.read_text())["counters"]["rows_written"] == len(results)
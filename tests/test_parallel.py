@@ -0,0 +1,20 @@
+import sys
+import os
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import read_json_from_directory
+
+def test_parallel_ingest_matches_sequential(sqlite_db):
+    """Parallel decoding with an ordered writer gives the same voyages and arrivals as a sequential run."""
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+
+    parallel_db = sqlite_connection()
+    read_json_from_directory(DATA_DIR, None, parallel_db, workers=3)
+
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(parallel_db) == (voyages, arrivals)
+    parallel_db.close()
@@ -0,0 +1,92 @@
+import sys
+import os
+from datetime import date, timedelta
+import pg8000
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR
+from config import DATABASE_CONFIG, PARTITION_CONFIG
+from portman_agent import create_tables, read_json_from_directory
+from portman_partitions import add_months, list_partitions, maintain_partitions
+
+SCHEMA = "portman_partition_test"
+ARCHIVE_SCHEMA = "portman_partition_test_archive"
+
+def drop_schemas(cursor):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE;")
+
+@pytest.fixture
+def partitioned_db(monkeypatch):
+    """Partitioned portman tables in a scratch schema of the local PostgreSQL, skipped when it is not reachable."""
+    try:
+        conn = pg8000.connect(database=DATABASE_CONFIG["dbname"], user=DATABASE_CONFIG["user"], password=DATABASE_CONFIG["password"],
+                              host=DATABASE_CONFIG["host"], port=DATABASE_CONFIG["port"])
+    except Exception as e:
+        pytest.skip(f"Local PostgreSQL not available: {e}")
+    monkeypatch.setitem(PARTITION_CONFIG, "enabled", True)
+    monkeypatch.setitem(PARTITION_CONFIG, "voyage_partition_size", 10000)
+    monkeypatch.setitem(PARTITION_CONFIG, "archive_schema", ARCHIVE_SCHEMA)
+    monkeypatch.setitem(PARTITION_CONFIG, "retention_months", 120)  # Keep the test data's old arrivals
+    cursor = conn.cursor()
+    drop_schemas(cursor)
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA};")
+    create_tables(cursor)
+    conn.commit()
+    yield conn
+    conn.rollback()
+    drop_schemas(cursor)
+    conn.commit()
+    conn.close()
+
+def count(cursor, table):
+    cursor.execute(f"SELECT count(*) FROM {table};")
+    return cursor.fetchone()[0]
+
+def test_partitions_are_created_ahead(partitioned_db):
+    """Setup creates the default partitions and the arrivals partitions of the coming months."""
+    cursor = partitioned_db.cursor()
+    month = date.today().replace(day=1)
+    expected = {"arrivals_default"} | {f"arrivals_{add_months(month, i):%Y_%m}" for i in range(-1, PARTITION_CONFIG["months_ahead"] + 1)}
+    assert list_partitions(cursor, "arrivals") == expected
+    assert list_partitions(cursor, "voyages") == {"voyages_default"}  # Ranges follow the first port calls
+
+def test_ingest_and_compaction(partitioned_db):
+    """Rows that landed in the default partitions are moved to their own partitions by maintenance."""
+    read_json_from_directory(DATA_DIR, None, partitioned_db)
+    cursor = partitioned_db.cursor()
+    voyages, arrivals = count(cursor, "voyages"), count(cursor, "arrivals")
+    assert voyages and arrivals
+    assert count(cursor, "voyages_default") == voyages
+
+    maintain_partitions(cursor)
+    partitioned_db.commit()
+    assert (count(cursor, "voyages"), count(cursor, "arrivals")) == (voyages, arrivals)
+    assert count(cursor, "voyages_default") == 0
+    assert count(cursor, "arrivals_default") == 0
+    assert {"voyages_p3140000", "voyages_p3190000", "voyages_p3200000", "voyages_p3210000"} <= list_partitions(cursor, "voyages")
+
+    # New port calls go straight to the partitions created ahead
+    read_json_from_directory(DATA_DIR, None, partitioned_db)
+    assert count(cursor, "voyages_default") == 0
+
+def test_retention_archives_old_partitions(partitioned_db):
+    """Partitions past the retention period are detached and moved to the archive schema."""
+    read_json_from_directory(DATA_DIR, None, partitioned_db)
+    cursor = partitioned_db.cursor()
+    maintain_partitions(cursor)
+    voyages, arrivals = count(cursor, "voyages"), count(cursor, "arrivals")
+
+    later = date.today() + timedelta(days=31 * (PARTITION_CONFIG["retention_months"] + 1))
+    maintain_partitions(cursor, later)
+    partitioned_db.commit()
+    assert count(cursor, "arrivals") == 0
+    assert 0 < count(cursor, "voyages") < voyages  # The range of the newest port calls stays
+    cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s;", (ARCHIVE_SCHEMA,))
+    archived = [row[0] for row in cursor.fetchall()]
+    assert sum(count(cursor, f"{ARCHIVE_SCHEMA}.{name}") for name in archived if name.startswith("arrivals")) == arrivals
+    assert count(cursor, "voyages") + sum(count(cursor, f"{ARCHIVE_SCHEMA}.{name}") for name in archived if name.startswith("voyages")) == voyages
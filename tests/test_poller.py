@@ -0,0 +1,176 @@
+import sys
+import os
+import asyncio
+import json
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from portman_poller import AsyncPoller, PortCallDiff, parse_slices
+
+SNAPSHOT = [
+    {"portCallId": 1, "portToVisit": "FIHEL", "imoLloyds": 9606900},
+    {"portCallId": 2, "portToVisit": "FIHEL", "imoLloyds": 9808259},
+    {"portCallId": 3, "portToVisit": "FITKU", "imoLloyds": 9606900},
+    {"portCallId": 4, "portToVisit": "FIRAU", "imoLloyds": 9878319},
+]
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Serves SNAPSHOT filtered by locode/imo, slowly, failing the first request of locodes in `server.fail_once`."""
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+            self.server.requests.append(query)
+            fail = query.get("locode") in self.server.fail_once
+            self.server.fail_once.discard(query.get("locode"))
+        try:
+            time.sleep(self.server.delay)
+            if fail:
+                self.send_error(503)
+                return
+            entries = [entry for entry in SNAPSHOT
+                       if query.get("locode", entry["portToVisit"]) == entry["portToVisit"]
+                       and int(query.get("imo", entry["imoLloyds"])) == entry["imoLloyds"]]
+            body = json.dumps({"portCalls": entries}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def fake_api():
+    """Local fake of the port calls API, yields (url, server)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    server.lock = threading.Lock()
+    server.active = server.max_active = 0
+    server.requests = []
+    server.fail_once = set()
+    server.delay = 0.05
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/port-calls", server
+    server.shutdown()
+    server.server_close()
+
+def test_parse_slices():
+    assert parse_slices("") == [{}]
+    assert parse_slices("locode=FIHEL; imo=9606900&locode=FITKU") == [{"locode": "FIHEL"}, {"imo": "9606900", "locode": "FITKU"}]
+
+def test_slices_are_fetched_concurrently_and_merged(fake_api):
+    """Slices run at most `concurrency` at a time and overlapping port calls are formatted once."""
+    url, server = fake_api
+    formatted = []
+    slices = [{"locode": "FIHEL"}, {"locode": "FITKU"}, {"locode": "FIRAU"}, {"imo": "9606900"}]
+    poller = AsyncPoller(slices, url=url, concurrency=2, formatter=formatted.append)
+    asyncio.run(poller.run(cycles=1))
+
+    assert server.max_active == 2
+    assert len(server.requests) == 4
+    assert [sorted(entry["portCallId"] for entry in cycle) for cycle in formatted] == [[1, 2, 3, 4]]
+
+def test_failed_requests_are_retried(fake_api):
+    """A failing slice is retried and a slice failing every attempt does not stop the others."""
+    url, server = fake_api
+    server.fail_once = {"FIHEL"}
+    formatted = []
+    poller = AsyncPoller([{"locode": "FIHEL"}, {"locode": "FITKU"}], url=url, retries=1, retry_backoff=0.01, formatter=formatted.append)
+    asyncio.run(poller.run(cycles=1))
+    assert sorted(entry["portCallId"] for entry in formatted[0]) == [1, 2, 3]
+
+    server.fail_once = {"FIHEL"}
+    formatted.clear()
+    poller = AsyncPoller([{"locode": "FIHEL"}, {"locode": "FITKU"}], url=url, retries=0, formatter=formatted.append)
+    asyncio.run(poller.run(cycles=1))
+    assert [entry["portCallId"] for entry in formatted[0]] == [3]
+
+def test_slow_formatting_does_not_block_fetching(fake_api):
+    """The next cycle is fetched while the previous one is still being formatted."""
+    url, server = fake_api
+    release = threading.Event()
+    formatted = []
+
+    def slow_formatter(port_calls):
+        release.wait(5)
+        formatted.append(port_calls)
+
+    async def scenario():
+        poller = AsyncPoller([{"locode": "FIHEL"}], url=url, interval=0.01, formatter=slow_formatter)
+        task = asyncio.create_task(poller.run(cycles=3))
+        while len(server.requests) < 3:
+            await asyncio.sleep(0.01)
+        assert not formatted  # All three cycles fetched, the first still formatting
+        release.set()
+        await task
+
+    asyncio.run(scenario())
+    assert len(formatted) == 3
+
+def diff_output(diff, port_calls, capsys, complete=True):
+    """Render a poll with a PortCallDiff and return the printed text."""
+    diff.render({"portCalls": port_calls}, complete)
+    return capsys.readouterr().out
+
+def test_diff_renders_only_changes(capsys):
+    """Only new, changed (with the changed fields) and removed port calls are printed."""
+    first = [
+        {"portCallId": 1, "vesselName": "Alpha", "portAreaDetails": [{"eta": "2025-01-01T10:00:00Z", "berthName": "B1"}]},
+        {"portCallId": 2, "vesselName": "Beta", "portAreaDetails": [{"eta": "2025-01-01T11:00:00Z"}]},
+        {"portCallId": 3, "vesselName": "Gamma"},
+    ]
+    diff = PortCallDiff(state_file="")
+    out = diff_output(diff, first, capsys)
+    assert out.count("Port Call ID:") == 3
+    assert "3 new, 0 changed, 0 removed" in out
+
+    second = [
+        {"portCallId": 1, "vesselName": "Alpha", "portCallTimestamp": "later",
+         "portAreaDetails": [{"eta": "2025-01-01T10:00:00Z", "ata": "2025-01-01T10:05:00Z", "berthName": "B2"}]},
+        {"portCallId": 2, "vesselName": "Beta", "portCallTimestamp": "later", "portAreaDetails": [{"eta": "2025-01-01T11:00:00Z"}]},
+    ]
+    out = diff_output(diff, second, capsys)
+    assert "Port Call ID: 1 changed" in out
+    assert "ata: N/A -> 2025-01-01T10:05:00Z" in out and "berthName: B1 -> B2" in out
+    assert "eta:" not in out and "Port Call ID: 2" not in out  # portCallTimestamp alone is not a change
+    assert "Port Call ID: 3 removed" in out
+    assert "0 new, 1 changed, 1 removed" in out
+
+    out = diff_output(diff, second[:1], capsys, complete=False)
+    assert "0 new, 0 changed, 0 removed" in out  # Port call 2 may be in a slice that failed
+
+def test_diff_state_survives_restart(tmp_path, capsys):
+    """With a state file the first poll after a restart prints only what changed meanwhile."""
+    state_file = str(tmp_path / "poller-state.json")
+    port_calls = [{"portCallId": 1, "vesselName": "Alpha"}, {"portCallId": 2, "vesselName": "Beta"}]
+    diff_output(PortCallDiff(state_file), port_calls, capsys)
+
+    port_calls[1] = {"portCallId": 2, "vesselName": "Beta", "portAreaDetails": [{"ata": "2025-01-01T12:00:00Z"}]}
+    out = diff_output(PortCallDiff(state_file), port_calls, capsys)
+    assert "0 new, 1 changed, 0 removed" in out
+
+def test_diff_poller_keeps_unchanged_slices(fake_api, capsys):
+    """A failed slice keeps its previous port calls, so they are not reported as removed."""
+    url, server = fake_api
+    diff = PortCallDiff(state_file="")
+    slices = [{"locode": "FIHEL"}, {"locode": "FITKU"}]
+    poller = AsyncPoller(slices, url=url, retries=0, interval=0.01, diff=diff)
+    asyncio.run(poller.run(cycles=1))
+    assert "3 new, 0 changed, 0 removed" in capsys.readouterr().out
+
+    server.fail_once = {"FIHEL"}
+    asyncio.run(poller.run(cycles=1))
+    assert "0 new, 0 changed, 0 removed" in capsys.readouterr().out
@@ -0,0 +1,140 @@
+import sys
+import os
+import threading
+import time
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_pool
+from config import DATABASE_CONFIG
+from portman_pool import ConnectionPool, PoolTimeout
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=()):
+        if not self.conn.alive:
+            raise ConnectionError("network error")
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if not self.alive:
+            raise ConnectionError("network error")
+
+    def close(self):
+        self.closed = True
+
+def test_checkout_reuses_warm_connection():
+    """Consecutive checkouts share one connection instead of reconnecting."""
+    opened = []
+    pool = ConnectionPool("test", min_size=1, max_size=2, connect=lambda: opened.append(FakeConnection()) or opened[-1])
+    pool.fill()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(opened) == 1
+
+def test_dead_connection_is_replaced_on_checkout():
+    """A connection that fails the liveness check is closed and replaced."""
+    opened = []
+    pool = ConnectionPool("test", min_size=1, max_size=1, connect=lambda: opened.append(FakeConnection()) or opened[-1])
+    with pool.connection() as conn:
+        pass
+    conn.alive = False
+    with pool.connection() as replacement:
+        assert replacement is not conn
+    assert conn.closed
+    assert pool.size == 1
+
+def test_reconnect_backs_off_exponentially(monkeypatch):
+    """Failed connection attempts are retried with doubling delays."""
+    delays = []
+    monkeypatch.setattr(portman_pool.time, "sleep", delays.append)
+    attempts = []
+
+    def flaky_connect():
+        attempts.append(1)
+        if len(attempts) < 4:
+            raise ConnectionRefusedError("database is restarting")
+        return FakeConnection()
+
+    pool = ConnectionPool("test", retries=5, backoff=0.5, connect=flaky_connect)
+    with pool.connection():
+        pass
+    assert delays == [0.5, 1.0, 2.0]
+
+    failing = ConnectionPool("test", retries=2, backoff=0.1, connect=lambda: (_ for _ in ()).throw(ConnectionRefusedError()))
+    with pytest.raises(ConnectionRefusedError):
+        failing.checkout()
+    assert failing.size == 0
+
+def test_checkout_waits_for_free_connection():
+    """With max_size connections in use, checkout waits and times out."""
+    pool = ConnectionPool("test", max_size=1, timeout=0.2, connect=FakeConnection)
+    conn = pool.checkout()
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+
+    threading.Timer(0.05, pool.checkin, (conn,)).start()
+    assert pool.checkout() is conn
+
+@pytest.fixture
+def postgres_pool():
+    """Pool against the local PostgreSQL from config.py, skipped when it is not reachable."""
+    pool = ConnectionPool(DATABASE_CONFIG["dbname"], min_size=1, max_size=2, retries=0)
+    try:
+        pool.fill()
+    except Exception as e:
+        pytest.skip(f"Local PostgreSQL not available: {e}")
+    yield pool
+    pool.close()
+
+def test_postgres_warm_checkout_is_faster_than_connect(postgres_pool):
+    """Checking out a warm connection costs less than opening a new one."""
+    start = time.perf_counter()
+    postgres_pool.connect_postgres().close()
+    connect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with postgres_pool.connection():
+        pass
+    checkout_time = time.perf_counter() - start
+    assert checkout_time < connect_time
+
+def test_postgres_terminated_backend_is_reconnected(postgres_pool):
+    """A connection killed on the server side is detected and replaced transparently."""
+    with postgres_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_backend_pid();")
+        pid = cursor.fetchone()[0]
+        conn.commit()
+
+    killer = postgres_pool.connect_postgres()
+    cursor = killer.cursor()
+    cursor.execute("SELECT pg_terminate_backend(%s);", (pid,))
+    killer.commit()
+    killer.close()
+    time.sleep(0.1)
+
+    with postgres_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_backend_pid();")
+        assert cursor.fetchone()[0] != pid
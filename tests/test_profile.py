@@ -0,0 +1,78 @@
+import sys
+import os
+import json
+import pstats
+import tracemalloc
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR
+from portman_agent import AgentDaemon, read_json_from_directory
+from portman_metrics import metrics
+from portman_profile import ProfileSession
+
+def functions(path):
+    """Names of the functions in a pstats file."""
+    return {name for _, _, name in pstats.Stats(path).stats}
+
+def test_session_writes_stage_reports(sqlite_db, tmp_path):
+    """A profiled ingest writes pstats, reports, collapsed stacks and a summary per stage, then uninstalls itself."""
+    session = ProfileSession(str(tmp_path)).start()
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+    directory = session.stop()
+
+    assert metrics.profiler is None and not tracemalloc.is_tracing()
+    with open(os.path.join(directory, "summary.json"), encoding="utf-8") as file:
+        summary = json.load(file)
+    for stage in ("load_staging", "merge", "commit"):
+        assert summary["stages"][stage]["runs"] > 0
+        assert os.path.exists(os.path.join(directory, f"{stage}.pstats"))
+    assert "build_voyage_upsert" in functions(os.path.join(directory, "merge.pstats"))
+    with open(os.path.join(directory, "merge.txt"), encoding="utf-8") as file:
+        assert "Top allocation sites" in file.read()
+    with open(os.path.join(directory, "stacks.collapsed"), encoding="utf-8") as file:
+        for line in file:
+            stack, count = line.rsplit(" ", 1)
+            assert stack.split(";")[0] in summary["stages"] and int(count) > 0
+
+def test_nested_stage_takes_over_the_profiler(tmp_path):
+    """Calls inside a nested stage are profiled in its own profile, not in the outer one."""
+    def outer_work():
+        return sum(range(1000))
+
+    def inner_work():
+        return sorted(range(1000))
+
+    session = ProfileSession(str(tmp_path)).start()
+    with metrics.stage("outer"):
+        outer_work()
+        with metrics.stage("inner"):
+            inner_work()
+        outer_work()
+    directory = session.stop()
+
+    assert "outer_work" in functions(os.path.join(directory, "outer.pstats"))
+    assert "inner_work" not in functions(os.path.join(directory, "outer.pstats"))
+    assert "inner_work" in functions(os.path.join(directory, "inner.pstats"))
+
+def test_profile_request_covers_the_next_poll_only(monkeypatch, tmp_path):
+    """After SIGUSR1 (request_profile) exactly the next daemon poll is profiled."""
+    def staged_poll(tracked_vessels, conn=None, cache=None, leases=None):
+        with metrics.stage("process"):
+            sum(range(1000))
+
+    monkeypatch.setattr(portman_agent, "poll", staged_poll)
+    monkeypatch.setitem(portman_agent.PROFILE_CONFIG, "directory", None)
+    monkeypatch.setitem(portman_agent.PROFILE_CONFIG, "signal_directory", str(tmp_path))
+    daemon = AgentDaemon(None, interval=60)
+
+    daemon.poll()
+    assert os.listdir(tmp_path) == []
+    daemon.request_profile()
+    daemon.poll()
+    daemon.poll()
+    profiles = os.listdir(tmp_path)
+    assert len(profiles) == 1 and profiles[0].endswith("-poll")
+    assert os.path.exists(os.path.join(tmp_path, profiles[0], "process.pstats"))
@@ -0,0 +1,39 @@
+import sys
+import os
+from datetime import datetime
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR
+from portman_agent import create_indexes, read_json_from_directory
+from portman_queries import ARRIVAL_QUERY_COLUMNS, ROUTE_COLUMNS, get_arrivals, get_port_call_arrivals, get_vessel_route
+
+def query_plan(conn, query, params):
+    """Return the sqlite query plan details as one string."""
+    return " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+
+def test_queries_use_indexes(sqlite_db):
+    """The read-path queries return the expected rows and are answered from the indexes."""
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+    create_indexes(sqlite_db.cursor())
+
+    imo = 9606900
+    route = get_vessel_route(imo, sqlite_db)
+    expected = sqlite_db.execute(
+        f"SELECT {', '.join(ROUTE_COLUMNS)} FROM voyages WHERE imoLloyds = ? ORDER BY ata, atd", (imo,)
+    ).fetchall()
+    assert route == expected and route
+    assert "voyages_imo_route_idx" in query_plan(sqlite_db, "SELECT * FROM voyages WHERE imoLloyds = ? ORDER BY ata, atd", (imo,))
+
+    arrivals = get_arrivals(conn=sqlite_db)
+    assert arrivals and all(len(row) == len(ARRIVAL_QUERY_COLUMNS) for row in arrivals)
+    port, ata = arrivals[-1][3], arrivals[-1][-1]
+    since = datetime.strptime(ata[:16], "%Y-%m-%dT%H:%M")
+    recent = get_arrivals(port, since, conn=sqlite_db)
+    assert recent and all(row[3] == port and row[-1] >= ata[:16] for row in recent)
+    assert "arrivals_ata_idx" in query_plan(sqlite_db, "SELECT * FROM arrivals WHERE ata >= ? ORDER BY ata", (ata,))
+
+    history = get_port_call_arrivals(arrivals[0][0], sqlite_db)
+    assert sorted(row[2] for row in history) == sorted(row[-1] for row in arrivals if row[0] == arrivals[0][0])
+    assert "arrivals_portcallid_idx" in query_plan(sqlite_db, "SELECT * FROM arrivals WHERE portCallId = ?", (1,))
@@ -0,0 +1,149 @@
+import sys
+import os
+import threading
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import process_json_file, save_results_to_db, save_spooled_batches
+from portman_batch import RESULT_FIELDS, PortCallBatch
+from portman_spool import RECORD_HEADER, Spool, SpoolWriter, UnwritableBatches, decode_batch
+
+def snapshot_batches():
+    """Processed PortCallBatches of the test snapshots, in file order."""
+    names = sorted(name for name in os.listdir(DATA_DIR) if name.startswith("portnet") and name.endswith(".json"))
+    return [process_json_file(os.path.join(DATA_DIR, name), None) for name in names]
+
+def small_batch(port_call_id):
+    """Batch with one port call of vessel 1."""
+    return PortCallBatch.from_rows([(port_call_id, None, 1) + (None,) * (len(RESULT_FIELDS) - 3)])
+
+class FlakySave:
+    """Save function that fails while `down` is set, rejects the port calls in `unwritable` and records the batches it saved."""
+
+    def __init__(self, down=False, unwritable=()):
+        self.down = down
+        self.unwritable = set(unwritable)
+        self.calls = []
+        self.saved = []
+        self.called = threading.Event()
+
+    def __call__(self, batches):
+        self.calls.append(len(batches))
+        self.called.set()
+        if self.down:
+            return False
+        if any(batch.column("portCallId")[0] in self.unwritable for batch in batches):
+            raise UnwritableBatches("constraint violated")
+        self.saved.extend(batch.column("portCallId")[0] for batch in batches)
+        return True
+
+def test_spool_round_trip_and_rotation(tmp_path):
+    """Records come back in order across rotated segments, acknowledged segments are deleted."""
+    spool = Spool(str(tmp_path), segment_bytes=200, fsync=False)
+    positions = [spool.append(small_batch(port_call_id)) for port_call_id in range(10)]
+    assert len(spool.segments()) > 1
+    records = spool.read()
+    assert [batch.column("portCallId")[0] for _, _, batch in records] == list(range(10))
+    assert [(start, end) for start, end, _ in records] == positions
+
+    spool.ack(positions[6][1])
+    assert spool.segments()[0] == positions[6][1][0]
+    assert [batch.column("portCallId")[0] for _, _, batch in spool.read()] == [7, 8, 9]
+    spool.close()
+
+def test_spool_truncates_torn_tail(tmp_path):
+    """A partially written record at the end of the spool is dropped on reopen."""
+    spool = Spool(str(tmp_path), fsync=False)
+    spool.append(small_batch(1))
+    _, end = spool.append(small_batch(2))
+    spool.close()
+    path = spool.segment_path(end[0])
+    with open(path, "r+b") as file:
+        file.truncate(end[1] - 3)
+
+    spool = Spool(str(tmp_path), fsync=False)
+    assert [batch.column("portCallId")[0] for _, _, batch in spool.read()] == [1]
+    assert os.path.getsize(path) < end[1] - 3
+    spool.append(small_batch(3))
+    assert [batch.column("portCallId")[0] for _, _, batch in spool.read()] == [1, 3]
+    spool.close()
+
+def test_writer_retries_while_database_is_down(tmp_path):
+    """Batches stay spooled while saving fails and are flushed in bulk once it succeeds."""
+    save = FlakySave(down=True)
+    writer = SpoolWriter(Spool(str(tmp_path), fsync=False), save, retry_interval=0.05)
+    for port_call_id in range(5):
+        writer.put(small_batch(port_call_id))
+    assert save.called.wait(5)
+    assert not writer.flush(0.2)
+
+    save.down = False
+    assert writer.flush(5)
+    assert save.saved == list(range(5))
+    assert max(save.calls) > 1  # Outage backlog written in one call
+    assert writer.spool.read() == []
+    writer.close(5)
+
+def test_writer_moves_unwritable_batch_aside(tmp_path):
+    """A batch that cannot be written is moved to the rejected directory and the batches after it are written."""
+    save = FlakySave(down=True, unwritable={2})
+    writer = SpoolWriter(Spool(str(tmp_path), fsync=False), save, retry_interval=0.05)
+    for port_call_id in range(5):
+        writer.put(small_batch(port_call_id))
+    assert save.called.wait(5)
+
+    save.down = False
+    assert writer.flush(5)
+    assert save.saved == [0, 1, 3, 4]
+    assert writer.spool.read() == []
+    rejected = os.listdir(tmp_path / "rejected")
+    assert len(rejected) == 2  # The record and the reason
+    record = next(name for name in rejected if name.endswith(".log"))
+    with open(tmp_path / "rejected" / record, "rb") as file:
+        length, _ = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+        assert decode_batch(file.read(length)).column("portCallId")[0] == 2
+    writer.close(5)
+
+def test_save_spooled_batches_raises_for_schema_errors(sqlite_db):
+    """Errors other than lost connections and locks are not retried."""
+    sqlite_db.execute("DROP TABLE arrivals;")
+    sqlite_db.commit()
+    with pytest.raises(UnwritableBatches):
+        save_spooled_batches(snapshot_batches(), sqlite_db)
+
+def test_unwritten_batches_survive_restart(tmp_path):
+    """Batches that were not saved before close are written by the next writer."""
+    writer = SpoolWriter(Spool(str(tmp_path), fsync=False), FlakySave(down=True), retry_interval=60)
+    writer.put(small_batch(1))
+    writer.put(small_batch(2))
+    writer.close(0.2)
+
+    save = FlakySave()
+    writer = SpoolWriter(Spool(str(tmp_path), fsync=False), save, queue_size=1)
+    writer.put(small_batch(3))
+    writer.put(small_batch(4))  # Overflows the queue, read back from the spool
+    assert writer.flush(5)
+    assert save.saved == [1, 2, 3, 4]
+    writer.close(5)
+
+def test_spooled_batches_match_per_snapshot_saves(tmp_path, sqlite_db, monkeypatch):
+    """Saving spooled snapshots in one go gives the voyages and arrivals of saving each snapshot."""
+    monkeypatch.setattr(portman_agent, "get_sink", lambda: type("Sink", (), {"publish": lambda self, event: None})())
+    batches = snapshot_batches()
+    for batch in batches:
+        save_results_to_db(batch, sqlite_db)
+
+    spool = Spool(str(tmp_path), fsync=False)
+    for batch in batches:
+        spool.append(batch)
+    spooled_db = sqlite_connection()
+    assert save_spooled_batches([batch for _, _, batch in spool.read()], spooled_db)
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(spooled_db) == (voyages, arrivals)
+    spool.close()
+    spooled_db.close()
@@ -0,0 +1,62 @@
+import sys
+import os
+import subprocess
+from datetime import date, timedelta
+import pg8000
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from config import DATABASE_CONFIG, PARTITION_CONFIG
+from portman_agent import SCHEMA_VERSION, create_tables, schema_is_current
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../"))
+SCHEMA = "portman_startup_test"
+
+def test_import_loads_no_client_libraries():
+    """Importing the agent leaves the HTTP, PostgreSQL and scheduling libraries unloaded."""
+    heavy = ["requests", "pg8000", "natsort", "schedule", "sqlite3", "http.server"]
+    output = subprocess.run(
+        [sys.executable, "-c", f"import sys, portman_agent; print([name for name in {heavy!r} if name in sys.modules])"],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    assert output.strip() == "[]"
+
+@pytest.fixture
+def scratch_cursor():
+    """Cursor on an empty scratch schema of the local PostgreSQL, skipped when it is not reachable."""
+    try:
+        conn = pg8000.connect(database=DATABASE_CONFIG["dbname"], user=DATABASE_CONFIG["user"], password=DATABASE_CONFIG["password"],
+                              host=DATABASE_CONFIG["host"], port=DATABASE_CONFIG["port"])
+    except Exception as e:
+        pytest.skip(f"Local PostgreSQL not available: {e}")
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA};")
+    yield cursor
+    conn.rollback()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    conn.commit()
+    conn.close()
+
+def test_schema_version_is_recorded(scratch_cursor):
+    """create_tables records SCHEMA_VERSION; an older version or a missing table means setup must run."""
+    assert not schema_is_current(scratch_cursor)
+    create_tables(scratch_cursor)
+    assert schema_is_current(scratch_cursor)
+
+    scratch_cursor.execute("UPDATE portman_schema SET version = %s;", (SCHEMA_VERSION - 1,))
+    assert not schema_is_current(scratch_cursor)
+
+def test_partition_maintenance_reruns_setup_daily(scratch_cursor, monkeypatch):
+    """With partitioning enabled, the schema only counts as current on the day partitions were maintained."""
+    create_tables(scratch_cursor)
+    monkeypatch.setitem(PARTITION_CONFIG, "enabled", True)
+    assert not schema_is_current(scratch_cursor)
+
+    scratch_cursor.execute("UPDATE portman_schema SET maintained = %s;", (date.today() - timedelta(days=1),))
+    assert not schema_is_current(scratch_cursor)
+    scratch_cursor.execute("UPDATE portman_schema SET maintained = %s;", (date.today(),))
+    assert schema_is_current(scratch_cursor)
@@ -0,0 +1,46 @@
+import sys
+import os
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import VoyageStateCache, process_query, read_json_from_directory, read_json_from_file, save_results_to_db
+
+def test_cached_replay_matches_uncached(sqlite_db):
+    """Replaying the snapshots with the state cache gives the same voyages and arrivals."""
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+
+    cached_db = sqlite_connection()
+    read_json_from_directory(DATA_DIR, None, cached_db, cache=VoyageStateCache())
+
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(cached_db) == (voyages, arrivals)
+    cached_db.close()
+
+def test_unchanged_voyages_are_not_rewritten(sqlite_db):
+    """A second save of the same snapshot writes nothing, also after a warm-up from the table."""
+    results = process_query(read_json_from_file(os.path.join(DATA_DIR, "portnet-20250101000032.json")), None)
+    cache = VoyageStateCache(retention_days=100000)
+    save_results_to_db(results, sqlite_db, cache=cache)
+
+    changes = sqlite_db.total_changes
+    save_results_to_db(results, sqlite_db, cache=cache)
+    assert sqlite_db.total_changes == changes
+
+    warmed = VoyageStateCache(retention_days=100000)
+    save_results_to_db(results, sqlite_db, cache=warmed)
+    assert warmed.warmed
+    assert sqlite_db.total_changes == changes
+
+def test_evicted_port_call_uses_database_ata(sqlite_db):
+    """An evicted port call is looked up again so its unchanged ata is not a new arrival."""
+    results = process_query(read_json_from_file(os.path.join(DATA_DIR, "portnet-20250101000032.json")), None)
+    cache = VoyageStateCache(retention_days=0)
+    save_results_to_db(results, sqlite_db, cache=cache)
+    assert len(cache.states) < len(results)
+
+    _, arrivals = table_contents(sqlite_db)
+    save_results_to_db(results, sqlite_db, cache=cache)
+    assert table_contents(sqlite_db)[1] == arrivals
@@ -0,0 +1,99 @@
+import sys
+import os
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+import portman_agent
+from config import DATABASE_CONFIG, SQLITE_CONFIG
+from conftest import DATA_DIR, table_contents
+from portman_agent import create_database_and_tables, read_json_from_directory, resolve_write_strategy
+from portman_storage import connect_sqlite, create_arrivals_unique_index, create_tables, is_transient_error, schema_is_current, using_sqlite
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """Select the SQLite backend with a database file in tmp_path and a fresh pool."""
+    path = str(tmp_path / "portman.db")
+    monkeypatch.setitem(DATABASE_CONFIG, "backend", "sqlite")
+    monkeypatch.setitem(SQLITE_CONFIG, "path", path)
+    monkeypatch.setattr(portman_agent, "pool", None)
+    yield path
+    portman_agent.get_pool().close()
+
+def test_sqlite_connection_settings(tmp_path):
+    """Connections use WAL, synchronous=NORMAL and an in-memory temp store."""
+    conn = connect_sqlite(str(tmp_path / "settings.db"))
+    assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous;").fetchone()[0] == 1
+    assert conn.execute("PRAGMA temp_store;").fetchone()[0] == 2
+    assert resolve_write_strategy(conn) == "executemany"
+    conn.close()
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setitem(DATABASE_CONFIG, "backend", "oracle")
+    with pytest.raises(ValueError):
+        using_sqlite()
+
+def test_sqlite_backend_setup_and_ingest(sqlite_backend, sqlite_db):
+    """The agent creates the SQLite schema once and ingests through pooled connections like the in-memory path."""
+    create_database_and_tables()
+    conn = connect_sqlite(sqlite_backend)
+    assert schema_is_current(conn.cursor(), sqlite=True)
+    create_database_and_tables()  # Schema is current, nothing to do
+
+    read_json_from_directory(DATA_DIR, None)
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+    voyages, arrivals = table_contents(sqlite_db)
+    assert arrivals, "Expected arrivals in the test snapshots"
+    assert table_contents(conn) == (voyages, arrivals)
+    conn.close()
+
+def test_readers_do_not_wait_for_writers(sqlite_backend):
+    """In WAL mode a reader sees the last committed state while a write transaction is open."""
+    create_database_and_tables()
+    writer = connect_sqlite(sqlite_backend)
+    reader = connect_sqlite(sqlite_backend)
+    writer.execute("INSERT INTO voyages (portCallId) VALUES (1);")
+    assert writer.in_transaction
+    assert reader.execute("SELECT count(*) FROM voyages;").fetchone()[0] == 0
+    writer.commit()
+    assert reader.execute("SELECT count(*) FROM voyages;").fetchone()[0] == 1
+    writer.close()
+    reader.close()
+
+def test_cluster_index_removes_duplicate_arrivals(sqlite_db):
+    """Creating the cluster mode index keeps the first of duplicate arrivals, after which duplicates are ignored."""
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+    _, arrivals = table_contents(sqlite_db)
+    sqlite_db.execute("INSERT INTO arrivals (portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName) "
+                      "SELECT portCallId, eta, old_ata, ata, vesselName, portAreaName, berthName FROM arrivals;")
+    sqlite_db.commit()
+
+    create_tables(sqlite_db.cursor(), sqlite=True)  # Setup without cluster mode leaves arrivals alone
+    assert len(table_contents(sqlite_db)[1]) == 2 * len(arrivals)
+    assert create_arrivals_unique_index(sqlite_db.cursor(), sqlite=True) == len(arrivals)
+    sqlite_db.commit()
+    assert table_contents(sqlite_db)[1] == arrivals
+    assert create_arrivals_unique_index(sqlite_db.cursor(), sqlite=True) == 0
+
+    sqlite_db.execute("UPDATE voyages SET ata = NULL;")  # A stale view detects every arrival again
+    sqlite_db.commit()
+    read_json_from_directory(DATA_DIR, None, sqlite_db)
+    assert table_contents(sqlite_db)[1] == arrivals
+
+def test_transient_errors():
+    """Lost connections, locks and deadlocks are transient; schema, constraint and data errors are not."""
+    import sqlite3
+    import pg8000.dbapi
+    import pg8000.exceptions
+    assert is_transient_error(pg8000.exceptions.InterfaceError("network error"))
+    assert is_transient_error(ConnectionResetError())
+    assert is_transient_error(pg8000.dbapi.ProgrammingError({"C": "40P01", "M": "deadlock detected"}))
+    assert is_transient_error(pg8000.dbapi.ProgrammingError({"C": "57P01", "M": "terminating connection"}))
+    assert not is_transient_error(pg8000.dbapi.ProgrammingError({"C": "23505", "M": "duplicate key"}))
+    assert not is_transient_error(pg8000.dbapi.ProgrammingError({"C": "42P01", "M": "relation does not exist"}))
+    assert is_transient_error(sqlite3.OperationalError("database is locked"))
+    assert not is_transient_error(sqlite3.OperationalError("no such table: arrivals"))
+    assert not is_transient_error(sqlite3.IntegrityError("UNIQUE constraint failed"))
+    assert not is_transient_error(sqlite3.InterfaceError("bad parameter"))
@@ -0,0 +1,36 @@
+import sys
+import os
+import io
+import json
+import glob
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from conftest import DATA_DIR
+from portman_stream import JsonArrayStream, iter_port_calls
+
+@pytest.mark.parametrize("filepath", sorted(glob.glob(os.path.join(DATA_DIR, "portnet*.json"))))
+def test_streamed_port_calls_match_json_load(filepath):
+    """Streaming yields exactly the portCalls entries json.load sees."""
+    with open(filepath, "r", encoding="utf-8") as file:
+        expected = json.load(file)["portCalls"]
+    assert list(iter_port_calls(filepath)) == expected
+
+@pytest.mark.parametrize("document, expected", [
+    ('{"dataUpdatedTime": "x", "portCalls": [{"a": 1}, 2, "ä", [3], null]}', [{"a": 1}, 2, "ä", [3], None]),
+    ('[{"portCallId": 12345}, {"portCallId": 67890}]', [{"portCallId": 12345}, {"portCallId": 67890}]),
+    ('{"portCalls": []}', []),
+    ('{"other": [1, 2]}', []),
+])
+def test_small_chunks_and_document_shapes(document, expected):
+    """Elements split across tiny read chunks decode correctly, also for a top-level array."""
+    stream = JsonArrayStream(io.StringIO(document), chunk_size=3)
+    assert [value for value, _, _ in stream.elements()] == expected
+
+def test_offsets_point_at_elements():
+    """Reported offsets delimit each element in the source text."""
+    document = '{"portCalls" : [ {"portCallId": 1} ,{"portCallId": 22}]}'
+    for value, start, end in JsonArrayStream(io.StringIO(document), chunk_size=4).elements():
+        assert json.loads(document[start:end]) == value
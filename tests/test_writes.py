@@ -0,0 +1,131 @@
+import sys
+import os
+import glob
+import json
+import re
+from datetime import datetime
+import pg8000
+import pytest
+
+# Ensure src is in the Python module search path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+
+from config import DATABASE_CONFIG
+from conftest import DATA_DIR, sqlite_connection, table_contents
+from portman_agent import create_tables, process_query, save_results_to_db
+from portman_batch import FIELD_INDEX, PortCallBatch
+
+SCHEMAS = ("portman_writes_test", "portman_writes_test_reference")
+SMALL_BATCH = 7  # Far fewer rows than a snapshot, so every strategy writes in several chunks
+TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+
+def load_batches():
+    """Processed PortCallBatches of the test snapshots, in file order."""
+    batches = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "portnet*.json"))):
+        with open(path, "r", encoding="utf-8") as file:
+            batches.append(process_query(json.load(file), None))
+    return batches
+
+def ingest(conn, strategy=None, batch_size=None):
+    """Save the test snapshots one by one, return the table contents."""
+    for batch in load_batches():
+        assert save_results_to_db(batch, conn, strategy=strategy, batch_size=batch_size)
+    return table_contents(conn)
+
+def comparable(contents):
+    """Table contents with PostgreSQL datetimes and sqlite ISO-8601 strings both as 'YYYY-MM-DDTHH:MM:SS'."""
+    def value(item):
+        if isinstance(item, datetime):
+            return item.strftime("%Y-%m-%dT%H:%M:%S")
+        if isinstance(item, str) and TIMESTAMP.match(item):
+            return item[:19]
+        return item
+    return tuple([tuple(value(item) for item in row) for row in rows] for rows in contents)
+
+def ata_changes():
+    """Snapshots of one port call whose ata is set, changes by seconds only, stays and changes by minutes."""
+    base = load_batches()[0][0]
+
+    def snapshot(ata):
+        row = list(base.values())
+        row[FIELD_INDEX["portCallId"]] = 1
+        row[FIELD_INDEX["ata"]] = ata
+        return PortCallBatch.from_rows([tuple(row)])
+
+    return [snapshot(ata) for ata in (
+        "2025-01-01T01:00:10.000Z", "2025-01-01T01:00:50.000Z", "2025-01-01T01:00:50.000Z", "2025-01-01T01:05:00.000Z"
+    )]
+
+@pytest.fixture
+def postgres():
+    """Function returning a connection to an empty scratch schema of the local PostgreSQL, skipped when it is not reachable."""
+    def connect():
+        return pg8000.connect(database=DATABASE_CONFIG["dbname"], user=DATABASE_CONFIG["user"], password=DATABASE_CONFIG["password"],
+                              host=DATABASE_CONFIG["host"], port=DATABASE_CONFIG["port"])
+
+    try:
+        admin = connect()
+    except Exception as e:
+        pytest.skip(f"Local PostgreSQL not available: {e}")
+    opened = []
+
+    def open_schema(index=0):
+        cursor = admin.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMAS[index]} CASCADE;")
+        cursor.execute(f"CREATE SCHEMA {SCHEMAS[index]};")
+        admin.commit()
+        conn = connect()
+        opened.append(conn)
+        cursor = conn.cursor()
+        cursor.execute(f"SET search_path TO {SCHEMAS[index]};")
+        create_tables(cursor)
+        conn.commit()
+        return conn
+
+    yield open_schema
+    for conn in opened:
+        conn.close()
+    cursor = admin.cursor()
+    for schema in SCHEMAS:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+    admin.commit()
+    admin.close()
+
+@pytest.mark.parametrize("strategy", ["row", "executemany", "values"])
+def test_sqlite_write_strategies(strategy):
+    """Every strategy, in small batches, writes the voyages and arrivals of the default one on sqlite."""
+    reference, conn = sqlite_connection(), sqlite_connection()
+    expected = ingest(reference)
+    assert expected[1], "Expected arrivals in the test snapshots"
+    assert ingest(conn, strategy, SMALL_BATCH) == expected
+    reference.close()
+    conn.close()
+
+@pytest.mark.parametrize("strategy", ["copy", "values", "executemany", "row"])
+def test_postgres_write_strategies(postgres, strategy):
+    """Every strategy, in small batches, writes the voyages and arrivals of the default one on PostgreSQL."""
+    expected = ingest(postgres(1))
+    assert expected[1], "Expected arrivals in the test snapshots"
+    assert ingest(postgres(0), strategy, SMALL_BATCH) == expected
+
+def test_postgres_and_sqlite_merges_agree(postgres):
+    """The PostgreSQL and sqlite merges write the same voyages and detect the same minute-level arrivals."""
+    sqlite_db = sqlite_connection()
+    expected = comparable(ingest(sqlite_db))
+    assert expected[1], "Expected arrivals in the test snapshots"
+    assert comparable(ingest(postgres())) == expected
+    sqlite_db.close()
+
+def test_seconds_only_ata_change_is_no_arrival(postgres):
+    """Only the first ata and the change by minutes are arrivals, on both backends."""
+    sqlite_db, postgres_db = sqlite_connection(), postgres()
+    for batch in ata_changes():
+        assert save_results_to_db(batch, sqlite_db)
+        assert save_results_to_db(batch, postgres_db)
+    _, arrivals = comparable(table_contents(sqlite_db))
+    assert [(old_ata, ata) for _, _, old_ata, ata, *_ in arrivals] == [
+        (None, "2025-01-01T01:00:00"), ("2025-01-01T01:00:00", "2025-01-01T01:05:00")
+    ]
+    assert comparable(table_contents(postgres_db)) == comparable(table_contents(sqlite_db))
+    sqlite_db.close()